@@ -2,14 +2,21 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from config import Config
+from app.replica import configurar_motores, SesionEnrutada
+from app.metricas import configurar_metricas
 
 app = Flask(__name__)
 app.config.from_object(Config)
-db = SQLAlchemy(app)
+#Bind 'replica' y pool de cada base según la configuración (ver app/replica.py).
+configurar_motores(app.config)
+#Métricas de /metrics y pool que mide la espera de conexiones (ver app/metricas.py).
+configurar_metricas(app.config)
+db = SQLAlchemy(app, session_options={'class_': SesionEnrutada})
 login_manager = LoginManager(app)
 @login_manager.user_loader
 def load_user(user_id):
-    from app.models import Usuario
-    return Usuario.query.get(str(user_id))
+    #Identidad cacheada por unos segundos: evita una consulta a la base en cada petición.
+    from app.identidad import cargar_identidad
+    return cargar_identidad(str(user_id))
 
 from app import routes, models
@@ -0,0 +1,129 @@
+import os
+import json
+import hashlib
+import tempfile
+from app import app
+from app.utils import escribir_atomico
+from app.metricas import registrar_cache
+
+#Cache de PDF generados, direccionada por contenido: el nombre del archivo es el hash de los datos
+#del reporte (sin la fecha de generación), así dos pedidos con los mismos datos reutilizan los bytes.
+#Se desactiva con PDF_CACHE = False. El hash también se usa como ETag de la descarga.
+
+MAX_BYTES_DEFECTO = 512 * 1024 * 1024
+
+_version_template = None
+
+
+def _huella_template():
+    """Hash del template del PDF: si cambia el diseño, los PDF guardados dejan de coincidir."""
+    global _version_template
+    if _version_template is None:
+        fuente, _, _ = app.jinja_env.loader.get_source(app.jinja_env, 'pdf_template.html')
+        _version_template = hashlib.sha256(fuente.encode('utf-8')).hexdigest()
+    return _version_template
+
+
+def _serializar(datos):
+    return json.dumps(datos, sort_keys=True, default=str, separators=(',', ':')).encode('utf-8')
+
+
+def huella_reporte(contexto):
+    """Hash de los datos con los que se renderiza el PDF (sin fecha_generacion)."""
+    return hashlib.sha256(_serializar([_huella_template(), contexto])).hexdigest()
+
+
+def nueva_huella(encabezado):
+    """Hash incremental para el PDF por lotes: se crea con los datos del encabezado y
+       se le agregan los registros con agregar_a_huella a medida que se recorren."""
+    huella = hashlib.sha256(b'lotes')
+    huella.update(_serializar([_huella_template(), encabezado]))
+    return huella
+
+
+def agregar_a_huella(huella, datos):
+    huella.update(_serializar(datos))
+
+
+def directorio_pdf():
+    """Directorio de la cache (también se usa para armar los PDF por lotes, así se mueven con os.replace)."""
+    directorio = app.config.get('PDF_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'marcaciones_pdf_cache'))
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def leer_pdf(huella):
+    """Retorna los bytes del PDF guardado con esa huella (None si no está o la cache está desactivada)."""
+    if not app.config.get('PDF_CACHE', True):
+        return None
+    ruta = os.path.join(directorio_pdf(), f'{huella}.pdf')
+    try:
+        with open(ruta, 'rb') as archivo:
+            pdf_bytes = archivo.read()
+    except FileNotFoundError:
+        registrar_cache('pdf', False)
+        return None
+    registrar_cache('pdf', True)
+    #Actualizamos el mtime para que el recorte borre primero los menos usados.
+    os.utime(ruta)
+    return pdf_bytes
+
+
+def abrir_pdf(huella):
+    """Retorna el PDF guardado con esa huella como archivo abierto (None si no está)."""
+    if not app.config.get('PDF_CACHE', True):
+        return None
+    ruta = os.path.join(directorio_pdf(), f'{huella}.pdf')
+    try:
+        archivo = open(ruta, 'rb')
+    except FileNotFoundError:
+        registrar_cache('pdf', False)
+        return None
+    registrar_cache('pdf', True)
+    os.utime(ruta)
+    return archivo
+
+
+def guardar_pdf(huella, pdf_bytes):
+    """Guarda el PDF y recorta la cache si supera PDF_CACHE_MAX_BYTES (los menos usados primero)."""
+    if not app.config.get('PDF_CACHE', True):
+        return
+    directorio = directorio_pdf()
+    escribir_atomico(os.path.join(directorio, f'{huella}.pdf'), pdf_bytes)
+    _recortar(directorio)
+
+
+def guardar_archivo_pdf(huella, ruta):
+    """Mueve a la cache un PDF ya escrito en directorio_pdf(). Retorna la ruta final
+       (la misma ruta si la cache está desactivada)."""
+    if not app.config.get('PDF_CACHE', True):
+        return ruta
+    directorio = directorio_pdf()
+    destino = os.path.join(directorio, f'{huella}.pdf')
+    os.replace(ruta, destino)
+    _recortar(directorio)
+    return destino
+
+
+def _recortar(directorio):
+    archivos = []
+    for nombre in os.listdir(directorio):
+        if not nombre.endswith('.pdf'):
+            continue
+        ruta = os.path.join(directorio, nombre)
+        try:
+            estado = os.stat(ruta)
+        except FileNotFoundError:
+            continue
+        archivos.append((estado.st_mtime, estado.st_size, ruta))
+
+    total = sum(tamano for _, tamano, _ in archivos)
+    limite = app.config.get('PDF_CACHE_MAX_BYTES', MAX_BYTES_DEFECTO)
+    for _, tamano, ruta in sorted(archivos):
+        if total <= limite:
+            break
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+        total -= tamano
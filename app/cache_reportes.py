@@ -0,0 +1,264 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from app import app
+from app.replica import retraso_lectura
+from app.metricas import registrar_cache
+from app.utils import directorio_privado
+
+#Cache de reportes ya procesados, por (fecha_desde, fecha_hasta, cedula).
+#Se configura con CACHE_REPORTES: None (desactivada), 'memoria' o 'disco'.
+# - 'memoria': LRU dentro de cada proceso. Con varios workers de Gunicorn la invalidación solo llega
+#   al worker que recibió el formulario, así que es para un solo worker.
+# - 'disco': archivos en CACHE_REPORTES_DIR compartidos por todos los workers, con una LRU en memoria
+#   por delante para no leer el archivo en cada acierto. CACHE_REPORTES_DIR es obligatorio (no hay uno por
+#   defecto dentro de /tmp): tiene que ser un directorio del usuario del servicio sin escritura para nadie más.
+#   Los reportes se guardan en JSON (son listas y diccionarios de strings y números), no con pickle.
+
+TTL_DEFECTO = 300
+MAX_ENTRADAS_DEFECTO = 32
+MAX_BYTES_DEFECTO = 256 * 1024 * 1024
+
+
+def llave_reporte(fecha_desde, fecha_hasta, cedula=None):
+    """Llave del reporte en la cache (las fechas en ISO se comparan bien como strings)."""
+    return (fecha_desde.isoformat(), fecha_hasta.isoformat(), cedula or '')
+
+
+def _cubre(llave, fecha):
+    """Indica si el rango de la llave incluye la fecha (string ISO)."""
+    return llave[0] <= fecha <= llave[1]
+
+
+class CacheMemoria:
+    """LRU en memoria con vencimiento por TTL y cantidad máxima de entradas."""
+
+    def __init__(self, ttl=TTL_DEFECTO, max_entradas=MAX_ENTRADAS_DEFECTO):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        #Fecha invalidada -> momento de la invalidación (para no guardar un cálculo que quedó viejo).
+        self._invalidaciones = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, llave):
+        """Retorna el valor guardado o None si no existe o ya venció."""
+        with self._lock:
+            entrada = self._entradas.get(llave)
+            if entrada is None:
+                return None
+            calculado, valor = entrada
+            if time.time() - calculado > self.ttl:
+                del self._entradas[llave]
+                return None
+            self._entradas.move_to_end(llave)
+            return valor
+
+    def guardar(self, llave, valor, calculado):
+        """Guarda el valor calculado a partir del momento calculado (inicio del cálculo).
+           No lo guarda si alguna fecha del rango se invalidó mientras se calculaba."""
+        with self._lock:
+            if any(_cubre(llave, fecha) and momento >= calculado for fecha, momento in self._invalidaciones.items()):
+                return
+            self._entradas[llave] = (calculado, valor)
+            self._entradas.move_to_end(llave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def invalidar_fecha(self, fecha):
+        """Elimina los reportes cuyo rango incluye la fecha."""
+        ahora = time.time()
+        with self._lock:
+            for llave in [llave for llave in self._entradas if _cubre(llave, fecha)]:
+                del self._entradas[llave]
+            self._invalidaciones[fecha] = ahora
+            #Una invalidación más vieja que el TTL ya no afecta a ningún cálculo que se pueda guardar.
+            self._invalidaciones = {f: m for f, m in self._invalidaciones.items() if ahora - m <= self.ttl}
+
+
+class CacheDisco:
+    """Cache en archivos compartida por los workers. Cada reporte (tupla registros, resumen) es un archivo JSON
+       {fecha_desde}_{fecha_hasta}_{hash}.json cuyo mtime es el momento del cálculo, así la invalidación
+       y el vencimiento se resuelven con el nombre y el stat, sin abrir los archivos."""
+
+    def __init__(self, directorio, ttl=TTL_DEFECTO, max_bytes=MAX_BYTES_DEFECTO, max_entradas=MAX_ENTRADAS_DEFECTO):
+        self.directorio = directorio
+        self.directorio_invalidaciones = os.path.join(directorio, 'invalidaciones')
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        directorio_privado(directorio)
+        directorio_privado(self.directorio_invalidaciones)
+        #Primer nivel en memoria: guarda (mtime del archivo, valor) para no deserializar en cada acierto.
+        self._memoria = CacheMemoria(ttl, max_entradas)
+
+    def _ruta(self, llave):
+        resumen = hashlib.sha1('|'.join(llave).encode('utf-8')).hexdigest()
+        return os.path.join(self.directorio, f'{llave[0]}_{llave[1]}_{resumen}.json')
+
+    def obtener(self, llave):
+        """Retorna el valor guardado o None si no existe, venció o fue invalidado por otro worker."""
+        ruta = self._ruta(llave)
+        try:
+            modificado = os.stat(ruta).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if time.time() - modificado / 1e9 > self.ttl:
+            self._eliminar(ruta)
+            return None
+
+        en_memoria = self._memoria.obtener(llave)
+        if en_memoria is not None and en_memoria[0] == modificado:
+            return en_memoria[1]
+
+        try:
+            with open(ruta, encoding='utf-8') as archivo:
+                valor = tuple(json.load(archivo))
+        except (OSError, ValueError, TypeError):
+            return None
+        self._memoria.guardar(llave, (modificado, valor), modificado / 1e9)
+        return valor
+
+    def guardar(self, llave, valor, calculado):
+        """Escribe el archivo de forma atómica (os.replace) con mtime = inicio del cálculo."""
+        ruta = self._ruta(llave)
+        descriptor, temporal = tempfile.mkstemp(dir=self.directorio, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w', encoding='utf-8') as archivo:
+                json.dump(valor, archivo, ensure_ascii=False, separators=(',', ':'))
+            os.utime(temporal, (calculado, calculado))
+            os.replace(temporal, ruta)
+        except (OSError, TypeError, ValueError) as error:
+            #TypeError/ValueError: el valor tiene algo que no es JSON; el reporte se sirve igual, sin cache.
+            app.logger.warning(f'No se pudo guardar el reporte en la cache: {error}')
+            self._eliminar(temporal)
+            return
+
+        #Se revisa después de escribir: si otro worker invalidó una fecha del rango mientras calculábamos,
+        #o él ve nuestro archivo y lo borra, o nosotros vemos su marca y lo borramos.
+        if self._invalidado_desde(llave, calculado):
+            self._eliminar(ruta)
+            return
+        self._recortar()
+
+    def invalidar_fecha(self, fecha):
+        """Marca la fecha como invalidada y borra los reportes cuyo rango la incluye."""
+        marca = os.path.join(self.directorio_invalidaciones, fecha)
+        with open(marca, 'a'):
+            os.utime(marca)
+        self._memoria.invalidar_fecha(fecha)
+
+        for nombre in self._archivos():
+            fecha_desde, fecha_hasta, _ = nombre.split('_', 2)
+            if fecha_desde <= fecha <= fecha_hasta:
+                self._eliminar(os.path.join(self.directorio, nombre))
+
+    def _invalidado_desde(self, llave, calculado):
+        ahora = time.time()
+        invalidado = False
+        for fecha in os.listdir(self.directorio_invalidaciones):
+            ruta = os.path.join(self.directorio_invalidaciones, fecha)
+            try:
+                momento = os.stat(ruta).st_mtime
+            except FileNotFoundError:
+                continue
+            if ahora - momento > self.ttl:
+                self._eliminar(ruta)
+            elif _cubre(llave, fecha) and momento >= calculado:
+                invalidado = True
+        return invalidado
+
+    def _archivos(self):
+        return [nombre for nombre in os.listdir(self.directorio) if nombre.endswith('.json')]
+
+    def _recortar(self):
+        """Borra los archivos vencidos y, si se supera max_bytes, los más viejos primero."""
+        ahora = time.time()
+        archivos = []
+        for nombre in self._archivos():
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                estado = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            if ahora - estado.st_mtime > self.ttl:
+                self._eliminar(ruta)
+            else:
+                archivos.append((estado.st_mtime, estado.st_size, ruta))
+
+        total = sum(tamano for _, tamano, _ in archivos)
+        for _, tamano, ruta in sorted(archivos):
+            if total <= self.max_bytes:
+                break
+            self._eliminar(ruta)
+            total -= tamano
+
+    @staticmethod
+    def _eliminar(ruta):
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+
+_cache = None
+_cache_pid = None
+
+def obtener_cache():
+    """Retorna la cache configurada (None si está desactivada). Se crea en cada proceso la primera vez
+       que se usa, así los workers no comparten la LRU ni el lock heredados del proceso padre."""
+    global _cache, _cache_pid
+    tipo = app.config.get('CACHE_REPORTES')
+    if not tipo:
+        return None
+
+    if _cache is None or _cache_pid != os.getpid():
+        ttl = app.config.get('CACHE_REPORTES_TTL', TTL_DEFECTO)
+        max_entradas = app.config.get('CACHE_REPORTES_MAX_ENTRADAS', MAX_ENTRADAS_DEFECTO)
+        if tipo == 'disco':
+            directorio = app.config.get('CACHE_REPORTES_DIR')
+            if not directorio:
+                raise RuntimeError("CACHE_REPORTES = 'disco' necesita CACHE_REPORTES_DIR.")
+            _cache = CacheDisco(directorio, ttl, app.config.get('CACHE_REPORTES_MAX_BYTES', MAX_BYTES_DEFECTO),
+                                max_entradas)
+        else:
+            _cache = CacheMemoria(ttl, max_entradas)
+        _cache_pid = os.getpid()
+    return _cache
+
+
+def obtener_o_calcular(llave, calcular):
+    """Retorna el reporte de la cache o lo calcula con calcular() y lo guarda."""
+    cache = obtener_cache()
+    if cache is None:
+        return calcular()
+
+    valor = cache.obtener(llave)
+    registrar_cache('reportes', valor is not None)
+    if valor is None:
+        #Si se lee de la réplica, los datos son de hace retraso_lectura() segundos: se guarda con ese momento
+        #para que una invalidación ocurrida dentro del atraso descarte el cálculo.
+        calculado = time.time() - retraso_lectura()
+        valor = calcular()
+        cache.guardar(llave, valor, calculado)
+    return valor
+
+
+def consultar(llave):
+    """Retorna el reporte si está en la cache, sin calcularlo (None si no está)."""
+    cache = obtener_cache()
+    if cache is None:
+        return None
+    valor = cache.obtener(llave)
+    registrar_cache('reportes', valor is not None)
+    return valor
+
+
+def invalidar_reportes(fecha):
+    """Invalida los reportes cuyo rango incluye la fecha (un date)."""
+    cache = obtener_cache()
+    if cache is not None:
+        cache.invalidar_fecha(fecha.isoformat())
@@ -0,0 +1,116 @@
+import csv
+import re
+import zipfile
+from io import StringIO
+from xml.sax.saxutils import escape
+from app.utils import BufferZip, en_lotes
+
+#Exportación del reporte procesado a CSV y XLSX, generada por partes mientras se envía.
+#El XLSX se escribe a mano (es un ZIP con XML) para no agregar dependencias: solo lleva
+#las partes mínimas que piden Excel y LibreOffice, con textos en línea (sin sharedStrings).
+
+#Filas que se escriben por vez antes de enviar al cliente.
+TAMANO_LOTE_EXPORTACION = 1000
+
+#Caracteres de control que no se permiten en XML.
+_CONTROL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+#Comienzos con los que Excel y LibreOffice interpretan una celda de CSV como fórmula.
+_INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _celda_csv(valor):
+    """Neutraliza los textos que se abrirían como fórmula (motivo y destino son texto libre) anteponiendo
+       un apóstrofo. El '-' de las horas sin marcación no es una fórmula y queda igual."""
+    if isinstance(valor, str) and valor.startswith(_INICIO_FORMULA) and valor != '-':
+        return "'" + valor
+    return valor
+
+
+def _filas_csv(filas):
+    return [[_celda_csv(valor) for valor in fila] for fila in filas]
+
+
+def iterar_csv(encabezados, filas, encabezados_resumen, resumen):
+    """Produce el CSV (UTF-8 con BOM, para que Excel respete los acentos) por partes.
+       Después del detalle, separada por una fila vacía, va la sección del resumen.
+       resumen puede completarse mientras se recorren las filas."""
+    salida = StringIO()
+    escritor = csv.writer(salida)
+
+    salida.write('\ufeff')
+    escritor.writerow(encabezados)
+    for lote in en_lotes(filas, TAMANO_LOTE_EXPORTACION):
+        escritor.writerows(_filas_csv(lote))
+        yield salida.getvalue().encode('utf-8')
+        salida.seek(0)
+        salida.truncate()
+
+    escritor.writerow([])
+    escritor.writerow(['Resumen'])
+    escritor.writerow(encabezados_resumen)
+    escritor.writerows(_filas_csv(resumen))
+    yield salida.getvalue().encode('utf-8')
+
+
+def _celda(valor):
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return f'<c><v>{valor}</v></c>'
+    texto = escape(_CONTROL_XML.sub('', str(valor)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def _fila_xml(valores):
+    return '<row>' + ''.join(_celda(valor) for valor in valores) + '</row>'
+
+
+_INICIO_HOJA = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+_FIN_HOJA = '</sheetData></worksheet>'
+
+_CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/worksheets/sheet2.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+</Types>'''
+
+_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+
+_WORKBOOK = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Detalle" sheetId="1" r:id="rId1"/><sheet name="Resumen" sheetId="2" r:id="rId2"/></sheets>
+</workbook>'''
+
+_WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet2.xml"/>
+</Relationships>'''
+
+
+def iterar_xlsx(encabezados, filas, encabezados_resumen, resumen):
+    """Produce el XLSX por partes: hoja Detalle con las filas y hoja Resumen.
+       La hoja Resumen se escribe al final, así resumen puede completarse mientras se recorren las filas."""
+    salida = BufferZip()
+    with zipfile.ZipFile(salida, 'w', compression=zipfile.ZIP_DEFLATED) as archivo_zip:
+        archivo_zip.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archivo_zip.writestr('_rels/.rels', _RELS)
+        archivo_zip.writestr('xl/workbook.xml', _WORKBOOK)
+        archivo_zip.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+
+        #force_zip64: el tamaño de la hoja no se conoce de antemano.
+        with archivo_zip.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as hoja:
+            hoja.write((_INICIO_HOJA + _fila_xml(encabezados)).encode('utf-8'))
+            for lote in en_lotes(filas, TAMANO_LOTE_EXPORTACION):
+                hoja.write(''.join(_fila_xml(fila) for fila in lote).encode('utf-8'))
+                yield from salida.pendiente()
+            hoja.write(_FIN_HOJA.encode('utf-8'))
+
+        archivo_zip.writestr('xl/worksheets/sheet2.xml', _INICIO_HOJA + _fila_xml(encabezados_resumen) +
+                             ''.join(_fila_xml(fila) for fila in resumen) + _FIN_HOJA)
+    yield from salida.pendiente()
@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, DateField, SubmitField, TimeField
+from wtforms import StringField, DateField, SubmitField, TimeField, BooleanField
 from wtforms.validators import DataRequired, Optional
 
 class CargarSalidaForm(FlaskForm):
@@ -24,6 +24,7 @@ class FiltroReporteForm(FlaskForm):
     fecha_desde = DateField('Fecha desde', format='%Y-%m-%d', validators=[DataRequired()])
     fecha_hasta = DateField('Fecha hasta', format='%Y-%m-%d', validators=[DataRequired()])
     cedula = StringField('Cédula de Identidad (opcional)', validators=[Optional()])
+    solo_resumen = BooleanField('Solo resumen')
     submit = SubmitField('Generar Reporte')
 
     def validar_fechas(self):
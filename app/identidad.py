@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+from flask_login import UserMixin
+from sqlalchemy import event
+from app import app
+from app.models import Usuario
+from app.replica import en_principal
+from app.metricas import registrar_cache
+
+#Cache de identidades para el user_loader de flask_login: evita consultar asistencias.funcionarios
+#en cada petición. Es local a cada proceso, con LRU (IDENTIDAD_MAX_ENTRADAS) y vencimiento corto
+#(IDENTIDAD_TTL segundos): la tabla la administra otro sistema, así que un usuario dado de baja o
+#modificado afuera deja de verse a lo sumo después del TTL. Los cambios hechos desde esta app
+#(y el login/logout) invalidan la entrada en el momento.
+
+TTL_DEFECTO = 60
+MAX_ENTRADAS_DEFECTO = 1024
+
+
+class Identidad(UserMixin):
+    """Datos del usuario logueado que usa la app (sin el hash de la contraseña)."""
+
+    def __init__(self, cedula, nombre, apellido, tipousuario):
+        self.cedula = cedula
+        self.nombre = nombre
+        self.apellido = apellido
+        self.tipousuario = tipousuario
+
+    def get_id(self):
+        return self.cedula
+
+
+_identidades = OrderedDict()
+_lock = threading.Lock()
+
+
+def cargar_identidad(cedula):
+    """Retorna la identidad del usuario (None si no existe), de la cache si no venció."""
+    ahora = time.time()
+    with _lock:
+        entrada = _identidades.get(cedula)
+        if entrada is not None and ahora - entrada[0] <= app.config.get('IDENTIDAD_TTL', TTL_DEFECTO):
+            _identidades.move_to_end(cedula)
+            registrar_cache('identidad', True)
+            return entrada[1]
+    registrar_cache('identidad', False)
+
+    #La identidad se lee siempre de la principal, también en las peticiones de reportes que usan la réplica.
+    with en_principal():
+        usuario = Usuario.query.with_entities(Usuario.cedula, Usuario.nombre, Usuario.apellido, Usuario.tipousuario)\
+            .filter(Usuario.cedula == cedula).first()
+    if usuario is None:
+        invalidar_identidad(cedula)
+        return None
+
+    identidad = Identidad(usuario.cedula, usuario.nombre, usuario.apellido, usuario.tipousuario)
+    with _lock:
+        _identidades[cedula] = (ahora, identidad)
+        _identidades.move_to_end(cedula)
+        while len(_identidades) > app.config.get('IDENTIDAD_MAX_ENTRADAS', MAX_ENTRADAS_DEFECTO):
+            _identidades.popitem(last=False)
+    return identidad
+
+
+def invalidar_identidad(cedula):
+    """Quita al usuario de la cache (la próxima petición lo vuelve a leer de la base)."""
+    with _lock:
+        _identidades.pop(cedula, None)
+
+
+@event.listens_for(Usuario, 'after_update')
+@event.listens_for(Usuario, 'after_delete')
+def _usuario_modificado(mapper, connection, usuario):
+    invalidar_identidad(usuario.cedula)
@@ -0,0 +1,144 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, request, has_app_context, before_render_template, template_rendered
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import app
+from app.metricas import observar
+
+#Medición por fases de las vistas de reportes (decorador instrumentado).
+#Durante la petición se acumula el tiempo de cada fase:
+# - sql: ejecución de las consultas (todas las bases), con la cantidad de consultas y de filas traídas
+#   (filas según el rowcount del driver; con cursores del lado del servidor no se cuentan)
+# - emparejamiento, registros, pdf: marcadas en services con fase()
+# - render: render de las plantillas (señales de Flask)
+#Las fases se pueden solapar (las consultas del motor SQL caen también en emparejamiento, y en modo
+#streaming el render incluye el cálculo del reporte).
+#La respuesta lleva el encabezado Server-Timing (SERVER_TIMING, activo por defecto; en streaming no,
+#porque los encabezados se envían antes de terminar). Las peticiones que tardan más de
+#REPORTE_LENTO_SEGUNDOS se registran como una linea JSON en el logger 'app.reportes_lentos' y, si está
+#configurado, en el archivo REPORTE_LENTO_ARCHIVO.
+
+LENTO_SEGUNDOS_DEFECTO = 5
+#Tipo de reporte de cada vista en la métrica reporte_duracion_segundos.
+TIPOS_REPORTE = {'registro_salidas': 'admin', 'registro_salidas_funcionario': 'funcionario', 'descargar_pdf': 'pdf'}
+
+_log_lentos = logging.getLogger(f'{app.name}.reportes_lentos')
+_archivo_configurado = []
+
+
+def _medicion():
+    return g.get('medicion') if has_app_context() else None
+
+
+@contextmanager
+def fase(nombre):
+    """Suma al tiempo de la fase lo que tarda el bloque (no hace nada fuera de una vista instrumentada)."""
+    medicion = _medicion()
+    if medicion is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicion['fases'][nombre] = medicion['fases'].get(nombre, 0.0) + time.perf_counter() - inicio
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    if _medicion() is not None:
+        conn.info.setdefault('inicios_instrumentacion', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _despues_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    medicion = _medicion()
+    inicios = conn.info.get('inicios_instrumentacion')
+    if medicion is None or not inicios:
+        return
+    fases = medicion['fases']
+    fases['sql'] = fases.get('sql', 0.0) + time.perf_counter() - inicios.pop()
+    medicion['consultas'] += 1
+    if cursor.description is not None and cursor.rowcount > 0:
+        medicion['filas'] += cursor.rowcount
+
+
+@before_render_template.connect_via(app)
+def _antes_de_render(sender, template, context, **extra):
+    medicion = _medicion()
+    if medicion is not None:
+        medicion['renders'].append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def _despues_de_render(sender, template, context, **extra):
+    medicion = _medicion()
+    if medicion is not None and medicion['renders']:
+        fases = medicion['fases']
+        fases['render'] = fases.get('render', 0.0) + time.perf_counter() - medicion['renders'].pop()
+
+
+def _server_timing(medicion, total):
+    partes = []
+    for nombre, segundos in medicion['fases'].items():
+        parte = f'{nombre};dur={segundos * 1000:.1f}'
+        if nombre == 'sql':
+            parte += f';desc="{medicion["consultas"]} consultas, {medicion["filas"]} filas"'
+        partes.append(parte)
+    partes.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(partes)
+
+
+def _terminar(medicion, endpoint, parametros, usuario, estado):
+    """Registra la duración en las métricas y, si superó REPORTE_LENTO_SEGUNDOS, en el log de reportes lentos."""
+    total = time.perf_counter() - medicion['inicio']
+    observar('reporte_duracion_segundos', total, tipo=TIPOS_REPORTE.get(endpoint, endpoint))
+    if total < app.config.get('REPORTE_LENTO_SEGUNDOS', LENTO_SEGUNDOS_DEFECTO):
+        return
+
+    ruta = app.config.get('REPORTE_LENTO_ARCHIVO')
+    if ruta and not _archivo_configurado:
+        _archivo_configurado.append(ruta)
+        _log_lentos.addHandler(logging.FileHandler(ruta, encoding='utf-8'))
+
+    _log_lentos.warning(json.dumps({
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'endpoint': endpoint,
+        'parametros': parametros,
+        'usuario': usuario,
+        'estado': estado,
+        'total_ms': round(total * 1000, 1),
+        'fases_ms': {nombre: round(segundos * 1000, 1) for nombre, segundos in medicion['fases'].items()},
+        'consultas': medicion['consultas'],
+        'filas': medicion['filas'],
+    }, ensure_ascii=False))
+
+
+def instrumentado(vista):
+    """Mide las fases de la vista: agrega Server-Timing a la respuesta y registra las peticiones lentas."""
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        medicion = g.medicion = {'inicio': time.perf_counter(), 'fases': {}, 'consultas': 0, 'filas': 0,
+                                 'renders': []}
+        endpoint = request.endpoint
+        parametros = request.args.to_dict()
+        usuario = current_user.get_id() if current_user.is_authenticated else None
+
+        respuesta = app.make_response(vista(*args, **kwargs))
+
+        if respuesta.is_streamed:
+            #El cuerpo se genera después de retornar: se mide cuando termina de enviarse.
+            respuesta.call_on_close(lambda: _terminar(
+                medicion, endpoint, parametros, usuario, respuesta.status_code))
+            return respuesta
+
+        if app.config.get('SERVER_TIMING', True):
+            respuesta.headers['Server-Timing'] = _server_timing(medicion, time.perf_counter() - medicion['inicio'])
+        _terminar(medicion, endpoint, parametros, usuario, respuesta.status_code)
+        return respuesta
+    return envoltura
@@ -0,0 +1,57 @@
+from operator import attrgetter
+
+#Columnas de la vista marcaciones_intermedias_general que contienen las horas marcadas.
+COLUMNAS_MARCACION = tuple(f'hora_marcacion_{i}' for i in range(1, 11))
+_leer_columnas = attrgetter(*COLUMNAS_MARCACION)
+
+
+def _parte_valida(texto, maximo):
+    """Valida un componente de 1 o 2 dígitos y retorna su valor (None si no es válido)."""
+    if not 1 <= len(texto) <= 2 or not (texto.isascii() and texto.isdigit()):
+        return None
+    valor = int(texto)
+    return valor if valor <= maximo else None
+
+
+def parsear_hora(texto):
+    """Convierte un string "HH:MM:SS" o "HH:MM" a segundos del día.
+       Acepta exactamente lo mismo que datetime.strptime con '%H:%M:%S' (8 o más caracteres)
+       o '%H:%M' (menos de 8 caracteres). Retorna None si el string no es una hora válida."""
+    if not texto:
+        return None
+
+    partes = texto.split(':')
+    if len(partes) != (3 if len(texto) >= 8 else 2):
+        return None
+
+    horas = _parte_valida(partes[0], 23)
+    minutos = _parte_valida(partes[1], 59)
+    segundos = _parte_valida(partes[2], 59) if len(partes) == 3 else 0
+    if horas is None or minutos is None or segundos is None:
+        return None
+    return horas * 3600 + minutos * 60 + segundos
+
+
+def parsear_marcaciones(marcacion):
+    """Retorna las horas marcadas de una fila de la vista como tupla ordenada de segundos.
+       Las marcaciones vacías o con formato inválido se ignoran."""
+    segundos = []
+    for texto in _leer_columnas(marcacion):
+        valor = parsear_hora(texto)
+        if valor is not None:
+            segundos.append(valor)
+    segundos.sort()
+    return tuple(segundos)
+
+
+def obtener_marcaciones_segundos(marcacion, cache):
+    """Retorna las marcaciones de la fila en segundos, parseando cada par (ci_nro, fecha_marcacion)
+       una sola vez. El diccionario cache vive lo que dura la petición (lo crea el orquestador)."""
+    if marcacion is None:
+        return ()
+
+    llave = (marcacion.ci_nro, marcacion.fecha_marcacion)
+    segundos = cache.get(llave)
+    if segundos is None:
+        segundos = cache[llave] = parsear_marcaciones(marcacion)
+    return segundos
@@ -0,0 +1,324 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from app.utils import escribir_atomico
+
+try:
+    import fcntl
+except ImportError:
+    #Windows (desarrollo): sin flock ni os.kill(pid, 0) los archivos de los procesos terminados no se archivan.
+    fcntl = None
+
+#Métricas de los reportes en el formato de texto de Prometheus (ruta /metrics), sin dependencias externas.
+#Cada proceso acumula contadores e histogramas en memoria y los escribe como JSON en
+#METRICAS_DIR/<pid>.json cada METRICAS_INTERVALO segundos (y al terminar); /metrics suma los archivos de
+#todos los procesos, así cualquier worker de Gunicorn responde el total. Los contadores son acumulados: los
+#archivos de los procesos que ya terminaron se suman en METRICAS_DIR/terminados.json y se borran (al responder
+#/metrics y cuando un proceso nuevo recibe el pid de uno que terminó, que si no pisaría sus valores), así el
+#directorio no crece con cada worker reiniciado y los totales no bajan. Se desactiva con METRICAS = False.
+#/metrics solo responde con METRICAS_TOKEN configurado (el scraper lo manda como "Authorization: Bearer <token>");
+#sin token la ruta da 404, aunque las métricas se sigan acumulando.
+
+PREFIJO = 'marcaciones_'
+INTERVALO_DEFECTO = 5
+ARCHIVO_TERMINADOS = 'terminados.json'
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BUCKETS_ESPERA = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+BUCKETS_BYTES = (10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000, 20_000_000, 100_000_000)
+
+#nombre: (ayuda, buckets)
+HISTOGRAMAS = {
+    'reporte_duracion_segundos': ('Duración de las peticiones de reportes por tipo (admin, funcionario, pdf).',
+                                  BUCKETS_SEGUNDOS),
+    'pdf_render_segundos': ('Tiempo de conversión del HTML a PDF.', BUCKETS_SEGUNDOS),
+    'pdf_bytes': ('Tamaño de los PDF generados.', BUCKETS_BYTES),
+    'login_verificacion_segundos': ('Tiempo de verificación de la contraseña por resultado.', BUCKETS_SEGUNDOS),
+    'db_pool_espera_segundos': ('Espera para obtener una conexión del pool (incluye abrir una nueva).',
+                                BUCKETS_ESPERA),
+}
+#nombre: ayuda
+CONTADORES = {
+    'formularios_emparejados_total': 'Formularios con resultado de emparejamiento (calculado o materializado).',
+    'estado_emparejamiento_total': 'Resultados del emparejamiento por momento (salida, llegada) y estado.',
+    'cache_consultas_total': 'Consultas a las caches (reportes, pdf, identidad) por resultado (acierto, fallo).',
+    'login_compartidos_total': 'Intentos de login repetidos que esperaron la verificación ya en curso.',
+}
+
+_ajustes = {'activo': True, 'directorio': os.path.join(tempfile.gettempdir(), 'marcaciones_metricas'),
+            'intervalo': INTERVALO_DEFECTO}
+
+#(nombre, etiquetas) -> valor del contador o [conteos por bucket (+Inf al final), suma, cantidad].
+_valores = {}
+_lock = threading.Lock()
+_lock_inicio = threading.Lock()
+_estado = {'pid': None, 'sucio': False}
+
+
+def _pool_medido(bind):
+    """QueuePool que registra la espera de cada checkout con la etiqueta del bind."""
+    class PoolMedido(QueuePool):
+        def _do_get(self):
+            inicio = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                observar('db_pool_espera_segundos', time.perf_counter() - inicio, bind=bind)
+    return PoolMedido
+
+
+def configurar_metricas(config):
+    """Lee METRICAS, METRICAS_DIR y METRICAS_INTERVALO y, en PostgreSQL, cambia el pool de la base principal
+       y de la réplica por uno que mide la espera. Se llama después de configurar_motores."""
+    _ajustes['activo'] = config.get('METRICAS', True)
+    _ajustes['directorio'] = config.get('METRICAS_DIR', _ajustes['directorio'])
+    _ajustes['intervalo'] = config.get('METRICAS_INTERVALO', INTERVALO_DEFECTO)
+    if not _ajustes['activo']:
+        return
+
+    motores = [('principal', config.get('SQLALCHEMY_DATABASE_URI'), config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {}))]
+    for bind, opciones in config.get('SQLALCHEMY_BINDS', {}).items():
+        if isinstance(opciones, dict):
+            motores.append((bind, opciones.get('url'), opciones))
+    for bind, uri, opciones in motores:
+        #Solo si no se eligió otro pool (SQLite en memoria, por ejemplo, usa uno propio).
+        if uri and make_url(uri).get_backend_name() == 'postgresql':
+            opciones.setdefault('poolclass', _pool_medido(bind))
+
+
+def _etiquetas(etiquetas):
+    return tuple(sorted(etiquetas.items()))
+
+
+def _preparar_proceso():
+    """En un proceso nuevo (fork de un worker) empieza de cero y arranca el hilo que escribe el archivo."""
+    global _lock
+    pid = os.getpid()
+    if _estado['pid'] == pid:
+        return
+    with _lock_inicio:
+        if _estado['pid'] == pid:
+            return
+        _lock = threading.Lock()
+        _valores.clear()
+        #Un archivo con este pid es de un proceso que ya terminó.
+        _archivar([pid], verificar=False)
+        threading.Thread(target=_escribir_periodicamente, name='metricas', daemon=True).start()
+        _estado['pid'] = pid
+
+
+def incrementar(nombre, valor=1, **etiquetas):
+    if not _ajustes['activo']:
+        return
+    _preparar_proceso()
+    llave = (nombre, _etiquetas(etiquetas))
+    with _lock:
+        _valores[llave] = _valores.get(llave, 0) + valor
+        _estado['sucio'] = True
+
+
+def observar(nombre, valor, **etiquetas):
+    if not _ajustes['activo']:
+        return
+    _preparar_proceso()
+    buckets = HISTOGRAMAS[nombre][1]
+    llave = (nombre, _etiquetas(etiquetas))
+    with _lock:
+        histograma = _valores.get(llave)
+        if histograma is None:
+            histograma = _valores[llave] = [[0] * (len(buckets) + 1), 0.0, 0]
+        histograma[0][bisect_left(buckets, valor)] += 1
+        histograma[1] += valor
+        histograma[2] += 1
+        _estado['sucio'] = True
+
+
+def registrar_emparejamiento(resultados):
+    """Cuenta los formularios emparejados y sus estados de salida y llegada."""
+    if not _ajustes['activo'] or not resultados:
+        return
+    estados = Counter()
+    for _, _, estado_salida, estado_llegada in resultados:
+        estados[('salida', estado_salida)] += 1
+        estados[('llegada', estado_llegada)] += 1
+    incrementar('formularios_emparejados_total', len(resultados))
+    for (momento, estado), cantidad in estados.items():
+        incrementar('estado_emparejamiento_total', cantidad, momento=momento, estado=estado)
+
+
+def registrar_cache(cache, acierto):
+    incrementar('cache_consultas_total', cache=cache, resultado='acierto' if acierto else 'fallo')
+
+
+def _copia():
+    with _lock:
+        _estado['sucio'] = False
+        return [[nombre, list(etiquetas), valor if nombre in CONTADORES else [list(valor[0]), valor[1], valor[2]]]
+                for (nombre, etiquetas), valor in _valores.items()]
+
+
+def _ruta_proceso(pid):
+    return os.path.join(_ajustes['directorio'], f'{pid}.json')
+
+
+def _escribir():
+    if _estado['pid'] != os.getpid():
+        return
+    try:
+        os.makedirs(_ajustes['directorio'], exist_ok=True)
+        escribir_atomico(_ruta_proceso(os.getpid()), json.dumps(_copia()).encode('utf-8'))
+    except OSError:
+        #Las métricas no deben cortar una petición: se reintenta en el próximo intervalo.
+        _estado['sucio'] = True
+
+
+def _escribir_periodicamente():
+    while True:
+        time.sleep(_ajustes['intervalo'])
+        if _estado['sucio']:
+            _escribir()
+
+
+atexit.register(_escribir)
+
+
+def _sumar(total, nombre, etiquetas, valor):
+    llave = (nombre, tuple(map(tuple, etiquetas)))
+    if nombre in CONTADORES:
+        total[llave] = total.get(llave, 0) + valor
+        return
+    acumulado = total.setdefault(llave, [[0] * len(valor[0]), 0.0, 0])
+    acumulado[0] = [a + b for a, b in zip(acumulado[0], valor[0])]
+    acumulado[1] += valor[1]
+    acumulado[2] += valor[2]
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        #Existe pero es de otro usuario.
+        return True
+    return True
+
+
+def _archivar(pids, verificar=True):
+    """Suma los archivos de esos procesos a terminados.json y los borra. Con verificar, omite los procesos
+       que siguen vivos (se revisa con el lock tomado: el pid pudo pasar a un proceso nuevo)."""
+    directorio = _ajustes['directorio']
+    if fcntl is None or not os.path.isdir(directorio):
+        return
+    try:
+        descriptor = os.open(os.path.join(directorio, '.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+    except OSError:
+        return
+    try:
+        fcntl.flock(descriptor, fcntl.LOCK_EX)
+        rutas = []
+        total = {}
+        for pid in pids:
+            if verificar and _proceso_vivo(pid):
+                continue
+            try:
+                with open(_ruta_proceso(pid), encoding='utf-8') as archivo:
+                    valores = json.load(archivo)
+            except FileNotFoundError:
+                #Otro proceso ya lo archivó.
+                continue
+            except (OSError, ValueError):
+                valores = []
+            rutas.append(_ruta_proceso(pid))
+            for nombre, etiquetas, valor in valores:
+                _sumar(total, nombre, etiquetas, valor)
+        if not rutas:
+            return
+
+        ruta_terminados = os.path.join(directorio, ARCHIVO_TERMINADOS)
+        try:
+            with open(ruta_terminados, encoding='utf-8') as archivo:
+                for nombre, etiquetas, valor in json.load(archivo):
+                    _sumar(total, nombre, etiquetas, valor)
+        except FileNotFoundError:
+            pass
+        escribir_atomico(ruta_terminados, json.dumps([[nombre, [list(par) for par in etiquetas], valor]
+                                                      for (nombre, etiquetas), valor in total.items()]).encode('utf-8'))
+        for ruta in rutas:
+            os.remove(ruta)
+    except (OSError, ValueError):
+        #Las métricas no deben cortar una petición: los archivos se siguen sumando donde están.
+        pass
+    finally:
+        os.close(descriptor)
+
+
+def _texto_etiquetas(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ''
+    escapar = lambda valor: str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{clave}="{escapar(valor)}"' for clave, valor in pares) + '}'
+
+
+def _texto_numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def exponer():
+    """Suma las métricas de todos los procesos y las retorna en el formato de texto de Prometheus."""
+    total = {}
+    propio = _ruta_proceso(os.getpid())
+    directorio = _ajustes['directorio']
+    nombres = os.listdir(directorio) if os.path.isdir(directorio) else []
+    otros = [int(nombre[:-5]) for nombre in nombres
+             if nombre.endswith('.json') and nombre[:-5].isdigit() and int(nombre[:-5]) != os.getpid()]
+    if otros:
+        _archivar(otros)
+        nombres = os.listdir(directorio)
+    for nombre_archivo in nombres:
+        ruta = os.path.join(directorio, nombre_archivo)
+        if not nombre_archivo.endswith('.json') or ruta == propio:
+            continue
+        try:
+            with open(ruta, encoding='utf-8') as archivo:
+                valores = json.load(archivo)
+        except (OSError, ValueError):
+            continue
+        for nombre, etiquetas, valor in valores:
+            _sumar(total, nombre, etiquetas, valor)
+    #El proceso que responde usa sus valores en memoria (el archivo puede estar atrasado).
+    if _estado['pid'] == os.getpid():
+        for nombre, etiquetas, valor in _copia():
+            _sumar(total, nombre, etiquetas, valor)
+        _estado['sucio'] = True
+
+    lineas = []
+    for nombre, ayuda in CONTADORES.items():
+        lineas.append(f'# HELP {PREFIJO}{nombre} {ayuda}')
+        lineas.append(f'# TYPE {PREFIJO}{nombre} counter')
+        for (nombre_serie, etiquetas), valor in sorted(total.items()):
+            if nombre_serie == nombre:
+                lineas.append(f'{PREFIJO}{nombre}{_texto_etiquetas(etiquetas)} {_texto_numero(valor)}')
+
+    for nombre, (ayuda, buckets) in HISTOGRAMAS.items():
+        lineas.append(f'# HELP {PREFIJO}{nombre} {ayuda}')
+        lineas.append(f'# TYPE {PREFIJO}{nombre} histogram')
+        for (nombre_serie, etiquetas), valor in sorted(total.items()):
+            if nombre_serie != nombre:
+                continue
+            conteos, suma, cantidad = valor
+            acumulado = 0
+            for limite, conteo in zip(list(buckets) + ['+Inf'], conteos):
+                acumulado += conteo
+                lineas.append(f'{PREFIJO}{nombre}_bucket{_texto_etiquetas(etiquetas, [("le", limite)])} {acumulado}')
+            lineas.append(f'{PREFIJO}{nombre}_sum{_texto_etiquetas(etiquetas)} {_texto_numero(suma)}')
+            lineas.append(f'{PREFIJO}{nombre}_count{_texto_etiquetas(etiquetas)} {cantidad}')
+    return '\n'.join(lineas) + '\n'
@@ -0,0 +1,282 @@
+import re
+from datetime import datetime
+from sqlalchemy import text, insert, select
+from app import app, db
+from app.models import FormularioSalida, VersionEsquema
+
+#Migraciones versionadas del esquema registro_intermedio (se aplican con migrar.py).
+#db.create_all() solo crea las tablas que no existen: los índices y los cambios sobre tablas existentes
+#van acá, numerados, y cada versión aplicada queda en registro_intermedio.version_esquema.
+#Las migraciones con 'transaccion': False crean índices con CONCURRENTLY (no bloquean la carga de
+#formularios mientras se construyen), y eso en PostgreSQL no puede correr dentro de una transacción.
+#Las migraciones con 'opcional': True tocan tablas de otros sistemas: ni crear_tablas.py ni migrar.py
+#las aplican solas, hay que pedirlas con migrar.py --opcional N una vez que el dueño de la tabla lo aprobó.
+
+MIGRACIONES = [
+    {
+        'version': 1,
+        'descripcion': 'Índices de formulario_salida para los reportes',
+        'transaccion': False,
+        'sql': [
+            #Reporte general: rango de fechas y el mismo orden del ORDER BY, así no hace falta ordenar.
+            #Con INCLUDE la consulta de solo resumen puede resolverse solo con el índice.
+            """CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_formulario_salida_fecha_orden
+               ON registro_intermedio.formulario_salida (fecha DESC, hora_salida_estipulada, id_salida)
+               INCLUDE (ci_nro, hora_llegada_estipulada)""",
+            #Reporte filtrado por cedula (y reporte del funcionario), formularios del día por cedula
+            #y días pendientes de materializar.
+            """CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_formulario_salida_ci_fecha_orden
+               ON registro_intermedio.formulario_salida (ci_nro, fecha DESC, hora_salida_estipulada, id_salida)
+               INCLUDE (hora_llegada_estipulada)""",
+            'ANALYZE registro_intermedio.formulario_salida',
+        ],
+    },
+    {
+        'version': 2,
+        'descripcion': 'Índice de registro_entrada_salida para leer las marcaciones por dia (FUENTE_MARCACIONES)',
+        'transaccion': False,
+        #control_asistencia es del sistema de asistencia: crear el índice (y el ANALYZE) en su tabla necesita
+        #el visto bueno de quien la administra. Sin él FUENTE_MARCACIONES = 'tabla' funciona igual, más lento.
+        'opcional': True,
+        'sql': [
+            #Misma expresión que usa marcaciones_por_dia: por funcionario y rango de la hora efectiva.
+            """CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_registro_entrada_salida_personal_momento
+               ON control_asistencia.registro_entrada_salida (personal_id, (COALESCE(registrado_modificado, registrado)))""",
+            'ANALYZE control_asistencia.registro_entrada_salida',
+        ],
+    },
+    {
+        'version': 3,
+        'descripcion': 'Funciones de emparejamiento en la base (MOTOR_EMPAREJAMIENTO = sql)',
+        'sql': [
+            #Igual que app.marcaciones.parsear_hora: "HH:MM:SS" (8 o más caracteres) o "HH:MM", con
+            #componentes de 1 o 2 dígitos. Retorna segundos del día o NULL si no es una hora válida.
+            """CREATE OR REPLACE FUNCTION registro_intermedio.parsear_hora(texto varchar)
+               RETURNS integer LANGUAGE plpgsql IMMUTABLE AS $$
+               DECLARE
+                   partes text[];
+               BEGIN
+                   IF texto IS NULL OR texto = '' THEN
+                       RETURN NULL;
+                   END IF;
+                   IF length(texto) >= 8 THEN
+                       IF texto !~ '^[0-9]{1,2}:[0-9]{1,2}:[0-9]{1,2}$' THEN
+                           RETURN NULL;
+                       END IF;
+                   ELSIF texto !~ '^[0-9]{1,2}:[0-9]{1,2}$' THEN
+                       RETURN NULL;
+                   END IF;
+                   partes := string_to_array(texto, ':');
+                   IF CAST(partes[1] AS integer) > 23 OR CAST(partes[2] AS integer) > 59
+                      OR COALESCE(CAST(partes[3] AS integer), 0) > 59 THEN
+                       RETURN NULL;
+                   END IF;
+                   RETURN CAST(partes[1] AS integer) * 3600 + CAST(partes[2] AS integer) * 60
+                          + COALESCE(CAST(partes[3] AS integer), 0);
+               END
+               $$""",
+            #Igual que services._obtener_hora_cercana: busca dentro de las marcas sin la primera ni la última,
+            #a lo sumo a una hora de distancia; en caso de empate gana la posterior.
+            """CREATE OR REPLACE FUNCTION registro_intermedio.hora_cercana(hora integer, marcas integer[])
+               RETURNS integer LANGUAGE plpgsql IMMUTABLE AS $$
+               DECLARE
+                   n integer := COALESCE(array_length(marcas, 1), 0);
+                   posicion integer := 2;
+                   mejor integer;
+                   delta integer := 3600;
+               BEGIN
+                   IF hora IS NULL OR n <= 2 THEN
+                       RETURN NULL;
+                   END IF;
+                   WHILE posicion < n AND marcas[posicion] < hora LOOP
+                       posicion := posicion + 1;
+                   END LOOP;
+                   IF posicion > 2 AND hora - marcas[posicion - 1] <= delta THEN
+                       delta := hora - marcas[posicion - 1];
+                       mejor := marcas[posicion - 1];
+                   END IF;
+                   IF posicion < n AND marcas[posicion] - hora <= delta THEN
+                       mejor := marcas[posicion];
+                   END IF;
+                   RETURN mejor;
+               END
+               $$""",
+            #Igual que services._calcular_estado_marcacion (tolerancias de 15 y 60 minutos).
+            """CREATE OR REPLACE FUNCTION registro_intermedio.estado_marcacion(estipulada integer, marca integer,
+                                                                               es_llegada boolean)
+               RETURNS varchar LANGUAGE sql IMMUTABLE AS $$
+                   SELECT CASE
+                       WHEN marca IS NULL THEN 'no_marco'
+                       WHEN es_llegada AND marca < estipulada THEN 'cumplio'
+                       WHEN abs(marca - estipulada) >= 3600 THEN 'incumplio'
+                       WHEN abs(marca - estipulada) >= 900 THEN 'alerta'
+                       ELSE 'cumplio'
+                   END
+               $$""",
+            #Igual que services._procesar_marcaciones aplicado a los formularios de un dia en orden
+            #(hora_salida_estipulada, id_salida): las marcas usadas se quitan para los siguientes y, con
+            #exactamente tres marcas disponibles, la del medio va a la estipulada más cercana.
+            """CREATE OR REPLACE FUNCTION registro_intermedio.emparejar_dia(marcas integer[], salidas integer[],
+                                                                            llegadas integer[])
+               RETURNS TABLE(orden integer, hora_salida integer, hora_llegada integer,
+                             estado_salida varchar, estado_llegada varchar)
+               LANGUAGE plpgsql IMMUTABLE AS $$
+               DECLARE
+                   disponibles integer[] := COALESCE(marcas, '{}');
+                   salida integer;
+                   llegada integer;
+                   posicion integer;
+               BEGIN
+                   FOR i IN 1 .. COALESCE(array_length(salidas, 1), 0) LOOP
+                       orden := i;
+                       salida := salidas[i];
+                       llegada := llegadas[i];
+                       hora_salida := NULL;
+                       hora_llegada := NULL;
+                       IF salida IS NULL OR llegada IS NULL THEN
+                           estado_salida := 'no_marco';
+                           estado_llegada := 'no_marco';
+                       ELSIF COALESCE(array_length(disponibles, 1), 0) = 3 THEN
+                           hora_salida := registro_intermedio.hora_cercana(salida, disponibles);
+                           hora_llegada := registro_intermedio.hora_cercana(llegada, disponibles);
+                           IF hora_llegada IS NULL OR (hora_salida IS NOT NULL
+                                   AND abs(hora_salida - salida) <= abs(hora_llegada - llegada)) THEN
+                               hora_llegada := NULL;
+                               estado_salida := registro_intermedio.estado_marcacion(salida, hora_salida, false);
+                               estado_llegada := 'no_marco';
+                           ELSE
+                               hora_salida := NULL;
+                               estado_salida := 'no_marco';
+                               estado_llegada := registro_intermedio.estado_marcacion(llegada, hora_llegada, true);
+                           END IF;
+                           disponibles := array_remove(disponibles, COALESCE(hora_salida, hora_llegada));
+                       ELSE
+                           hora_salida := registro_intermedio.hora_cercana(salida, disponibles);
+                           estado_salida := registro_intermedio.estado_marcacion(salida, hora_salida, false);
+                           IF hora_salida IS NOT NULL THEN
+                               posicion := array_position(disponibles, hora_salida);
+                               disponibles := disponibles[1:posicion - 1] || disponibles[posicion + 1:];
+                           END IF;
+                           hora_llegada := registro_intermedio.hora_cercana(llegada, disponibles);
+                           estado_llegada := registro_intermedio.estado_marcacion(llegada, hora_llegada, true);
+                           disponibles := array_remove(array_remove(disponibles, hora_salida), hora_llegada);
+                       END IF;
+                       RETURN NEXT;
+                   END LOOP;
+               END
+               $$""",
+        ],
+    },
+]
+
+#Número arbitrario para el advisory lock: evita que dos migrar.py apliquen lo mismo a la vez.
+LOCK_MIGRACIONES = 74120301
+
+#Índices que quedan inválidos cuando falla un CREATE INDEX CONCURRENTLY (IF NOT EXISTS los saltearía).
+_SQL_INDICES_INVALIDOS = text("""
+    SELECT n.nspname, c.relname
+    FROM pg_index i
+    INNER JOIN pg_class c ON c.oid = i.indexrelid
+    INNER JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE NOT i.indisvalid
+""")
+_INDICE_CREADO = re.compile(r'CREATE INDEX CONCURRENTLY IF NOT EXISTS (\w+)')
+
+
+def migraciones_pendientes(conexion, opcionales=()):
+    """Retorna las migraciones que todavía no se aplicaron, en orden de versión. Las opcionales solo
+       se incluyen si su versión está en opcionales."""
+    VersionEsquema.__table__.create(conexion, checkfirst=True)
+    aplicadas = set(conexion.execute(select(VersionEsquema.version)).scalars())
+    return [migracion for migracion in sorted(MIGRACIONES, key=lambda m: m['version'])
+            if migracion['version'] not in aplicadas
+            and (not migracion.get('opcional') or migracion['version'] in opcionales)]
+
+
+def versiones_opcionales():
+    """Versiones de las migraciones que solo se aplican a pedido (migrar.py --opcional N)."""
+    return [migracion['version'] for migracion in MIGRACIONES if migracion.get('opcional')]
+
+
+def _registrar_version(conexion, migracion):
+    conexion.execute(insert(VersionEsquema).values(version=migracion['version'],
+                                                   descripcion=migracion['descripcion'],
+                                                   fecha_aplicacion=datetime.now()))
+
+
+def _borrar_indices_invalidos(conexion, migracion):
+    """Borra los índices inválidos que crea la migración (solo esos: puede haber tablas de otros sistemas)."""
+    propios = {nombre for sql in migracion['sql'] for nombre in _INDICE_CREADO.findall(sql)}
+    for esquema, nombre in conexion.execute(_SQL_INDICES_INVALIDOS).all():
+        if nombre in propios:
+            app.logger.warning(f'Borrando índice inválido de una migración anterior: {esquema}.{nombre}')
+            conexion.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{esquema}"."{nombre}"'))
+
+
+def aplicar_migraciones(opcionales=()):
+    """Aplica las migraciones pendientes en orden y retorna las versiones aplicadas.
+       Las opcionales se aplican solo si su versión está en opcionales.
+       Las transaccionales se aplican junto con su registro; si una falla se detiene ahí.
+       Usa conexiones propias y no db.session: una transacción abierta en la sesión dejaría
+       esperando para siempre a CREATE INDEX CONCURRENTLY."""
+    aplicadas = []
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conexion:
+        conexion.execute(text('SELECT pg_advisory_lock(:id)'), {'id': LOCK_MIGRACIONES})
+        try:
+            #Se calcula con el lock tomado: otro proceso pudo haber aplicado algo mientras esperábamos.
+            for migracion in migraciones_pendientes(conexion, opcionales):
+                if migracion.get('transaccion', True):
+                    with db.engine.begin() as transaccion:
+                        for sql in migracion['sql']:
+                            transaccion.execute(text(sql))
+                        _registrar_version(transaccion, migracion)
+                else:
+                    _borrar_indices_invalidos(conexion, migracion)
+                    for sql in migracion['sql']:
+                        conexion.execute(text(sql))
+                    _registrar_version(conexion, migracion)
+                aplicadas.append(migracion['version'])
+        finally:
+            conexion.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': LOCK_MIGRACIONES})
+    return aplicadas
+
+
+def _consultas_reporte(fecha_desde, fecha_hasta, cedula=None):
+    consultas = [
+        ('reporte_admin', FormularioSalida.consultar_reporte_admin(fecha_desde, fecha_hasta, cedula)),
+        ('resumen_admin', FormularioSalida.consultar_resumen_admin(fecha_desde, fecha_hasta, cedula)),
+    ]
+    if cedula:
+        consultas.append(('reporte_usuario', FormularioSalida.consultar_reporte_usuario(fecha_desde, fecha_hasta, cedula)))
+    return consultas
+
+
+def _recorrer_plan(nodo, indices, secuenciales):
+    if 'Index Name' in nodo:
+        indices.add(f"{nodo['Index Name']} ({nodo['Node Type']})")
+    elif nodo['Node Type'] == 'Seq Scan':
+        secuenciales.add(f"{nodo.get('Schema', '')}.{nodo['Relation Name']}".lstrip('.'))
+    for hijo in nodo.get('Plans', []):
+        _recorrer_plan(hijo, indices, secuenciales)
+
+
+def explicar_reportes(fecha_desde, fecha_hasta, cedula=None, analizar=False):
+    """Corre EXPLAIN sobre las consultas de los reportes y retorna, por consulta, los índices que usa el plan,
+       las tablas que recorre completas (Seq Scan) y el costo estimado. Con analizar=True las ejecuta
+       (EXPLAIN ANALYZE) y agrega el tiempo real en milisegundos."""
+    opciones = 'ANALYZE, BUFFERS, VERBOSE, FORMAT JSON' if analizar else 'VERBOSE, FORMAT JSON'
+    conexion = db.session.connection()
+    informe = {}
+    for nombre, consulta in _consultas_reporte(fecha_desde, fecha_hasta, cedula):
+        compilada = consulta.statement.compile(dialect=conexion.dialect)
+        plan = conexion.exec_driver_sql(f'EXPLAIN ({opciones}) {compilada}', compilada.params).scalar()[0]
+
+        indices, secuenciales = set(), set()
+        _recorrer_plan(plan['Plan'], indices, secuenciales)
+        informe[nombre] = {
+            'indices': sorted(indices),
+            'secuenciales': sorted(secuenciales),
+            'costo': plan['Plan']['Total Cost'],
+            'tiempo_ms': plan.get('Execution Time'),
+        }
+    return informe
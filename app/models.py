@@ -1,7 +1,13 @@
 from app import db
+from app.replica import lectura
+from app.marcaciones import COLUMNAS_MARCACION, parsear_hora, parsear_marcaciones
+from flask import current_app
 from flask_login import UserMixin, current_user
-from datetime import datetime, date
+from datetime import date, time, datetime, timedelta
+from sqlalchemy import text, bindparam, null, func
+from sqlalchemy.orm import aliased
 import hashlib
+import hmac
 import base64
 
 #Tabla existente usuarios.
@@ -21,17 +27,21 @@ class Usuario(db.Model, UserMixin):
     
     def check_password(self, raw_password):
         """Valida hash de Django (pbkdf2_sha256)"""
+        return verificar_password(self.password, raw_password)
 
-        if not self.password: return False
-        try:
-            algorithm, iterations, salt, hash_val = self.password.split('$', 3)
-        except ValueError: return False
+def verificar_password(password, raw_password):
+    """Valida raw_password contra un hash de Django (pbkdf2_sha256).
+       Es una función aparte para poder correrla fuera del hilo de la petición (app/verificacion.py)."""
+    if not password: return False
+    try:
+        algorithm, iterations, salt, hash_val = password.split('$', 3)
+    except ValueError: return False
 
-        if algorithm != 'pbkdf2_sha256': return False
+    if algorithm != 'pbkdf2_sha256': return False
 
-        encrypted = hashlib.pbkdf2_hmac('sha256', raw_password.encode('utf-8'), salt.encode('utf-8'), int(iterations))
-        encoded = base64.b64encode(encrypted).decode('ascii').strip()
-        return encoded == hash_val
+    encrypted = hashlib.pbkdf2_hmac('sha256', raw_password.encode('utf-8'), salt.encode('utf-8'), int(iterations))
+    encoded = base64.b64encode(encrypted).decode('ascii').strip()
+    return hmac.compare_digest(encoded.encode('ascii'), hash_val.encode('utf-8'))
     
 #Nueva tabla formulario_salida.
 class FormularioSalida(db.Model):
@@ -49,31 +59,365 @@ class FormularioSalida(db.Model):
     fecha_creacion = db.Column(db.DateTime, nullable=False, default=date.today())
 
 
+    @classmethod
+    def _marcacion(cls):
+        """Entidad de la vista en las consultas de reporte, o NULL si no se une (ver unir_vista_marcaciones):
+           así la fila conserva la misma forma."""
+        return MarcacionIntermediaGeneral if unir_vista_marcaciones() else null().label('marcacion')
+
+    @classmethod
+    def _unir_marcaciones(cls, query, condicion):
+        """Agrega el outer join con la vista, si las consultas de reporte la necesitan."""
+        return query.outerjoin(MarcacionIntermediaGeneral, condicion) if unir_vista_marcaciones() else query
+
+    @classmethod
+    def _condicion_marcaciones(cls):
+        """Condición del outer join con la vista de marcaciones. La vista solo se lee para los formularios
+           sin resultado materializado y para los de hoy (que todavía pueden recibir marcaciones)."""
+        return (cls.ci_nro == MarcacionIntermediaGeneral.ci_nro) & \
+            (cls.fecha == MarcacionIntermediaGeneral.fecha_marcacion) & \
+            (ResultadoSalida.id_salida.is_(None) | (cls.fecha >= date.today()))
+
+    @classmethod
+    def consultar_reporte_admin(cls, fecha_desde, fecha_hasta, cedula=None):
+        """Construye (sin ejecutar) la consulta del reporte de administración.
+           Cada fila es (formulario, marcacion, usuario, resultado materializado o None)."""
+        query = db.session.query(cls, cls._marcacion(), Usuario, ResultadoSalida)\
+        .outerjoin(ResultadoSalida, cls.id_salida == ResultadoSalida.id_salida)
+        query = cls._unir_marcaciones(query, cls._condicion_marcaciones())\
+        .join(Usuario, cls.ci_nro == Usuario.cedula)\
+        .filter(cls.fecha.between(fecha_desde, fecha_hasta))
+
+        if cedula:
+            query = query.filter(cls.ci_nro == cedula)
+
+        #id_salida desempata para que el orden sea estable (lo necesita la paginación keyset).
+        return query.order_by(cls.fecha.desc(), cls.hora_salida_estipulada.asc(), cls.id_salida.asc())
+
     @classmethod
     def obtener_reporte_admin(cls, fecha_desde, fecha_hasta, cedula=None):
         """Retorna un reporte con todos los formularios enviados, tengan o no registrada marcaciones en un rango de fechas.
            Tambien se puede filtrar por cedula."""
-        query = db.session.query(cls, MarcacionIntermediaGeneral, Usuario)\
-        .outerjoin(MarcacionIntermediaGeneral, (cls.ci_nro == MarcacionIntermediaGeneral.ci_nro) & 
-                   (cls.fecha == MarcacionIntermediaGeneral.fecha_marcacion))\
+        return cls.consultar_reporte_admin(fecha_desde, fecha_hasta, cedula).all()
+
+    @classmethod
+    def _dia_materializado(cls):
+        """Condición: el dia (ci_nro, fecha) del formulario ya pasó y todos sus formularios tienen resultado
+           materializado (los mismos dias que _emparejar_con_materializados no recalcula)."""
+        otro = aliased(cls)
+        resultado = aliased(ResultadoSalida)
+        sin_resultado = db.exists().where(otro.ci_nro == cls.ci_nro, otro.fecha == cls.fecha,
+                                          ~db.exists().where(resultado.id_salida == otro.id_salida))
+        return (cls.fecha < date.today()) & ~sin_resultado
+
+    @classmethod
+    def consultar_resumen_admin(cls, fecha_desde, fecha_hasta, cedula=None, solo_pendientes=False):
+        """Consulta liviana para el modo solo resumen: trae únicamente las columnas necesarias para
+           el emparejamiento y las estadísticas (sin armar objetos del ORM), en el orden del reporte.
+           Con solo_pendientes trae solo los dias sin materializar (los demás los suma resumen_materializado)."""
+        if unir_vista_marcaciones():
+            columnas_vista = [MarcacionIntermediaGeneral.fecha_marcacion,
+                              *(getattr(MarcacionIntermediaGeneral, columna) for columna in COLUMNAS_MARCACION)]
+        else:
+            columnas_vista = [null().label('fecha_marcacion')]
+        query = db.session.query(
+            cls.id_salida, cls.ci_nro, cls.fecha, cls.hora_salida_estipulada, cls.hora_llegada_estipulada,
+            Usuario.cedula, Usuario.nombre, Usuario.apellido,
+            *columnas_vista,
+            ResultadoSalida.id_salida.label('id_resultado'),
+            ResultadoSalida.hora_salida_cercana, ResultadoSalida.hora_llegada_cercana,
+            ResultadoSalida.estado_salida, ResultadoSalida.estado_llegada)\
+        .outerjoin(ResultadoSalida, cls.id_salida == ResultadoSalida.id_salida)
+        query = cls._unir_marcaciones(query, cls._condicion_marcaciones())\
         .join(Usuario, cls.ci_nro == Usuario.cedula)\
         .filter(cls.fecha.between(fecha_desde, fecha_hasta))
 
         if cedula:
             query = query.filter(cls.ci_nro == cedula)
+        if solo_pendientes:
+            query = query.filter(~cls._dia_materializado())
+
+        return query.order_by(cls.fecha.desc(), cls.hora_salida_estipulada.asc(), cls.id_salida.asc())
+
+    @classmethod
+    def resumen_materializado(cls, fecha_desde, fecha_hasta, cedula=None):
+        """Estadísticas por funcionario de los dias ya materializados, agrupadas en la base (GROUP BY ci_nro).
+           Cada fila trae cedula, nombre, apellido, los contadores (total, cumplio, alerta, incumplio, contando
+           salida y llegada como en _actualizar_estado_estadisticas) y la llave (fecha, hora_salida_estipulada,
+           id_salida) del primer formulario del funcionario en el orden del reporte."""
+        #Posición de cada formulario dentro de los de su funcionario, en el orden del reporte.
+        orden = func.row_number().over(partition_by=cls.ci_nro,
+                                       order_by=(cls.fecha.desc(), cls.hora_salida_estipulada, cls.id_salida))
+        query = db.session.query(cls.ci_nro, cls.fecha, cls.hora_salida_estipulada, cls.id_salida,
+                                 ResultadoSalida.estado_salida, ResultadoSalida.estado_llegada,
+                                 orden.label('orden'))\
+        .join(ResultadoSalida, cls.id_salida == ResultadoSalida.id_salida)\
+        .filter(cls.fecha.between(fecha_desde, fecha_hasta), cls._dia_materializado())
+        if cedula:
+            query = query.filter(cls.ci_nro == cedula)
+        formularios = query.subquery()
+
+        def contar(*estados):
+            #COUNT(*) FILTER (WHERE ...) de la salida más el de la llegada.
+            return func.count().filter(formularios.c.estado_salida.in_(estados)) + \
+                func.count().filter(formularios.c.estado_llegada.in_(estados))
+
+        primero = formularios.c.orden == 1
+        incumplio = contar('incumplio', 'no_marco')
+        alerta = contar('alerta')
+        return db.session.query(
+            Usuario.cedula, Usuario.nombre, Usuario.apellido,
+            func.count().label('total'),
+            (2 * func.count() - incumplio - alerta).label('cumplio'),
+            alerta.label('alerta'),
+            incumplio.label('incumplio'),
+            func.max(formularios.c.fecha).filter(primero).label('primera_fecha'),
+            func.max(formularios.c.hora_salida_estipulada).filter(primero).label('primera_hora'),
+            func.max(formularios.c.id_salida).filter(primero).label('primer_id'))\
+        .join(Usuario, formularios.c.ci_nro == Usuario.cedula)\
+        .group_by(Usuario.cedula, Usuario.nombre, Usuario.apellido).all()
+
+    @classmethod
+    def _despues_de(cls, llave):
+        """Condición keyset: filas que van después de la llave (fecha, hora_salida_estipulada, id_salida)
+           en el orden del reporte (fecha desc, hora_salida_estipulada asc, id_salida asc)."""
+        fecha, hora_salida, id_salida = llave
+        return db.or_(cls.fecha < fecha,
+                      db.and_(cls.fecha == fecha,
+                              db.or_(cls.hora_salida_estipulada > hora_salida,
+                                     db.and_(cls.hora_salida_estipulada == hora_salida, cls.id_salida > id_salida))))
+
+    @classmethod
+    def _antes_de(cls, llave):
+        """Condición keyset: filas que van antes de la llave en el orden del reporte."""
+        fecha, hora_salida, id_salida = llave
+        return db.or_(cls.fecha > fecha,
+                      db.and_(cls.fecha == fecha,
+                              db.or_(cls.hora_salida_estipulada < hora_salida,
+                                     db.and_(cls.hora_salida_estipulada == hora_salida, cls.id_salida < id_salida))))
+
+    @classmethod
+    def obtener_pagina_reporte_admin(cls, fecha_desde, fecha_hasta, cedula=None, llave=None, hacia_atras=False, limite=50):
+        """Retorna (filas, hay_mas): una página del reporte de administración usando paginación keyset.
+           Las filas siguen el orden del reporte; hacia_atras trae la página anterior a la llave."""
+        query = cls.consultar_reporte_admin(fecha_desde, fecha_hasta, cedula)
+
+        if hacia_atras:
+            if llave:
+                query = query.filter(cls._antes_de(llave))
+            query = query.order_by(None).order_by(cls.fecha.asc(), cls.hora_salida_estipulada.desc(), cls.id_salida.desc())
+        elif llave:
+            query = query.filter(cls._despues_de(llave))
 
-        return query.order_by(cls.fecha.desc(), cls.hora_salida_estipulada.asc()).all()
+        #Pedimos una fila de más para saber si hay otra página.
+        filas = query.limit(limite + 1).all()
+        hay_mas = len(filas) > limite
+        filas = filas[:limite]
+        if hacia_atras:
+            filas.reverse()
+        return filas, hay_mas
+
+    @classmethod
+    def obtener_previos_del_dia(cls, formulario, cedulas):
+        """Retorna, en el orden del reporte, los formularios del mismo dia (y de las cedulas dadas)
+           que van antes del formulario indicado."""
+        llave = (formulario.fecha, formulario.hora_salida_estipulada, formulario.id_salida)
+        return cls.consultar_reporte_admin(formulario.fecha, formulario.fecha)\
+            .filter(cls.ci_nro.in_(cedulas), cls._antes_de(llave)).all()
     
     @classmethod
-    def obtener_reporte_usuario(cls, fecha_desde, fecha_hasta):
-        """Retorna un reporte al usuario que muestra el resultado de sus formularios enviados y sus marcaciones"""
-        query = db.session.query(cls, MarcacionIntermediaGeneral)\
-        .outerjoin(MarcacionIntermediaGeneral, (cls.ci_nro == MarcacionIntermediaGeneral.ci_nro) &
-                (cls.fecha == MarcacionIntermediaGeneral.fecha_marcacion))\
-        .filter(cls.ci_nro == current_user.cedula, cls.fecha.between(fecha_desde, fecha_hasta))
+    def consultar_reporte_usuario(cls, fecha_desde, fecha_hasta, cedula):
+        """Construye (sin ejecutar) la consulta del reporte de un funcionario.
+           Cada fila es (formulario, marcacion, resultado materializado o None)."""
+        query = db.session.query(cls, cls._marcacion(), ResultadoSalida)\
+        .outerjoin(ResultadoSalida, cls.id_salida == ResultadoSalida.id_salida)
+        query = cls._unir_marcaciones(query, cls._condicion_marcaciones())\
+        .filter(cls.ci_nro == cedula, cls.fecha.between(fecha_desde, fecha_hasta))
+
+        return query.order_by(cls.fecha.desc(), cls.hora_salida_estipulada.asc(), cls.id_salida.asc())
+
+    @classmethod
+    def obtener_reporte_usuario(cls, fecha_desde, fecha_hasta, cedula=None):
+        """Retorna un reporte al usuario que muestra el resultado de sus formularios enviados y sus marcaciones.
+           Por defecto es el usuario logueado (los trabajos en segundo plano pasan la cedula)."""
+        return cls.consultar_reporte_usuario(fecha_desde, fecha_hasta, cedula or current_user.cedula).all()
+
+    @classmethod
+    def obtener_formularios_del_dia(cls, fecha, cedulas):
+        """Retorna (formulario, marcacion) de los formularios de las cedulas en la fecha, en el orden del reporte.
+           Siempre lee las marcaciones (de la vista o de la tabla del reloj): lo usa el proceso que materializa
+           los resultados."""
+        query = cls._unir_marcaciones(db.session.query(cls, cls._marcacion()),
+                                      (cls.ci_nro == MarcacionIntermediaGeneral.ci_nro) &
+                                      (cls.fecha == MarcacionIntermediaGeneral.fecha_marcacion))\
+        .filter(cls.fecha == fecha, cls.ci_nro.in_(cedulas))
+
+        return query.order_by(cls.hora_salida_estipulada.asc(), cls.id_salida.asc()).all()
+
+    @classmethod
+    def dias_pendientes(cls, hasta, marca_agua=None):
+        """Retorna los dias (ci_nro, fecha) anteriores a hasta que tienen formularios sin resultado
+           materializado o formularios creados después de la marca de agua."""
+        condicion = ResultadoSalida.id_salida.is_(None)
+        if marca_agua:
+            condicion = condicion | (cls.fecha_creacion > marca_agua)
+
+        query = db.session.query(cls.ci_nro, cls.fecha).distinct()\
+        .outerjoin(ResultadoSalida, cls.id_salida == ResultadoSalida.id_salida)\
+        .filter(cls.fecha < hasta, condicion)
+        return {(ci_nro, fecha) for ci_nro, fecha in query}
+
+#Nueva tabla con los resultados del emparejamiento ya calculados (la completa refrescar_resultados.py).
+class ResultadoSalida(db.Model):
+    __tablename__ = 'resultado_salida'
+    __table_args__ = {'schema': 'registro_intermedio'}
+
+    id_salida = db.Column(db.Integer, db.ForeignKey('registro_intermedio.formulario_salida.id_salida', ondelete='CASCADE'),
+                          primary_key=True)
+    ci_nro = db.Column(db.String(20), nullable=False)
+    fecha = db.Column(db.Date, nullable=False)
+    hora_salida_cercana = db.Column(db.Time)
+    hora_llegada_cercana = db.Column(db.Time)
+    estado_salida = db.Column(db.String(10), nullable=False)
+    estado_llegada = db.Column(db.String(10), nullable=False)
+    fecha_calculo = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+#Nueva tabla con la marca de agua de los procesos incrementales.
+class ControlProceso(db.Model):
+    __tablename__ = 'control_proceso'
+    __table_args__ = {'schema': 'registro_intermedio'}
+
+    nombre = db.Column(db.String(50), primary_key=True)
+    marca_agua = db.Column(db.DateTime, nullable=False)
+
+    @classmethod
+    def obtener_marca_agua(cls, nombre):
+        """Retorna la marca de agua del proceso (None si nunca se ejecutó)."""
+        control = db.session.get(cls, nombre)
+        return control.marca_agua if control else None
+
+    @classmethod
+    def guardar_marca_agua(cls, nombre, marca_agua):
+        """Actualiza (o crea) la marca de agua del proceso. No hace commit."""
+        db.session.merge(cls(nombre=nombre, marca_agua=marca_agua))
+
+#Nueva tabla con las migraciones del esquema ya aplicadas (la completa migrar.py).
+class VersionEsquema(db.Model):
+    __tablename__ = 'version_esquema'
+    __table_args__ = {'schema': 'registro_intermedio'}
 
-        return query.order_by(cls.fecha.desc(), cls.hora_salida_estipulada.asc()).all()
+    version = db.Column(db.Integer, primary_key=True)
+    descripcion = db.Column(db.String(200), nullable=False)
+    fecha_aplicacion = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+def dias_con_marcaciones_modificadas(marca_agua, hasta):
+    """Retorna los dias (ci_nro, fecha) anteriores a hasta cuyas marcaciones del reloj fueron
+       cargadas o modificadas después de la marca de agua (tabla base de la vista)."""
+    sql = lectura(text("""
+        SELECT p.ci_nro, CAST(r.registrado AS DATE) AS fecha
+        FROM control_asistencia.registro_entrada_salida r
+        INNER JOIN ficha_personal.personal p ON p.id = r.personal_id
+        WHERE r.fecha_modificacion > :marca_agua AND r.registrado < :hasta
+        UNION
+        SELECT p.ci_nro, CAST(r.registrado_modificado AS DATE) AS fecha
+        FROM control_asistencia.registro_entrada_salida r
+        INNER JOIN ficha_personal.personal p ON p.id = r.personal_id
+        WHERE r.fecha_modificacion > :marca_agua AND r.registrado_modificado < :hasta
+    """))
+    filas = db.session.execute(sql, {'marca_agua': marca_agua, 'hasta': hasta})
+    return {(ci_nro, fecha) for ci_nro, fecha in filas}
     
+def leer_marcaciones_de_tabla():
+    """Indica si las marcaciones se leen directamente de la tabla del reloj (FUENTE_MARCACIONES = 'tabla')
+       en lugar de la vista marcaciones_intermedias_general (por defecto, 'vista'). Para rangos grandes
+       conviene el índice de la migración opcional 2 (migrar.py --opcional 2)."""
+    return current_app.config.get('FUENTE_MARCACIONES', 'vista') == 'tabla'
+
+def emparejamiento_en_base():
+    """Indica si el emparejamiento se calcula en la base (MOTOR_EMPAREJAMIENTO = 'sql', ver emparejar_dias_en_base)."""
+    return current_app.config.get('MOTOR_EMPAREJAMIENTO', 'vectorizado') == 'sql'
+
+def unir_vista_marcaciones():
+    """Indica si las consultas de reporte traen las marcaciones de la vista. No hace falta si se leen
+       de la tabla del reloj ni si el emparejamiento se hace en la base."""
+    return not leer_marcaciones_de_tabla() and not emparejamiento_en_base()
+
+#Marcaciones de un dia d (ci_nro, fecha) como arreglo ordenado de segundos, según FUENTE_MARCACIONES.
+_MARCAS_DIA_TABLA = """
+    SELECT array_agg(CAST(EXTRACT(EPOCH FROM CAST(date_trunc('second', x.momento) AS TIME)) AS INTEGER)
+                     ORDER BY x.momento) AS marcas
+    FROM (SELECT COALESCE(r.registrado_modificado, r.registrado) AS momento
+          FROM control_asistencia.registro_entrada_salida r
+          INNER JOIN ficha_personal.personal p ON p.id = r.personal_id
+          WHERE p.ci_nro = d.ci_nro
+            AND COALESCE(r.registrado_modificado, r.registrado) >= d.fecha
+            AND COALESCE(r.registrado_modificado, r.registrado) < d.fecha + 1) x
+"""
+_MARCAS_DIA_VISTA = """
+    SELECT array_agg(s.segundos ORDER BY s.segundos) AS marcas
+    FROM registro_intermedio.marcaciones_intermedias_general v
+    CROSS JOIN LATERAL unnest(ARRAY[{columnas}]) AS h(texto)
+    CROSS JOIN LATERAL (SELECT registro_intermedio.parsear_hora(CAST(h.texto AS varchar)) AS segundos) s
+    WHERE v.ci_nro = d.ci_nro AND v.fecha_marcacion = d.fecha AND s.segundos IS NOT NULL
+""".format(columnas=', '.join(f'v.{columna}' for columna in COLUMNAS_MARCACION))
+
+def emparejar_dias_en_base(dias):
+    """Retorna {id_salida: (hora_salida, hora_llegada, estado_salida, estado_llegada)} (horas en segundos)
+       de todos los formularios de los dias (ci_nro, fecha) dados, calculado en PostgreSQL con
+       registro_intermedio.emparejar_dia (migración 3): solo viajan los resultados, no las marcaciones.
+       Se consulta el rango de fechas de los dias y solo sus cedulas."""
+    if not dias:
+        return {}
+    sql = lectura(text(f"""
+        WITH d AS (
+            SELECT f.ci_nro, f.fecha,
+                   array_agg(f.id_salida ORDER BY f.hora_salida_estipulada, f.id_salida) AS ids,
+                   array_agg(CAST(FLOOR(EXTRACT(EPOCH FROM f.hora_salida_estipulada)) AS INTEGER)
+                             ORDER BY f.hora_salida_estipulada, f.id_salida) AS salidas,
+                   array_agg(CAST(FLOOR(EXTRACT(EPOCH FROM f.hora_llegada_estipulada)) AS INTEGER)
+                             ORDER BY f.hora_salida_estipulada, f.id_salida) AS llegadas
+            FROM registro_intermedio.formulario_salida f
+            WHERE f.fecha BETWEEN :desde AND :hasta AND f.ci_nro IN :cedulas
+            GROUP BY f.ci_nro, f.fecha
+        )
+        SELECT d.ids[e.orden], e.hora_salida, e.hora_llegada, e.estado_salida, e.estado_llegada
+        FROM d
+        CROSS JOIN LATERAL ({_MARCAS_DIA_TABLA if leer_marcaciones_de_tabla() else _MARCAS_DIA_VISTA}) m
+        CROSS JOIN LATERAL registro_intermedio.emparejar_dia(m.marcas, d.salidas, d.llegadas) e
+    """).bindparams(bindparam('cedulas', expanding=True)))
+    filas = db.session.execute(sql, {
+        'desde': min(fecha for _, fecha in dias),
+        'hasta': max(fecha for _, fecha in dias),
+        'cedulas': sorted({ci_nro for ci_nro, _ in dias}),
+    })
+    return {id_salida: tuple(resultado) for id_salida, *resultado in filas}
+
+def marcaciones_por_dia(dias):
+    """Retorna {(ci_nro, fecha): tupla ordenada de segundos} con las marcaciones del reloj de los dias dados,
+       leídas de la tabla base (sin el pivot de la vista ni su límite de diez marcaciones).
+       Se consulta el rango de fechas de los dias y solo sus cedulas; la base agrupa por dia y arma el arreglo
+       ya ordenado. Vale la hora modificada si existe (la misma que usa dias_con_marcaciones_modificadas)."""
+    if not dias:
+        return {}
+    sql = lectura(text("""
+        SELECT p.ci_nro,
+               CAST(COALESCE(r.registrado_modificado, r.registrado) AS DATE) AS fecha,
+               array_agg(CAST(EXTRACT(EPOCH FROM CAST(date_trunc('second', COALESCE(r.registrado_modificado, r.registrado)) AS TIME)) AS INTEGER)
+                         ORDER BY COALESCE(r.registrado_modificado, r.registrado)) AS segundos
+        FROM control_asistencia.registro_entrada_salida r
+        INNER JOIN ficha_personal.personal p ON p.id = r.personal_id
+        WHERE COALESCE(r.registrado_modificado, r.registrado) >= :desde
+          AND COALESCE(r.registrado_modificado, r.registrado) < :hasta
+          AND p.ci_nro IN :cedulas
+        GROUP BY p.ci_nro, CAST(COALESCE(r.registrado_modificado, r.registrado) AS DATE)
+    """).bindparams(bindparam('cedulas', expanding=True)))
+    filas = db.session.execute(sql, {
+        'desde': min(fecha for _, fecha in dias),
+        'hasta': max(fecha for _, fecha in dias) + timedelta(days=1),
+        'cedulas': sorted({ci_nro for ci_nro, _ in dias}),
+    })
+    return {(ci_nro, fecha): tuple(segundos) for ci_nro, fecha, segundos in filas}
+
 #Vista existente marcaciones_intermedias_general (solo de lectura).
 class MarcacionIntermediaGeneral(db.Model):
     __tablename__ = 'marcaciones_intermedias_general'
@@ -98,18 +442,13 @@ class MarcacionIntermediaGeneral(db.Model):
     def get_marcaciones_list(self):
         """Retorna lista de objetos time, convirtiendo desde string"""
         marcaciones = []
-        for i in range(1, 11):
-            val_str = getattr(self, f'hora_marcacion_{i}')
-            if val_str:
-                try:
-                    # Intentamos convertir el string "08:00:00" a objeto time.
-                    # Ajusta el formato '%H:%M:%S' si tus datos son diferentes.
-                    if len(val_str) >= 8: # Formato HH:MM:SS
-                        time_obj = datetime.strptime(val_str, '%H:%M:%S').time()
-                    else: # Formato HH:MM
-                        time_obj = datetime.strptime(val_str, '%H:%M').time()
-                    marcaciones.append(time_obj)
-                except ValueError:
-                    # Si hay un error de conversión, simplemente ignoramos esa marcación.
-                    continue
-        return marcaciones
\ No newline at end of file
+        for columna in COLUMNAS_MARCACION:
+            # Las marcaciones con formato inválido se ignoran (ver parsear_hora).
+            segundos = parsear_hora(getattr(self, columna))
+            if segundos is not None:
+                marcaciones.append(time(segundos // 3600, segundos % 3600 // 60, segundos % 60))
+        return marcaciones
+
+    def get_marcaciones_segundos(self):
+        """Retorna las marcaciones como tupla ordenada de segundos del día"""
+        return parsear_marcaciones(self)
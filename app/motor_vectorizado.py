@@ -0,0 +1,157 @@
+import numpy as np
+
+#Rango de busqueda de la hora cercana (mismo valor por defecto que _obtener_hora_cercana).
+RANGO_MINUTOS = 60
+
+#Codigos de estado usados dentro del motor, se traducen a texto al final.
+CUMPLIO, ALERTA, INCUMPLIO, NO_MARCO = 0, 1, 2, 3
+ESTADOS = np.array(['cumplio', 'alerta', 'incumplio', 'no_marco'], dtype=object)
+
+#Centinela para las posiciones vacías de la matriz (queda al final al ordenar).
+SIN_MARCA = 1 << 40
+INFINITO = 1 << 50
+
+
+def _construir_matriz(marcas_por_dia):
+    """Arma una matriz (dias x max_marcaciones) de segundos ordenados por fila.
+       Las posiciones vacías quedan con el centinela SIN_MARCA."""
+    ancho = max((len(marcas) for marcas in marcas_por_dia), default=0)
+    matriz = np.full((len(marcas_por_dia), max(ancho, 1)), SIN_MARCA, dtype=np.int64)
+    for fila, marcas in enumerate(marcas_por_dia):
+        if marcas:
+            matriz[fila, :len(marcas)] = marcas
+    matriz.sort(axis=1)
+    return matriz, matriz != SIN_MARCA
+
+
+def _mas_cercana(valores, candidatas, objetivo, rango_segundos):
+    """Version vectorizada de _obtener_hora_cercana sobre las posiciones candidatas.
+       En caso de empate gana la ultima posicion, igual que el bucle original (usa <=)."""
+    distancias = np.where(candidatas, np.abs(valores - objetivo[:, None]), INFINITO)
+    ancho = distancias.shape[1]
+    posicion = ancho - 1 - np.argmin(distancias[:, ::-1], axis=1)
+    distancia = distancias[np.arange(len(posicion)), posicion]
+    return posicion, distancia <= rango_segundos, distancia
+
+
+def _estados(estipulada, marcacion, encontrada, es_llegada, alerta_segundos, incumplimiento_segundos):
+    """Version vectorizada de _calcular_estado_marcacion."""
+    diferencia = np.abs(marcacion - estipulada)
+    estado = np.where(diferencia >= incumplimiento_segundos, INCUMPLIO,
+                      np.where(diferencia >= alerta_segundos, ALERTA, CUMPLIO))
+    if es_llegada:
+        # Si es llegada y marcó antes de la hora estipulada, consideramos que cumplió.
+        estado = np.where(marcacion < estipulada, CUMPLIO, estado)
+    return np.where(encontrada, estado, NO_MARCO)
+
+
+def emparejar_lote(filas):
+    """Procesa todas las filas de un reporte de una sola vez.
+       Cada fila es una tupla (llave_dia, salida_seg, llegada_seg, marcas_seg) en el orden del reporte,
+       donde llave_dia identifica al par (cedula, fecha) y las horas están en segundos del día.
+       Retorna una lista de tuplas (hora_salida_cercana, hora_llegada_cercana, estado_salida, estado_llegada)
+       con las horas en segundos (o None), idénticas a las del camino fila por fila."""
+    from app.services import TOLERANCIA_ALERTA, TOLERANCIA_INCUMPLIMIENTO
+
+    total = len(filas)
+    if not total:
+        return []
+
+    #Agrupamos las filas por dia y numeramos cada formulario dentro de su dia (respetando el orden).
+    indice_dia = {}
+    marcas_por_dia = []
+    formularios_por_dia = []
+    dia = np.empty(total, dtype=np.int64)
+    turno = np.empty(total, dtype=np.int64)
+    salida = np.zeros(total, dtype=np.int64)
+    llegada = np.zeros(total, dtype=np.int64)
+    valida = np.ones(total, dtype=bool)
+
+    for i, (llave_dia, salida_seg, llegada_seg, marcas_seg) in enumerate(filas):
+        d = indice_dia.get(llave_dia)
+        if d is None:
+            d = indice_dia[llave_dia] = len(marcas_por_dia)
+            marcas_por_dia.append(marcas_seg)
+            formularios_por_dia.append(0)
+        dia[i] = d
+        turno[i] = formularios_por_dia[d]
+        formularios_por_dia[d] += 1
+        if salida_seg is None or llegada_seg is None:
+            valida[i] = False
+        else:
+            salida[i] = salida_seg
+            llegada[i] = llegada_seg
+
+    matriz, disponibles = _construir_matriz(marcas_por_dia)
+    rango_segundos = RANGO_MINUTOS * 60
+    alerta_segundos = TOLERANCIA_ALERTA * 60
+    incumplimiento_segundos = TOLERANCIA_INCUMPLIMIENTO * 60
+
+    hora_salida = np.zeros(total, dtype=np.int64)
+    hora_llegada = np.zeros(total, dtype=np.int64)
+    marco_salida = np.zeros(total, dtype=bool)
+    marco_llegada = np.zeros(total, dtype=bool)
+
+    #Cada pasada procesa el n-esimo formulario de todos los dias a la vez.
+    #Asi las marcaciones usadas por un formulario ya no estan disponibles para el siguiente del mismo dia.
+    orden = np.argsort(turno, kind='stable')
+    cortes = np.searchsorted(turno[orden], np.arange(1, turno.max() + 1))
+    for filas_pasada in np.split(orden, cortes):
+        dias_pasada = dia[filas_pasada]
+        valores = matriz[dias_pasada]
+        libres = disponibles[dias_pasada]
+
+        #Quitamos la primera y la ultima marcacion disponible (entrada y salida del trabajo).
+        cantidad = libres.sum(axis=1)
+        acumulado = np.cumsum(libres, axis=1)
+        extremos = libres & ((acumulado == 1) | (acumulado == cantidad[:, None]))
+        candidatas = libres & ~extremos & (cantidad > 2)[:, None]
+
+        es_valida = valida[filas_pasada]
+        unica = es_valida & (cantidad == 3)
+        normal = es_valida & ~unica
+        objetivo_salida = salida[filas_pasada]
+        objetivo_llegada = llegada[filas_pasada]
+        filas_idx = np.arange(len(filas_pasada))
+
+        # ---- SALIDA ----
+        pos_salida, hay_salida, dist_salida = _mas_cercana(valores, candidatas, objetivo_salida, rango_segundos)
+
+        # ---- LLEGADA ---- (sin la marcacion usada por la salida, salvo en el caso de hora unica)
+        candidatas_llegada = candidatas.copy()
+        quitar = normal & hay_salida
+        candidatas_llegada[filas_idx[quitar], pos_salida[quitar]] = False
+        pos_llegada, hay_llegada, dist_llegada = _mas_cercana(valores, candidatas_llegada, objetivo_llegada, rango_segundos)
+
+        # ---- CASO ESPECIAL: una sola hora disponible, se asigna a la mas cercana ----
+        diff_salida = np.where(hay_salida, dist_salida, INFINITO)
+        diff_llegada = np.where(hay_llegada, dist_llegada, INFINITO)
+        gana_salida = diff_salida <= diff_llegada
+
+        usa_salida = hay_salida & (normal | (unica & gana_salida))
+        usa_llegada = hay_llegada & (normal | (unica & ~gana_salida))
+
+        valor_salida = valores[filas_idx, pos_salida]
+        valor_llegada = valores[filas_idx, pos_llegada]
+
+        #Marcamos como usadas todas las copias de las horas asignadas.
+        usadas = (usa_salida[:, None] & (valores == valor_salida[:, None])) | \
+                 (usa_llegada[:, None] & (valores == valor_llegada[:, None]))
+        disponibles[dias_pasada] = libres & ~usadas
+
+        hora_salida[filas_pasada] = valor_salida
+        hora_llegada[filas_pasada] = valor_llegada
+        marco_salida[filas_pasada] = usa_salida
+        marco_llegada[filas_pasada] = usa_llegada
+
+    estado_salida = ESTADOS[_estados(salida, hora_salida, marco_salida, False,
+                                     alerta_segundos, incumplimiento_segundos)]
+    estado_llegada = ESTADOS[_estados(llegada, hora_llegada, marco_llegada, True,
+                                      alerta_segundos, incumplimiento_segundos)]
+
+    return [
+        (int(hs) if ms else None, int(hl) if ml else None, es, el)
+        for hs, hl, ms, ml, es, el in zip(hora_salida.tolist(), hora_llegada.tolist(),
+                                          marco_salida.tolist(), marco_llegada.tolist(),
+                                          estado_salida.tolist(), estado_llegada.tolist())
+    ]
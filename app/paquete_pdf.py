@@ -0,0 +1,88 @@
+import os
+import zipfile
+from datetime import datetime
+from concurrent.futures import wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from app import app
+from app.utils import generar_pdf_desde_html, BufferZip, PoolProcesos
+from app.cache_pdf import leer_pdf, guardar_pdf
+from flask import render_template
+
+#Exportación de un PDF por funcionario dentro de un ZIP.
+#El HTML se renderiza en el proceso web y la conversión a PDF (la parte lenta) se reparte en un pool
+#de procesos con PDF_ZIP_MAX_PROCESOS procesos (por defecto uno por núcleo).
+
+
+_pool = PoolProcesos()
+
+
+def iterar_zip_pdfs(documentos):
+    """Genera el ZIP por partes a partir de documentos (file_name, contexto, huella).
+       Los PDF que ya están en la cache se agregan directamente; el resto se convierte en el pool,
+       con a lo sumo dos PDF por proceso en curso para acotar la memoria. Los que no se pueden generar
+       (error de conversión o proceso del pool caído) se listan en errores.txt dentro del ZIP.
+       Debe recorrerse dentro del contexto de la aplicación (render_template)."""
+    salida = BufferZip()
+    procesos = app.config.get('PDF_ZIP_MAX_PROCESOS', os.cpu_count())
+    en_curso = {}
+    limite = 2 * procesos
+    errores = []
+    fecha_generacion = datetime.now().strftime('%d-%m-%Y %H:%M')
+
+    with zipfile.ZipFile(salida, 'w', compression=zipfile.ZIP_DEFLATED) as archivo_zip:
+        def agregar(file_name, pdf_bytes):
+            archivo_zip.writestr(zipfile.ZipInfo(file_name, datetime.now().timetuple()[:6]), pdf_bytes,
+                                 compress_type=zipfile.ZIP_DEFLATED)
+
+        def recibir(terminados):
+            for futuro in terminados:
+                file_name, huella, pool_usado = en_curso.pop(futuro)
+                try:
+                    pdf_bytes = futuro.result()
+                except Exception as error:
+                    #Una excepción acá cortaría el ZIP a la mitad: el archivo va a errores.txt.
+                    app.logger.error(f'Error generando {file_name} en el ZIP: {error!r}')
+                    if isinstance(error, BrokenProcessPool):
+                        _pool.descartar(pool_usado)
+                    pdf_bytes = None
+                if not pdf_bytes:
+                    errores.append(file_name)
+                    continue
+                guardar_pdf(huella, pdf_bytes)
+                agregar(file_name, pdf_bytes)
+
+        try:
+            for file_name, contexto, huella in documentos:
+                pdf_bytes = leer_pdf(huella)
+                if pdf_bytes is not None:
+                    agregar(file_name, pdf_bytes)
+                else:
+                    html_content = render_template('pdf_template.html', fecha_generacion=fecha_generacion, **contexto)
+                    pool = _pool.obtener(procesos)
+                    try:
+                        futuro = pool.submit(generar_pdf_desde_html, html_content)
+                    except BrokenProcessPool:
+                        #Un proceso del pool murió con un PDF anterior: se reintenta en un pool nuevo.
+                        _pool.descartar(pool)
+                        pool = _pool.obtener(procesos)
+                        futuro = pool.submit(generar_pdf_desde_html, html_content)
+                    en_curso[futuro] = (file_name, huella, pool)
+                    if len(en_curso) >= limite:
+                        terminados, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+                        recibir(terminados)
+                yield from salida.pendiente()
+
+            while en_curso:
+                terminados, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+                recibir(terminados)
+                yield from salida.pendiente()
+        finally:
+            #Si el cliente corta la descarga no seguimos convirtiendo lo que falta.
+            for futuro in en_curso:
+                futuro.cancel()
+
+        if errores:
+            app.logger.error(f'Error generando PDF en el ZIP: {", ".join(errores)}')
+            agregar('errores.txt', ('No se pudieron generar:\n' + '\n'.join(errores)).encode('utf-8'))
+
+    yield from salida.pendiente()
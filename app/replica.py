@@ -0,0 +1,153 @@
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.elements import TextClause
+
+#Réplica de lectura para los reportes.
+#Con REPLICA_DATABASE_URI configurada se agrega el bind 'replica' y las consultas SELECT de las
+#peticiones marcadas con usar_replica() (reportes, PDF, exportaciones) se mandan ahí; las escrituras,
+#el login y todo lo demás siguen en la base principal. Si la réplica está atrasada más de
+#REPLICA_MAX_RETRASO segundos o no responde, las lecturas vuelven a la principal hasta el próximo chequeo.
+#El pool de cada bind se configura con POOL_PRINCIPAL y POOL_REPLICA (pool_size, max_overflow,
+#pool_pre_ping, pool_recycle, pool_timeout).
+
+BIND_REPLICA = 'replica'
+MAX_RETRASO_DEFECTO = 10
+INTERVALO_CHEQUEO_DEFECTO = 5
+
+#Retraso en segundos de una réplica de PostgreSQL. Si ya reprodujo todo lo que recibió el retraso es 0
+#(sin esto, con la principal sin escrituras, el último replay parecería cada vez más viejo), pero solo si
+#el receptor de WAL está en streaming: con el receptor caído o reconectando no recibe nada nuevo y "reprodujo
+#todo" no dice nada del retraso, así que da NULL (atrasada). Un receptor trabado sin respuesta de la principal
+#sale de streaming al vencer wal_receiver_timeout. Sin el rol pg_read_all_stats la vista solo muestra que
+#el receptor existe (status NULL): en ese caso se lo toma como en streaming.
+_SQL_RETRASO = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE COALESCE(status, 'streaming') = 'streaming') THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+def configurar_motores(config):
+    """Arma SQLALCHEMY_ENGINE_OPTIONS y SQLALCHEMY_BINDS a partir de POOL_PRINCIPAL, REPLICA_DATABASE_URI
+       y POOL_REPLICA. Se llama antes de crear SQLAlchemy(app); lo que ya esté definido en Config se respeta."""
+    opciones = config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    for clave, valor in config.get('POOL_PRINCIPAL', {}).items():
+        opciones.setdefault(clave, valor)
+
+    uri_replica = config.get('REPLICA_DATABASE_URI')
+    binds = config.setdefault('SQLALCHEMY_BINDS', {})
+    if uri_replica and BIND_REPLICA not in binds:
+        binds[BIND_REPLICA] = {'url': uri_replica, **config.get('POOL_REPLICA', {})}
+
+
+def usar_replica():
+    """Manda a la réplica las lecturas del contexto actual (petición o app_context)."""
+    g.leer_en_replica = True
+
+
+def lectura(sql):
+    """Marca una consulta en texto (text()) como de solo lectura: SesionEnrutada la manda a la réplica
+       igual que a un SELECT del ORM. Sin la marca el SQL en texto va siempre a la principal."""
+    return sql.execution_options(solo_lectura=True)
+
+
+@contextmanager
+def en_principal():
+    """Fuerza la base principal dentro del bloque, aunque el contexto use la réplica."""
+    anterior = g.get('forzar_principal', False)
+    g.forzar_principal = True
+    try:
+        yield
+    finally:
+        g.forzar_principal = anterior
+
+
+_estado = {'retraso': None, 'chequeado': 0.0}
+_lock = threading.Lock()
+
+
+def _medir_retraso(motor):
+    if motor.dialect.name != 'postgresql':
+        return 0.0
+    with motor.connect() as conexion:
+        retraso = conexion.execute(_SQL_RETRASO).scalar()
+    #NULL: la réplica no está recibiendo WAL, se la trata como atrasada sin límite.
+    return float('inf') if retraso is None else float(retraso)
+
+
+def retraso_replica():
+    """Retraso de la réplica en segundos (None si no está configurada o no respondió).
+       Se mide a lo sumo una vez cada REPLICA_INTERVALO_CHEQUEO segundos por proceso."""
+    motor = current_app.extensions['sqlalchemy'].engines.get(BIND_REPLICA)
+    if motor is None:
+        return None
+
+    ahora = time.time()
+    intervalo = current_app.config.get('REPLICA_INTERVALO_CHEQUEO', INTERVALO_CHEQUEO_DEFECTO)
+    with _lock:
+        if ahora - _estado['chequeado'] < intervalo:
+            return _estado['retraso']
+        #Los demás hilos usan el valor anterior mientras este mide.
+        _estado['chequeado'] = ahora
+
+    try:
+        retraso = _medir_retraso(motor)
+    except Exception as e:
+        current_app.logger.warning(f'Réplica no disponible, se lee de la base principal: {e}')
+        retraso = None
+    else:
+        if retraso == float('inf'):
+            current_app.logger.warning('Réplica sin recibir WAL de la principal, se lee de la base principal')
+        elif retraso > current_app.config.get('REPLICA_MAX_RETRASO', MAX_RETRASO_DEFECTO):
+            current_app.logger.warning(f'Réplica atrasada {retraso:.1f} s, se lee de la base principal')
+
+    with _lock:
+        _estado['retraso'] = retraso
+    return retraso
+
+
+def _replica_al_dia():
+    retraso = retraso_replica()
+    return retraso is not None and retraso <= current_app.config.get('REPLICA_MAX_RETRASO', MAX_RETRASO_DEFECTO)
+
+
+def _lee_en_replica():
+    return has_app_context() and g.get('leer_en_replica', False) and not g.get('forzar_principal', False)
+
+
+def retraso_lectura():
+    """Segundos de atraso de los datos que lee el contexto actual (0 si lee de la principal).
+       La cache de reportes lo usa para no guardar como nuevo un cálculo hecho con datos atrasados."""
+    if not _lee_en_replica() or not _replica_al_dia():
+        return 0.0
+    return _estado['retraso'] or 0.0
+
+
+def _es_lectura(clause):
+    if isinstance(clause, Select):
+        return clause._for_update_arg is None
+    return isinstance(clause, TextClause) and clause.get_execution_options().get('solo_lectura', False)
+
+
+class SesionEnrutada(Session):
+    """Sesión que manda los SELECT a la réplica cuando el contexto lo pide y la réplica está al día.
+       Los flush, INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE y el SQL en texto sin la marca de lectura()
+       van siempre a la principal, y después de la primera escritura la sesión ya no lee de la réplica
+       (para leer lo que escribió)."""
+
+    escribio = False
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if self._flushing or getattr(clause, 'is_dml', False):
+            self.escribio = True
+        elif bind is None and not self.escribio and _es_lectura(clause) and _lee_en_replica() and _replica_al_dia():
+            return self._db.engines[BIND_REPLICA]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
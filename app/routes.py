@@ -1,12 +1,39 @@
 from app import app, db
-from app.services import obtener_reporte_salidas_procesado, obtener_reporte_salidas_funcionario, preparar_reporte_para_pdf
+from app.services import obtener_reporte_salidas_procesado, obtener_reporte_salidas_funcionario, preparar_datos_pdf, generar_pdf_reporte, \
+    datos_pdf_por_lotes, abrir_pdf_por_lotes, documentos_pdf_por_funcionario, datos_exportacion, \
+    iterar_reporte_salidas_procesado, obtener_pagina_reporte_salidas, obtener_resumen_salidas
+from app.utils import agrupar_fragmentos
+from app.cache_reportes import invalidar_reportes
+from app.identidad import invalidar_identidad
+from app.verificacion import verificar_login, LoginOcupado
+from app.paquete_pdf import iterar_zip_pdfs
+from app.exportacion import iterar_csv, iterar_xlsx
+from app.replica import usar_replica
+from app.instrumentacion import instrumentado
+from app.metricas import exponer
+from app.trabajos_pdf import enviar_trabajo_pdf, obtener_estado_trabajo, ruta_resultado, ColaPdfLlena, LISTO
 from app.models import FormularioSalida, Usuario, MarcacionIntermediaGeneral
 from app.forms import CargarSalidaForm, LoginForm, FiltroReporteForm
-from flask import render_template, redirect, url_for, flash, request, make_response
+from flask import render_template, redirect, url_for, flash, request, make_response, stream_template, send_file, jsonify, \
+    stream_with_context, abort
 from flask_login import current_user, login_required, logout_user, login_user
 from datetime import date, datetime
 from urllib.parse import urlparse
 import sqlalchemy as sa
+import hmac
+
+#Vistas de solo lectura cuyas consultas van a la réplica (si está configurada y al día).
+ENDPOINTS_REPLICA = {'registro_salidas', 'registro_salidas_funcionario', 'descargar_pdf', 'descargar_csv',
+                     'descargar_xlsx', 'descargar_pdf_funcionarios'}
+
+def _es_administrador():
+    """Mismo criterio que muestra el panel de administración en index.html."""
+    return current_user.tipousuario == '1' or current_user.cedula == '6556063'
+
+@app.before_request
+def enrutar_lecturas():
+    if request.endpoint in ENDPOINTS_REPLICA:
+        usar_replica()
 
 @app.route('/')
 @app.route('/index')
@@ -33,6 +60,8 @@ def formulario_salidas():
         )
         db.session.add(formulario)
         db.session.commit()
+        #Los reportes en cache que incluyen esta fecha ya no están completos.
+        invalidar_reportes(formulario.fecha)
 
         flash('Formulario enviado exitosamente, podrá revisar el registro mañana.', 'success')
 
@@ -43,6 +72,7 @@ def formulario_salidas():
 #RUTA PARA QUE EL ADMINISTRADOR VEA LAS ESTADISTICAS TOTALES DE SALIDAS DENTRO DEL HORARIO LABORAL.
 @app.route('/registro_salidas', methods=['GET'])
 @login_required
+@instrumentado
 def registro_salidas():
     #Le pasamos request.args al formulario (para que mantenga los valores en la URL)
     form = FiltroReporteForm(request.args)
@@ -54,8 +84,32 @@ def registro_salidas():
     
     #Cuando el formulario usa metodos get se utiliza el form.validate()
     if form.validate() and form.validar_fechas():
+        #Modo paginado: se pide con el parámetro por_pagina (y cursor para moverse entre páginas).
+        por_pagina = request.args.get('por_pagina', type=int)
+
+        #Modo streaming: las filas se envían a medida que se procesan y el resumen llega al final.
+        if not por_pagina and not form.solo_resumen.data and app.config.get('REPORTE_STREAMING', False):
+            return _registro_salidas_streaming(form)
+
         try:
             #--- Llamada al servicio ---
+            #Modo solo resumen: no se arman los registros de detalle.
+            if form.solo_resumen.data:
+                resumen_estadistico = obtener_resumen_salidas(
+                    form.fecha_desde.data, form.fecha_hasta.data, form.cedula.data or None)
+
+                return render_template('registro_salidas.html', registros=[],
+                                    form=form, resumen=resumen_estadistico, solo_resumen=True)
+
+            if por_pagina:
+                registros, resumen_estadistico, paginacion = obtener_pagina_reporte_salidas(
+                    form.fecha_desde.data, form.fecha_hasta.data, form.cedula.data or None,
+                    cursor=request.args.get('cursor'), por_pagina=por_pagina)
+
+                return render_template('registro_salidas.html', registros=registros,
+                                    form=form, resumen=resumen_estadistico,
+                                    paginacion=paginacion, por_pagina=por_pagina)
+
             registros, resumen_estadistico = obtener_reporte_salidas_procesado(
                 form.fecha_desde.data, form.fecha_hasta.data, form.cedula.data or None)
         
@@ -70,9 +124,28 @@ def registro_salidas():
     return render_template('registro_salidas.html', registros=[],
                                 form=form, resumen=[])
 
+def _registro_salidas_streaming(form):
+    """Responde el reporte por partes, sin armar la lista de registros en memoria."""
+    resumen_estadistico = []
+    registros = iterar_reporte_salidas_procesado(
+        form.fecha_desde.data, form.fecha_hasta.data, form.cedula.data or None, resumen=resumen_estadistico)
+    #stream_template conserva el contexto de la petición mientras se envía la respuesta.
+    fragmentos = stream_template('registro_salidas.html', registros=registros,
+                                 form=form, resumen=resumen_estadistico, streaming=True)
+
+    def generar():
+        try:
+            yield from agrupar_fragmentos(fragmentos)
+        except Exception as e:
+            #Los encabezados ya fueron enviados: solo podemos registrar el error y cortar la respuesta.
+            app.logger.error(f'Error generando reporte: {e}')
+
+    return app.response_class(generar())
+
 #RUTA PARA QUE EL FUNCIONARIO VEA SUS PROPIAS SALIDAS DENTRO DEL HORARIO LABORAL REGISTRADAS.
 @app.route('/registro_salidas_funcionario', methods=['GET'])
 @login_required
+@instrumentado
 def registro_salidas_funcionario():
         #Le pasamos request.args al formulario (para que mantenga los valores en la URL).
         form = FiltroReporteForm(request.args)
@@ -97,6 +170,18 @@ def registro_salidas_funcionario():
         #Si llega hasta acá es porque validate() falló o hubo una excepción.
         return render_template('registro_salidas_funcionario.html', registros=[], form=form)
 
+#RUTA PARA PROMETHEUS: MÉTRICAS DE TODOS LOS WORKERS (VER app/metricas.py).
+@app.route('/metrics')
+def metrics():
+    #Sin sesión: el scraper manda METRICAS_TOKEN como "Authorization: Bearer <token>".
+    #Sin token configurado la ruta responde 404: las métricas no se publican sin control de acceso.
+    token = app.config.get('METRICAS_TOKEN')
+    if not app.config.get('METRICAS', True) or not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(403)
+    return app.response_class(exponer(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 #RUTAS PARA INICIAR Y CERRAR SESIÓN.
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -108,8 +193,16 @@ def login():
         #Buscamos el usuario por cedula en la tabla de asistencias.
         user = Usuario.query.filter_by(cedula=form.ci.data).first()
 
-        #Usamos nuestra funcion personalizada check_password para validar la contraseña.
-        if user and user.check_password(form.password.data):
+        #Validamos la contraseña (hash de Django) en el pool de verificación, fuera de este hilo.
+        try:
+            valido = user is not None and verificar_login(user.cedula, user.password, form.password.data)
+        except LoginOcupado:
+            flash('Hay muchos inicios de sesión en este momento. Intente nuevamente en unos segundos.', 'warning')
+            return render_template('login.html', form=form), 503
+
+        if valido:
+            #Al iniciar sesión se descartan los datos cacheados: se leen de nuevo de la base.
+            invalidar_identidad(user.cedula)
             login_user(user)
             flash('Inicio de sesión exitoso.', 'success')
 
@@ -125,6 +218,7 @@ def login():
 @app.route('/logout')
 @login_required
 def logout():
+    invalidar_identidad(current_user.cedula)
     logout_user()
     flash('Has cerrado sesión correctamente.', 'success')
     return redirect(url_for('login'))
@@ -132,6 +226,7 @@ def logout():
 #RUTA PARA DESCARGAR PDF.
 @app.route('/descargar_pdf')
 @login_required
+@instrumentado
 def descargar_pdf():
     form = FiltroReporteForm(request.args)
     tipo = request.args.get('tipo', 'admin')
@@ -145,9 +240,26 @@ def descargar_pdf():
         flash('Fechas inválidas. Intente nuevamente.', 'warning')
         return redirect(request.referrer or url_for('index'))
     
+    #Modo asíncrono: el PDF se genera en segundo plano y el usuario espera en la página del trabajo.
+    if app.config.get('PDF_ASINCRONO', False):
+        try:
+            id_trabajo = enviar_trabajo_pdf(tipo, form.fecha_desde.data, form.fecha_hasta.data,
+                                            form.cedula.data or None, current_user)
+            return redirect(url_for('trabajo_pdf', id_trabajo=id_trabajo))
+        except ColaPdfLlena:
+            flash('Hay demasiados PDF generándose en este momento. Intente nuevamente en unos minutos.', 'warning')
+        except Exception as e:
+            app.logger.error(f'Error encolando PDF: {e}')
+            flash('Ocurrió un error al generar el PDF. Intente nuevamente.', 'danger')
+        return redirect(request.referrer or url_for('index'))
+
     try:
-        #Llamada al servicio para generar el PDF.
-        pdf_bytes, file_name = preparar_reporte_para_pdf(
+        #Modo por lotes: para reportes muy grandes, el PDF se arma por partes en disco.
+        if app.config.get('PDF_POR_LOTES', False):
+            return _descargar_pdf_por_lotes(form, tipo)
+
+        #Llamada al servicio para obtener los datos del PDF.
+        contexto, file_name, huella = preparar_datos_pdf(
             tipo=tipo,
             fecha_desde=form.fecha_desde.data,
             fecha_hasta=form.fecha_hasta.data,
@@ -155,6 +267,14 @@ def descargar_pdf():
             usuario_actual=current_user
         )
 
+        #Si el navegador ya tiene este mismo PDF (mismo ETag) no hace falta enviarlo de nuevo.
+        if huella in request.if_none_match:
+            response = make_response('', 304)
+            response.set_etag(huella)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+        pdf_bytes = generar_pdf_reporte(contexto, huella)
         if not pdf_bytes:
             raise Exception("El generador de PDF devolvió un contenido vacío.")
         
@@ -162,9 +282,151 @@ def descargar_pdf():
         response = make_response(pdf_bytes)
         response.headers['Content-Type'] = 'application/pdf'
         response.headers['Content-Disposition'] = f'attachment; filename={file_name}'
+        #El ETag es la huella del contenido: el navegador revalida en cada descarga.
+        response.set_etag(huella)
+        response.headers['Cache-Control'] = 'private, no-cache'
         return response
     
     except Exception as e:
         app.logger.error(f'Error descargando PDF: {e}')
         flash('Ocurrió un error al generar el PDF. Intente nuevamente.', 'danger')
-        return redirect(request.referrer or url_for('index'))  
\ No newline at end of file
+        return redirect(request.referrer or url_for('index'))
+
+#RUTAS PARA DESCARGAR EL REPORTE EN CSV Y XLSX (PARA PLANILLAS DE CÁLCULO).
+FORMATOS_EXPORTACION = {
+    'csv': (iterar_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (iterar_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+@app.route('/descargar_csv')
+@login_required
+def descargar_csv():
+    return _descargar_exportacion('csv')
+
+@app.route('/descargar_xlsx')
+@login_required
+def descargar_xlsx():
+    return _descargar_exportacion('xlsx')
+
+def _descargar_exportacion(formato):
+    """Envía el reporte en el formato pedido a medida que se genera."""
+    form = FiltroReporteForm(request.args)
+    tipo = request.args.get('tipo', 'admin')
+    #Solo el reporte propio (tipo funcionario) está abierto a todos los usuarios.
+    if tipo != 'funcionario' and not _es_administrador():
+        abort(403)
+
+    #Validaciones de entrada.
+    if not request.args:
+        flash('Debe especificar un rango de fechas', 'warning')
+        return redirect(url_for('index'))
+
+    if not form.validate() or not form.validar_fechas():
+        flash('Fechas inválidas. Intente nuevamente.', 'warning')
+        return redirect(request.referrer or url_for('index'))
+
+    iterar, mimetype = FORMATOS_EXPORTACION[formato]
+    columnas, filas, columnas_resumen, filas_resumen, nombre_base = datos_exportacion(
+        tipo, form.fecha_desde.data, form.fecha_hasta.data, form.cedula.data or None, current_user)
+
+    def generar():
+        try:
+            yield from iterar(columnas, filas, columnas_resumen, filas_resumen)
+        except Exception as e:
+            #Los encabezados ya fueron enviados: solo podemos registrar el error y cortar la respuesta.
+            app.logger.error(f'Error exportando reporte: {e}')
+
+    return app.response_class(stream_with_context(generar()), mimetype=mimetype,
+                              headers={'Content-Disposition': f'attachment; filename={nombre_base}.{formato}'})
+
+#RUTA PARA DESCARGAR UN ZIP CON EL PDF INDIVIDUAL DE CADA FUNCIONARIO.
+@app.route('/descargar_pdf_funcionarios')
+@login_required
+def descargar_pdf_funcionarios():
+    #Trae los PDF de todos los funcionarios: solo para administradores.
+    if not _es_administrador():
+        abort(403)
+    form = FiltroReporteForm(request.args)
+
+    #Validaciones de entrada.
+    if not request.args:
+        flash('Debe especificar un rango de fechas', 'warning')
+        return redirect(url_for('index'))
+
+    if not form.validate() or not form.validar_fechas():
+        flash('Fechas inválidas. Intente nuevamente.', 'warning')
+        return redirect(request.referrer or url_for('index'))
+
+    try:
+        #Una sola pasada del reporte para todos los funcionarios; los PDF se generan mientras se envía el ZIP.
+        documentos = documentos_pdf_por_funcionario(form.fecha_desde.data, form.fecha_hasta.data,
+                                                    form.cedula.data or None)
+    except Exception as e:
+        app.logger.error(f'Error descargando PDF por funcionario: {e}')
+        flash('Ocurrió un error al generar los PDF. Intente nuevamente.', 'danger')
+        return redirect(request.referrer or url_for('index'))
+
+    file_name = f"Salidas_Funcionarios_{form.fecha_desde.data}_{form.fecha_hasta.data}.zip"
+    return app.response_class(stream_with_context(iterar_zip_pdfs(documentos)), mimetype='application/zip',
+                              headers={'Content-Disposition': f'attachment; filename={file_name}'})
+
+def _descargar_pdf_por_lotes(form, tipo):
+    """Envía el PDF armado por lotes desde el archivo, sin cargarlo en memoria."""
+    parametros = dict(tipo=tipo, fecha_desde=form.fecha_desde.data, fecha_hasta=form.fecha_hasta.data,
+                      cedula_filtro=form.cedula.data or None, usuario_actual=current_user)
+    #Una sola pasada por el reporte: la huella (ETag) sale de la misma lectura que después se renderiza.
+    with datos_pdf_por_lotes(**parametros) as datos:
+        #Si el navegador ya tiene este mismo PDF (mismo ETag) no hace falta generarlo.
+        if datos['huella'] in request.if_none_match:
+            response = make_response('', 304)
+        else:
+            response = send_file(abrir_pdf_por_lotes(datos), mimetype='application/pdf',
+                                 as_attachment=True, download_name=datos['file_name'], max_age=0)
+    response.set_etag(datos['huella'])
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _trabajo_del_usuario(id_trabajo):
+    """Retorna el estado del trabajo si existe y pertenece al usuario logueado (None si no)."""
+    estado = obtener_estado_trabajo(id_trabajo)
+    if estado is None or estado['cedula_usuario'] != current_user.cedula:
+        return None
+    return estado
+
+#RUTAS DE LOS TRABAJOS DE PDF EN SEGUNDO PLANO.
+@app.route('/trabajos_pdf/<id_trabajo>')
+@login_required
+def trabajo_pdf(id_trabajo):
+    estado = _trabajo_del_usuario(id_trabajo)
+    if estado is None:
+        flash('El PDF solicitado no existe o ya venció. Genérelo nuevamente.', 'warning')
+        return redirect(url_for('index'))
+
+    if estado['estado'] == LISTO:
+        return redirect(url_for('descargar_trabajo_pdf', id_trabajo=id_trabajo))
+    return render_template('trabajo_pdf.html', id_trabajo=id_trabajo, estado=estado)
+
+@app.route('/trabajos_pdf/<id_trabajo>/estado')
+@login_required
+def estado_trabajo_pdf(id_trabajo):
+    estado = _trabajo_del_usuario(id_trabajo)
+    if estado is None:
+        return jsonify({'estado': 'no_existe'}), 404
+
+    respuesta = {'estado': estado['estado']}
+    if estado['estado'] == LISTO:
+        respuesta['descarga'] = url_for('descargar_trabajo_pdf', id_trabajo=id_trabajo)
+    return jsonify(respuesta)
+
+@app.route('/trabajos_pdf/<id_trabajo>/descargar')
+@login_required
+def descargar_trabajo_pdf(id_trabajo):
+    estado = _trabajo_del_usuario(id_trabajo)
+    if estado is None or estado['estado'] != LISTO:
+        flash('El PDF solicitado no está disponible.', 'warning')
+        return redirect(url_for('index'))
+
+    response = send_file(ruta_resultado(id_trabajo), mimetype='application/pdf', as_attachment=True,
+                         download_name=estado['nombre_archivo'], etag=estado['huella'], max_age=0)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
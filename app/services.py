@@ -1,50 +1,56 @@
-from datetime import datetime, timedelta, date, time
-from app.models import FormularioSalida
-from app.utils import generar_pdf_desde_html
-from flask import render_template
-
-def _obtener_hora_cercana(hora_estipulada, lista_marcaciones, rango_minutos=60, filtrar=True):
-    """Busca la hora mas cercana en la lista."""
-    if not hora_estipulada or not lista_marcaciones:
-        return None
-    
-    # LIMPIEZA: Quitamos cualquier None de la lista antes de ordenar
-    lista_limpia = [h for h in lista_marcaciones if h is not None]
-    
-    if not lista_limpia:
-        return None
-
-    lista_procesada = lista_limpia
-    if filtrar:
-        if len(lista_limpia) <= 2:
-            return None
-        lista_ordenada = sorted(lista_limpia) # Ahora es seguro ordenar
-        lista_procesada = lista_ordenada[1:-1]
-
-    if not lista_procesada:
+import os
+import json
+import tempfile
+import threading
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import datetime, date, time, timedelta
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from bisect import bisect_left, bisect_right
+from itertools import groupby
+from sqlalchemy import insert, delete
+from app import app, db
+from app.models import FormularioSalida, ResultadoSalida, ControlProceso, dias_con_marcaciones_modificadas, \
+    leer_marcaciones_de_tabla, marcaciones_por_dia, emparejamiento_en_base, emparejar_dias_en_base
+from app.utils import generar_pdf_desde_html, generar_pdf_a_archivo, unir_pdfs, en_lotes, PoolProcesos
+from app.motor_vectorizado import emparejar_lote
+from app.marcaciones import obtener_marcaciones_segundos
+from app.cache_reportes import llave_reporte, obtener_o_calcular, consultar, invalidar_reportes
+from app.instrumentacion import fase
+from app.metricas import observar, registrar_emparejamiento
+from app.replica import usar_replica
+from app.cache_pdf import huella_reporte, leer_pdf, guardar_pdf, nueva_huella, agregar_a_huella, directorio_pdf, \
+    abrir_pdf, guardar_archivo_pdf
+from flask import render_template, g
+
+def _obtener_hora_cercana(hora_estipulada, horas_disponibles, rango_minutos=60):
+    """Busca la hora mas cercana entre las marcaciones intermedias.
+       horas_disponibles es la lista ordenada (en segundos) de las marcaciones no usadas del dia;
+       la primera y la ultima (entrada y salida del trabajo) no se consideran."""
+    if hora_estipulada is None or len(horas_disponibles) <= 2:
         return None
 
-    dummy_date = datetime(2000, 1, 1)
-    target_dt = datetime.combine(dummy_date, hora_estipulada)
+    #Busqueda binaria dentro de horas_disponibles[1:-1].
+    inicio, fin = 1, len(horas_disponibles) - 1
+    posicion = bisect_left(horas_disponibles, hora_estipulada, inicio, fin)
 
     mejor_match = None
-    # Usamos un delta muy grande inicial para la comparación
-    min_delta_seconds = rango_minutos * 60 
+    min_delta_seconds = rango_minutos * 60
 
-    for marcacion in lista_procesada:
-        if marcacion is None:
-            continue
+    #Candidata anterior a la hora estipulada.
+    if posicion > inicio:
+        anterior = horas_disponibles[posicion - 1]
+        if hora_estipulada - anterior <= min_delta_seconds:
+            min_delta_seconds = hora_estipulada - anterior
+            mejor_match = anterior
 
-        # Blindaje: asegurar que marcacion sea objeto time/datetime
-        try:
-            marcacion_dt = datetime.combine(dummy_date, marcacion)
-            diff_seconds = abs((marcacion_dt - target_dt).total_seconds())
-            
-            if diff_seconds <= min_delta_seconds:
-                min_delta_seconds = diff_seconds
-                mejor_match = marcacion
-        except Exception:
-            continue
+    #Candidata posterior (en caso de empate gana la posterior).
+    if posicion < fin:
+        posterior = horas_disponibles[posicion]
+        if posterior - hora_estipulada <= min_delta_seconds:
+            mejor_match = posterior
 
     return mejor_match
 
@@ -52,32 +58,25 @@ def _obtener_hora_cercana(hora_estipulada, lista_marcaciones, rango_minutos=60,
 TOLERANCIA_ALERTA = 15
 TOLERANCIA_INCUMPLIMIENTO = 60
 def _calcular_estado_marcacion(hora_estipulada, hora_marcacion, es_llegada=False):
-    """Retorna el ESTADO semántico (cumplio, alerta, incumplio, no_marco)"""
-    if not hora_marcacion:
-        return 'no_marco'
-    
-    try:
-        dummy = date.today()
-        dt_est = datetime.combine(dummy, hora_estipulada)
-        dt_marcacion = datetime.combine(dummy, hora_marcacion)
-        
-        if es_llegada and dt_marcacion < dt_est:
-            # Si es llegada y marcó antes de la hora estipulada, consideramos que cumplió.
-            return 'cumplio'
-
-        # Calculamos la diferencia absoluta en minutos (usando números puros)
-        diff_segundos = abs((dt_marcacion - dt_est).total_seconds())
-        diferencia_minutos = diff_segundos / 60
-
-        if diferencia_minutos >= TOLERANCIA_INCUMPLIMIENTO:
-            return 'incumplio'
-        elif diferencia_minutos >= TOLERANCIA_ALERTA:
-            return 'alerta'
-        else:
-            return 'cumplio'
-    except Exception:
+    """Retorna el ESTADO semántico (cumplio, alerta, incumplio, no_marco).
+       Las horas se reciben en segundos del día."""
+    if hora_marcacion is None:
         return 'no_marco'
 
+    if es_llegada and hora_marcacion < hora_estipulada:
+        # Si es llegada y marcó antes de la hora estipulada, consideramos que cumplió.
+        return 'cumplio'
+
+    # Calculamos la diferencia absoluta en minutos (usando números puros)
+    diferencia_minutos = abs(hora_marcacion - hora_estipulada) / 60
+
+    if diferencia_minutos >= TOLERANCIA_INCUMPLIMIENTO:
+        return 'incumplio'
+    elif diferencia_minutos >= TOLERANCIA_ALERTA:
+        return 'alerta'
+    else:
+        return 'cumplio'
+
 def _inicializar_estadisticas_funcionario(usuario):
     """Inicializa el diccionario de estadísticas para un funcionario."""
     return {
@@ -98,115 +97,290 @@ def _actualizar_estado_estadisticas(estadisticas, estado):
     else:
         estadisticas['cumplio'] += 1
 
-def _procesar_hora_unica(hora_salida_estipulada, hora_llegada_estipulada, hora_salida_cercana, hora_llegada_cercana, horas_usadas_set, cedula, fecha):
-    """Funcion auxiliar para procesar una única hora (salida o llegada)."""
-    dummy = date.today()
-    estado_llegada = 'no_marco'
-    estado_salida = 'no_marco'
-
+def _procesar_hora_unica(hora_salida_estipulada, hora_llegada_estipulada, hora_salida_cercana, hora_llegada_cercana):
+    """Funcion auxiliar para procesar una única hora (salida o llegada).
+       La hora se asigna a la estipulada que tenga más cerca."""
     #Calculamos la distancia con la salida y la llegada.
-    diff_salida = abs((datetime.combine(dummy, hora_salida_cercana) - datetime.combine(dummy, hora_salida_estipulada)).total_seconds()) if hora_salida_cercana else float('inf')
-    diff_llegada = abs((datetime.combine(dummy, hora_llegada_cercana) - datetime.combine(dummy, hora_llegada_estipulada)).total_seconds()) if hora_llegada_cercana else float('inf')
+    diff_salida = abs(hora_salida_cercana - hora_salida_estipulada) if hora_salida_cercana is not None else float('inf')
+    diff_llegada = abs(hora_llegada_cercana - hora_llegada_estipulada) if hora_llegada_cercana is not None else float('inf')
 
     if diff_salida <= diff_llegada:
-        hora_llegada_cercana = None
-        estado_salida = _calcular_estado_marcacion(hora_salida_estipulada, hora_salida_cercana, es_llegada=False)
-    else:
-        hora_salida_cercana = None
-        estado_llegada = _calcular_estado_marcacion(hora_llegada_estipulada, hora_llegada_cercana, es_llegada=True)
-
-
-    horas_usadas_set.add((cedula, fecha, hora_salida_cercana if hora_salida_cercana else hora_llegada_cercana))
-
+        return (hora_salida_cercana, None,
+                _calcular_estado_marcacion(hora_salida_estipulada, hora_salida_cercana, es_llegada=False), 'no_marco')
+    return (None, hora_llegada_cercana,
+            'no_marco', _calcular_estado_marcacion(hora_llegada_estipulada, hora_llegada_cercana, es_llegada=True))
+
+def _quitar_hora(horas_disponibles, hora, todas=False):
+    """Quita una copia (o todas las copias) de la hora de la lista ordenada."""
+    posicion = bisect_left(horas_disponibles, hora)
+    hasta = bisect_right(horas_disponibles, hora, posicion) if todas else posicion + 1
+    del horas_disponibles[posicion:hasta]
+
+def _procesar_marcaciones(hora_salida_estipulada, hora_llegada_estipulada, horas_disponibles):
+    """Función auxiliar para procesar las marcaciones de un formulario.
+       Recibe las horas estipuladas y la lista ordenada de marcaciones disponibles del dia (en segundos)
+       y retorna (hora_salida_cercana, hora_llegada_cercana, estado_salida, estado_llegada).
+       Las marcaciones asignadas se quitan de la lista para los siguientes formularios del mismo dia."""
+    # Verificamos que el formulario tenga las horas estipuladas
+    if hora_salida_estipulada is None or hora_llegada_estipulada is None:
+        return None, None, 'no_marco', 'no_marco'
+
+    # ---- CASO ESPECIAL: Si solo hay una hora intermedia disponible ----
+    if len(horas_disponibles) == 3:
+        resultado = _procesar_hora_unica(
+            hora_salida_estipulada,
+            hora_llegada_estipulada,
+            _obtener_hora_cercana(hora_salida_estipulada, horas_disponibles),
+            _obtener_hora_cercana(hora_llegada_estipulada, horas_disponibles),
+        )
+        hora_usada = resultado[0] if resultado[0] is not None else resultado[1]
+        if hora_usada is not None:
+            _quitar_hora(horas_disponibles, hora_usada, todas=True)
+        return resultado
+
+    # ---- SALIDA ----
+    hora_salida_cercana = _obtener_hora_cercana(hora_salida_estipulada, horas_disponibles)
+    estado_salida = _calcular_estado_marcacion(hora_salida_estipulada, hora_salida_cercana, es_llegada=False)
+    if hora_salida_cercana is not None:
+        #La llegada no puede usar la misma marcación (sí otra copia de la misma hora).
+        _quitar_hora(horas_disponibles, hora_salida_cercana)
+
+    # ---- LLEGADA ----
+    hora_llegada_cercana = _obtener_hora_cercana(hora_llegada_estipulada, horas_disponibles)
+    estado_llegada = _calcular_estado_marcacion(hora_llegada_estipulada, hora_llegada_cercana, es_llegada=True)
+
+    #Las horas usadas ya no están disponibles para los siguientes formularios del dia.
+    for hora_usada in (hora_salida_cercana, hora_llegada_cercana):
+        if hora_usada is not None:
+            _quitar_hora(horas_disponibles, hora_usada, todas=True)
+
+    return hora_salida_cercana, hora_llegada_cercana, estado_salida, estado_llegada
+
+def emparejar_por_dia(filas):
+    """Procesa las filas (llave_dia, salida, llegada, marcaciones) una por una, en el orden del reporte.
+       Mantiene una lista ordenada de marcaciones disponibles por cada (cedula, fecha); como las filas
+       vienen agrupadas por fecha, el estado de un dia se libera apenas aparece la fecha siguiente.
+       Es un generador: produce el resultado de cada fila apenas se procesa."""
+    dias = {}
+    fecha_actual = None
+
+    for llave_dia, hora_salida_estipulada, hora_llegada_estipulada, marcas in filas:
+        if llave_dia[1] != fecha_actual:
+            dias.clear()
+            fecha_actual = llave_dia[1]
+
+        horas_disponibles = dias.get(llave_dia)
+        if horas_disponibles is None:
+            horas_disponibles = dias[llave_dia] = list(marcas)
+
+        yield _procesar_marcaciones(hora_salida_estipulada, hora_llegada_estipulada, horas_disponibles)
+
+#Emparejamiento en varios procesos para los reportes grandes (EMPAREJAMIENTO_PROCESOS, por defecto 0 = apagado).
+#Las marcaciones usadas son por (cedula, dia): las filas se reparten por ci_nro en tantas partes como procesos,
+#equilibradas por cantidad de filas, y cada parte conserva el orden del reporte. A los procesos se envían
+#tuplas de números (cedula y fecha reemplazadas por enteros), no objetos del ORM, y los resultados vuelven a
+#su posición original; registros y estadísticas se arman después en el proceso web como siempre.
+#Por debajo de EMPAREJAMIENTO_PROCESOS_MINIMO filas se empareja en el mismo proceso: serializar y enviar
+#las filas cuesta más que lo que se gana.
+PROCESOS_MINIMO_DEFECTO = 50000
+_pool_procesos = PoolProcesos()
+
+def _emparejar_parte(filas, por_dia):
+    """Se ejecuta en un proceso del pool: empareja una parte de las filas con el motor indicado."""
+    if por_dia:
+        return list(emparejar_por_dia(filas))
+    return emparejar_lote(filas)
+
+def _repartir_por_cedula(filas, partes):
+    """Reparte las filas por cedula en partes de tamaño parecido (la cedula con más filas va a la parte
+       con menos filas). Retorna una lista de (posiciones, filas compactas) por parte."""
+    filas_por_cedula = {}
+    for posicion, fila in enumerate(filas):
+        filas_por_cedula.setdefault(fila[0][0], []).append(posicion)
+
+    cargas = [0] * partes
+    parte_de_cedula = {}
+    for numero, (cedula, posiciones) in enumerate(sorted(filas_por_cedula.items(), key=lambda par: -len(par[1]))):
+        parte = cargas.index(min(cargas))
+        parte_de_cedula[cedula] = (parte, numero)
+        cargas[parte] += len(posiciones)
+
+    repartidas = [([], []) for _ in range(partes)]
+    for posicion, ((cedula, fecha), salida, llegada, marcas) in enumerate(filas):
+        parte, numero = parte_de_cedula[cedula]
+        posiciones, compactas = repartidas[parte]
+        posiciones.append(posicion)
+        compactas.append(((numero, fecha.toordinal()), salida, llegada, tuple(marcas)))
+    return [parte for parte in repartidas if parte[0]]
+
+def _emparejar_en_procesos(filas, procesos, por_dia):
+    """Empareja las partes en el pool de procesos y retorna los resultados en el orden de las filas."""
+    emparejados = [None] * len(filas)
+    partes = _repartir_por_cedula(filas, procesos)
+    pool = _pool_procesos.obtener(procesos)
+    try:
+        futuros = [(posiciones, pool.submit(_emparejar_parte, compactas, por_dia)) for posiciones, compactas in partes]
+        for posiciones, futuro in futuros:
+            for posicion, resultado in zip(posiciones, futuro.result()):
+                emparejados[posicion] = resultado
+    except BrokenProcessPool as error:
+        #Murió un proceso hijo: se cierra este pool y el próximo reporte usa otro.
+        _pool_procesos.descartar(pool)
+        app.logger.error(f'Error en el pool de emparejamiento, se empareja en el proceso web: {error}')
+        return _emparejar_parte(filas, por_dia)
+    return emparejados
+
+def _emparejar(filas):
+    """Ejecuta el motor de emparejamiento configurado (MOTOR_EMPAREJAMIENTO) sobre todas las filas.
+       'vectorizado' (por defecto) usa NumPy; 'por_dia' usa el procesamiento fila por fila.
+       Con EMPAREJAMIENTO_PROCESOS los reportes grandes se reparten en un pool de procesos."""
+    por_dia = app.config.get('MOTOR_EMPAREJAMIENTO', 'vectorizado') == 'por_dia'
+    procesos = app.config.get('EMPAREJAMIENTO_PROCESOS', 0)
+    if procesos > 1:
+        filas = list(filas)
+        if len(filas) >= app.config.get('EMPAREJAMIENTO_PROCESOS_MINIMO', PROCESOS_MINIMO_DEFECTO):
+            return _emparejar_en_procesos(filas, procesos, por_dia)
+    if por_dia:
+        return list(emparejar_por_dia(filas))
+    return emparejar_lote(list(filas))
+
+def _emparejar_formularios(resultados):
+    """Retorna el resultado del emparejamiento de cada fila (formulario, marcacion, ...), en el mismo orden.
+       Con MOTOR_EMPAREJAMIENTO = 'sql' se calcula en la base y solo se traen los resultados."""
+    with fase('emparejamiento'):
+        if emparejamiento_en_base():
+            formularios = [formulario for formulario, *_ in resultados]
+            calculados = emparejar_dias_en_base({(formulario.ci_nro, formulario.fecha) for formulario in formularios})
+            return [calculados[formulario.id_salida] for formulario in formularios]
+        return _emparejar(_filas_para_motor(resultados))
+
+def _hora_a_segundos(hora):
+    """Convierte un objeto time a segundos del día (None si no hay hora)."""
+    if hora is None:
+        return None
+    return hora.hour * 3600 + hora.minute * 60 + hora.second
 
+def _segundos_a_hora(segundos):
+    """Convierte segundos del día a un objeto time (None si no hay hora)."""
+    if segundos is None:
+        return None
+    return time(segundos // 3600, segundos % 3600 // 60, segundos % 60)
+
+def _segundos_a_texto(segundos):
+    """Convierte segundos del día al formato HH:MM de la vista ('-' si no hay hora)."""
+    if segundos is None:
+        return '-'
+    return f"{segundos // 3600:02d}:{segundos % 3600 // 60:02d}"
+
+def _fila_para_motor(formulario, marcacion, cache_marcaciones):
+    """Arma la tupla (llave_dia, salida, llegada, marcaciones) que reciben los motores de emparejamiento."""
+    return (
+        (formulario.ci_nro, formulario.fecha),
+        _hora_a_segundos(formulario.hora_salida_estipulada),
+        _hora_a_segundos(formulario.hora_llegada_estipulada),
+        obtener_marcaciones_segundos(marcacion, cache_marcaciones),
+    )
+
+def _filas_para_motor(resultados):
+    """Generador de filas para el motor a partir de las filas (formulario, marcacion, ...) de la consulta.
+       Cada fila de la vista se parsea una sola vez aunque el join la repita; como las filas vienen
+       agrupadas por fecha, el cache se vacía al cambiar de fecha.
+       Con FUENTE_MARCACIONES = 'tabla' las marcaciones de todos los dias se traen ya en segundos
+       con una sola consulta a la tabla del reloj."""
+    if leer_marcaciones_de_tabla():
+        formularios = [formulario for formulario, *_ in resultados]
+        marcaciones = marcaciones_por_dia({(formulario.ci_nro, formulario.fecha) for formulario in formularios})
+        for formulario in formularios:
+            llave_dia = (formulario.ci_nro, formulario.fecha)
+            yield (llave_dia, _hora_a_segundos(formulario.hora_salida_estipulada),
+                   _hora_a_segundos(formulario.hora_llegada_estipulada), marcaciones.get(llave_dia, ()))
+        return
+
+    cache_marcaciones = {}
+    fecha_actual = None
+    for formulario, marcacion, *_ in resultados:
+        if formulario.fecha != fecha_actual:
+            cache_marcaciones.clear()
+            fecha_actual = formulario.fecha
+        yield _fila_para_motor(formulario, marcacion, cache_marcaciones)
+
+def _resultado_materializado(resultado):
+    """Convierte una fila de resultado_salida a la tupla que devuelven los motores."""
+    return (_hora_a_segundos(resultado.hora_salida_cercana), _hora_a_segundos(resultado.hora_llegada_cercana),
+            resultado.estado_salida, resultado.estado_llegada)
+
+def _emparejar_con_materializados(resultados):
+    """Retorna el resultado del emparejamiento de cada fila (formulario, marcacion, ..., resultado).
+       Los dias ya materializados en resultado_salida se leen de la tabla; los dias de hoy o con algún
+       formulario sin resultado se recalculan completos (la vista solo viene unida en esas filas)."""
+    hoy = date.today()
+
+    #Dias a recalcular, con la fila de la vista de ese dia.
+    marcaciones_pendientes = {}
+    for formulario, marcacion, *_, resultado in resultados:
+        if resultado is None or formulario.fecha >= hoy:
+            llave_dia = (formulario.ci_nro, formulario.fecha)
+            if marcaciones_pendientes.get(llave_dia) is None:
+                marcaciones_pendientes[llave_dia] = marcacion
+
+    pendientes = [
+        (formulario, marcaciones_pendientes[(formulario.ci_nro, formulario.fecha)])
+        for formulario, *_ in resultados if (formulario.ci_nro, formulario.fecha) in marcaciones_pendientes
+    ]
+    calculados = iter(_emparejar_formularios(pendientes))
+
+    emparejados = [
+        next(calculados) if (formulario.ci_nro, formulario.fecha) in marcaciones_pendientes
+        else _resultado_materializado(resultado)
+        for formulario, *_, resultado in resultados
+    ]
+    registrar_emparejamiento(emparejados)
+    return emparejados
+
+def _emparejar_por_fecha(resultados):
+    """Procesa las filas de a una fecha por vez (vienen ordenadas por fecha) y produce (fila, resultado).
+       Solo mantiene en memoria las filas de la fecha en curso."""
+    for _, filas_fecha in groupby(resultados, key=lambda fila: fila[0].fecha):
+        filas_fecha = list(filas_fecha)
+        yield from zip(filas_fecha, _emparejar_con_materializados(filas_fecha))
+
+def _acumular_estadisticas(estadisticas_funcionarios, usuario, resultado_marcaciones):
+    """Suma el formulario procesado a las estadísticas del funcionario."""
+    #Si el usuario nunca completo un formulario.
+    if usuario.cedula not in estadisticas_funcionarios:
+        estadisticas_funcionarios[usuario.cedula] = _inicializar_estadisticas_funcionario(usuario)
+
+    #Obtenemos el objeto de estadísticas.
+    estadisticas = estadisticas_funcionarios[usuario.cedula]
+    #Sumamos al total.
+    estadisticas['total'] += 1
+    #Actualizamos los estados.
+    _actualizar_estado_estadisticas(estadisticas, resultado_marcaciones[2])
+    _actualizar_estado_estadisticas(estadisticas, resultado_marcaciones[3])
+
+def _registro_funcionario(formulario, resultado_marcaciones):
+    """Prepara el objeto para la vista (DTO - Data Transfer Object) de un formulario procesado."""
+    hora_salida_cercana, hora_llegada_cercana, estado_salida, estado_llegada = resultado_marcaciones
     return {
-        'hora_salida_cercana': hora_salida_cercana,
-        'hora_llegada_cercana': hora_llegada_cercana,
+        'fecha': formulario.fecha.strftime('%d-%m-%Y'),
+        'motivo': formulario.motivo,
+        'destino': formulario.destino,
+        'hora_salida_estipulada': formulario.hora_salida_estipulada.strftime('%H:%M'),
+        'hora_llegada_estipulada': formulario.hora_llegada_estipulada.strftime('%H:%M'),
+        'hora_salida_cercana': _segundos_a_texto(hora_salida_cercana),
+        'hora_llegada_cercana': _segundos_a_texto(hora_llegada_cercana),
         'estado_salida': estado_salida,
         'estado_llegada': estado_llegada,
     }
 
-def _cantidad_horas(lista_horas, filtrar=True):
-    """Funcion para contar la cantidad de horas utilizables para procesar."""
-    if not lista_horas:
-        return 0
-
-    lista_limpia = [h for h in lista_horas if h is not None]
-
-    lista_procesada = lista_limpia
-    if filtrar:
-        if len(lista_limpia) <= 2:
-            return 0
-        lista_ordenada = sorted(lista_limpia)
-        lista_procesada = lista_ordenada[1:-1]
-    return len(lista_procesada)
-
-def _procesar_marcaciones(formulario, marcacion, cedula, horas_usadas):
-    """Función auxiliar para procesar las marcaciones de un formulario."""
-    #Inicializamos variables.
-    hora_salida_cercana = None
-    hora_llegada_cercana = None
-    estado_salida = "no_marco"
-    estado_llegada = "no_marco"
-
-    try:
-        # Verificamos que el formulario tenga las horas estipuladas
-        if not formulario.hora_salida_estipulada or not formulario.hora_llegada_estipulada:
-            return {
-                'hora_salida_cercana': None, 'hora_llegada_cercana': None,
-                'estado_salida': 'no_marco', 'estado_llegada': 'no_marco'
-            }
-
-        if marcacion:
-            #Obtenemos todas las horas marcadas por el usuario en ese día.
-            lista_horas = marcacion.get_marcaciones_list()
-            #Creamos una lista de horas disponibles (no usadas).
-            if lista_horas:
-                horas_disponibles = [
-                    hora for hora in lista_horas
-                    if (cedula, formulario.fecha, hora) not in horas_usadas
-                ]
-            
-            # ---- CASO ESPECIAL: Si solo hay una hora disponible----
-            if _cantidad_horas(horas_disponibles) == 1:
-                return _procesar_hora_unica(
-                    formulario.hora_salida_estipulada,
-                    formulario.hora_llegada_estipulada,
-                    _obtener_hora_cercana(formulario.hora_salida_estipulada, horas_disponibles),
-                    _obtener_hora_cercana(formulario.hora_llegada_estipulada, horas_disponibles),
-                    horas_usadas,
-                    cedula,
-                    formulario.fecha   
-                )
-
-            # ---- SALIDA ----
-            hora_salida_cercana = _obtener_hora_cercana(formulario.hora_salida_estipulada, horas_disponibles)
-
-            if hora_salida_cercana:
-                llave_usada = (cedula, formulario.fecha, hora_salida_cercana)
-                horas_usadas.add(llave_usada)
-                estado_salida = _calcular_estado_marcacion(formulario.hora_salida_estipulada, hora_salida_cercana, es_llegada=False)
-                if hora_salida_cercana in horas_disponibles: horas_disponibles.remove(hora_salida_cercana)
-
-            # ---- LLEGADA ----
-            hora_llegada_cercana = _obtener_hora_cercana(formulario.hora_llegada_estipulada, horas_disponibles)
-            if hora_llegada_cercana:
-                llave_usada = (cedula, formulario.fecha, hora_llegada_cercana)
-                horas_usadas.add(llave_usada)
-                estado_llegada = _calcular_estado_marcacion(formulario.hora_llegada_estipulada, hora_llegada_cercana, es_llegada=True)
-    except Exception as e:
-        import logging
-        logging.error(f"Error procesando marcaciones para CI {cedula}: {str(e)}")
-        
+def _registro_admin(formulario, usuario, resultado_marcaciones):
+    """DTO del reporte de administración: agrega los datos del funcionario."""
     return {
-        'hora_salida_cercana': hora_salida_cercana,
-        'hora_llegada_cercana': hora_llegada_cercana,
-        'estado_salida': estado_salida,
-        'estado_llegada': estado_llegada,
+        'nombre_completo': f"{usuario.nombre} {usuario.apellido}",
+        'ci_nro': usuario.cedula,
+        **_registro_funcionario(formulario, resultado_marcaciones),
     }
 
-
-
 def obtener_reporte_salidas_procesado(fecha_desde, fecha_hasta, cedula_filtro=None):
     """
     Orquestador Principal:
@@ -214,86 +388,311 @@ def obtener_reporte_salidas_procesado(fecha_desde, fecha_hasta, cedula_filtro=No
     2- Procesa la lógica de negocio (obtiene las horas cercanas a las estipuladas).
     3- Obtiene las estadísticas generales por cada funcionario que haya enviado formularios en el rango de fechas.
     4- Devuelve objetos limpios para la vista.
+    Si la cache de reportes está activa (CACHE_REPORTES) se reutiliza el último cálculo del mismo rango.
     """
+    return obtener_o_calcular(llave_reporte(fecha_desde, fecha_hasta, cedula_filtro),
+                              lambda: _calcular_reporte_salidas(fecha_desde, fecha_hasta, cedula_filtro))
+
+def _calcular_reporte_salidas(fecha_desde, fecha_hasta, cedula_filtro=None):
+    """Calcula el reporte de administración completo (sin cache).
+       Con REPORTE_PARALELO los rangos de más de un tramo se consultan y procesan en paralelo."""
+    if app.config.get('REPORTE_PARALELO', False):
+        tramos = _tramos_de_fechas(fecha_desde, fecha_hasta, app.config.get('REPORTE_PARALELO_TRAMO', 'mes'))
+        if len(tramos) > 1:
+            return _calcular_reporte_paralelo(tramos, cedula_filtro)
+    return _calcular_tramo(fecha_desde, fecha_hasta, cedula_filtro)
+
+def _calcular_tramo(fecha_desde, fecha_hasta, cedula_filtro=None):
+    """Consulta y procesa el reporte de administración de un rango. Retorna (registros, resumen)."""
     #Obtenemos los datos crudos (Delegamos la query al modelo).
     resultados = FormularioSalida.obtener_reporte_admin(fecha_desde, fecha_hasta, cedula_filtro)
 
+    #Procesamos todas las marcaciones del rango de una sola vez (salvo los dias ya materializados).
+    emparejados = _emparejar_con_materializados(resultados)
+    return _armar_reporte(resultados, emparejados)
+
+#Consulta paralela por tramos (REPORTE_PARALELO): cada tramo del rango (mes o semana, REPORTE_PARALELO_TRAMO)
+#se consulta en un hilo con su propia sesión y conexión del pool, y se empareja apenas llega. Las
+#marcaciones usadas son por (cedula, dia), así que los tramos son independientes; se unen del más reciente
+#al más antiguo y cada uno viene con el orden del reporte (fecha desc, hora_salida_estipulada asc).
+#Cada pedido ocupa hasta REPORTE_PARALELO_HILOS conexiones a la vez: POOL_PRINCIPAL (y POOL_REPLICA)
+#deben tener lugar para eso.
+HILOS_PARALELO_DEFECTO = 4
+_pool_tramos = None
+_pool_tramos_pid = None
+_lock_pool_tramos = threading.Lock()
+
+def _obtener_pool_tramos():
+    """Pool de hilos de este proceso (un fork no hereda los hilos del pool del padre: sus tareas no correrían)."""
+    global _pool_tramos, _pool_tramos_pid
+    with _lock_pool_tramos:
+        if _pool_tramos is None or _pool_tramos_pid != os.getpid():
+            _pool_tramos = ThreadPoolExecutor(max_workers=app.config.get('REPORTE_PARALELO_HILOS', HILOS_PARALELO_DEFECTO),
+                                              thread_name_prefix='tramos')
+            _pool_tramos_pid = os.getpid()
+        return _pool_tramos
+
+def _tramos_de_fechas(fecha_desde, fecha_hasta, tramo='mes'):
+    """Divide el rango en meses calendario o semanas (lunes a domingo), del más reciente al más antiguo.
+       Retorna una lista de (desde, hasta) que cubre el rango completo."""
+    tramos = []
+    fin = fecha_hasta
+    while fin >= fecha_desde:
+        if tramo == 'semana':
+            inicio = fin - timedelta(days=fin.weekday())
+        else:
+            inicio = fin.replace(day=1)
+        inicio = max(inicio, fecha_desde)
+        tramos.append((inicio, fin))
+        fin = inicio - timedelta(days=1)
+    return tramos
+
+def _calcular_tramo_en_hilo(fecha_desde, fecha_hasta, cedula_filtro, leer_en_replica):
+    #Contexto propio: el hilo usa otra sesión (y otra conexión) que la petición.
+    with app.app_context():
+        if leer_en_replica:
+            usar_replica()
+        return _calcular_tramo(fecha_desde, fecha_hasta, cedula_filtro)
+
+def _calcular_reporte_paralelo(tramos, cedula_filtro=None):
+    """Calcula los tramos en el pool de hilos y une registros y estadísticas en el orden del reporte."""
+    leer_en_replica = g.get('leer_en_replica', False) and not g.get('forzar_principal', False)
+    pool = _obtener_pool_tramos()
+    futuros = [pool.submit(_calcular_tramo_en_hilo, desde, hasta, cedula_filtro, leer_en_replica)
+               for desde, hasta in tramos]
+
     datos_procesados = []
     estadisticas_funcionarios = {}
-    horas_usadas = set()
-
-    for formulario, marcacion, usuario in resultados:
-        #Utilizamos la funcion auxiliar para procesar las marcaciones.    
-        resultado_marcaciones = _procesar_marcaciones(formulario, marcacion, usuario.cedula, horas_usadas)
-
-        #Acumulamos Estadísticas.
-        #Si el usuario nunca completo un formulario.
-        if usuario.cedula not in estadisticas_funcionarios:
-            estadisticas_funcionarios[usuario.cedula] = _inicializar_estadisticas_funcionario(usuario)
-        
-        #Obtenemos el objeto de estadísticas.
-        estadisticas=estadisticas_funcionarios[usuario.cedula]
-        #Sumamos al total.
-        estadisticas['total'] += 1
-        #Actualizamos los estados.
-        _actualizar_estado_estadisticas(estadisticas, resultado_marcaciones['estado_salida'])
-        _actualizar_estado_estadisticas(estadisticas, resultado_marcaciones['estado_llegada'])
-        
-        #Preparamos el objeto para la vista (DTO - Data Transfer Object).
-        datos_procesados.append({
-            'nombre_completo': f"{usuario.nombre} {usuario.apellido}",
-            'ci_nro': usuario.cedula,
-            'fecha': formulario.fecha.strftime('%d-%m-%Y'),
-            'motivo': formulario.motivo,
-            'destino': formulario.destino,
-            'hora_salida_estipulada': formulario.hora_salida_estipulada.strftime('%H:%M'),
-            'hora_llegada_estipulada': formulario.hora_llegada_estipulada.strftime('%H:%M'),
-            'hora_salida_cercana': resultado_marcaciones['hora_salida_cercana'].strftime('%H:%M') if resultado_marcaciones['hora_salida_cercana'] else '-',
-            'hora_llegada_cercana': resultado_marcaciones['hora_llegada_cercana'].strftime('%H:%M') if resultado_marcaciones['hora_llegada_cercana'] else '-',
-            'estado_salida': resultado_marcaciones['estado_salida'],
-            'estado_llegada': resultado_marcaciones['estado_llegada'],
-        })
+    #Las consultas de los hilos no se ven en las fases de la petición: se mide la espera total.
+    with fase('tramos'):
+        for futuro in futuros:
+            registros, resumen = futuro.result()
+            datos_procesados.extend(registros)
+            for estadisticas in resumen:
+                acumuladas = estadisticas_funcionarios.setdefault(estadisticas['ci_nro'], estadisticas)
+                if acumuladas is not estadisticas:
+                    for clave in ('total', 'cumplio', 'alerta', 'incumplio'):
+                        acumuladas[clave] += estadisticas[clave]
+    return datos_procesados, list(estadisticas_funcionarios.values())
+
+def _armar_reporte(resultados, emparejados):
+    """Arma los registros de la vista y las estadísticas por funcionario a partir de las filas
+       (formulario, marcacion, usuario, ...) y el resultado del emparejamiento de cada una."""
+    datos_procesados = []
+    estadisticas_funcionarios = {}
+
+    with fase('registros'):
+        for (formulario, marcacion, usuario, *_), resultado_marcaciones in zip(resultados, emparejados):
+            #Acumulamos Estadísticas.
+            _acumular_estadisticas(estadisticas_funcionarios, usuario, resultado_marcaciones)
+            #Preparamos el objeto para la vista.
+            datos_procesados.append(_registro_admin(formulario, usuario, resultado_marcaciones))
     
     return datos_procesados, list(estadisticas_funcionarios.values())
 
+#Cantidad de filas que se traen por vez de la base de datos en modo streaming.
+TAMANO_LOTE_STREAMING = 500
+
+def iterar_reporte_salidas_procesado(fecha_desde, fecha_hasta, cedula_filtro=None, resumen=None):
+    """
+    Versión generadora del orquestador principal (modo streaming):
+    Lee las filas de la base de datos por lotes y produce cada registro apenas se procesa,
+    sin armar la lista completa en memoria. Las estadísticas por funcionario se agregan a la
+    lista resumen (si se pasa) cuando termina la iteración.
+    """
+    consulta = FormularioSalida.consultar_reporte_admin(fecha_desde, fecha_hasta, cedula_filtro)
+    estadisticas_funcionarios = {}
+
+    for (formulario, marcacion, usuario, _), resultado_marcaciones in _emparejar_por_fecha(
+            consulta.yield_per(TAMANO_LOTE_STREAMING)):
+        _acumular_estadisticas(estadisticas_funcionarios, usuario, resultado_marcaciones)
+        yield _registro_admin(formulario, usuario, resultado_marcaciones)
+
+    if resumen is not None:
+        resumen.extend(estadisticas_funcionarios.values())
+
 
-def obtener_reporte_salidas_funcionario(fecha_desde, fecha_hasta):
+def obtener_resumen_salidas(fecha_desde, fecha_hasta, cedula_filtro=None):
+    """
+    Orquestador del modo solo resumen:
+    Calcula las estadísticas por funcionario sin armar los registros de detalle. Los dias ya materializados
+    se cuentan en la base con un GROUP BY ci_nro; solo los dias pendientes (y los de hoy) se emparejan acá,
+    con una consulta liviana (sin objetos del ORM) leída por lotes y procesada de a una fecha.
+    Los contadores y el orden son los mismos que devuelve obtener_reporte_salidas_procesado.
+    """
+    #Si el reporte completo del mismo rango está en la cache, su resumen es el mismo.
+    reporte = consultar(llave_reporte(fecha_desde, fecha_hasta, cedula_filtro))
+    if reporte is not None:
+        return reporte[1]
+
+    #Cedula -> llave (fecha, hora_salida_estipulada, id_salida) de su primer formulario en el orden del reporte.
+    primeros = {}
+    estadisticas_funcionarios = {}
+    for fila in FormularioSalida.resumen_materializado(fecha_desde, fecha_hasta, cedula_filtro):
+        estadisticas = estadisticas_funcionarios[fila.cedula] = _inicializar_estadisticas_funcionario(fila)
+        for clave in ('total', 'cumplio', 'alerta', 'incumplio'):
+            estadisticas[clave] = getattr(fila, clave)
+        primeros[fila.cedula] = (fila.primera_fecha, fila.primera_hora, fila.primer_id)
+
+    consulta = FormularioSalida.consultar_resumen_admin(fecha_desde, fecha_hasta, cedula_filtro, solo_pendientes=True)
+    #Cada fila trae los datos del formulario, del funcionario, de la vista (None si no se unió)
+    #y del resultado materializado (None si no existe).
+    filas = (
+        (fila, fila if fila.fecha_marcacion is not None else None, fila if fila.id_resultado is not None else None)
+        for fila in consulta.yield_per(TAMANO_LOTE_STREAMING)
+    )
+    for (fila, _, _), resultado_marcaciones in _emparejar_por_fecha(filas):
+        llave = (fila.fecha, fila.hora_salida_estipulada, fila.id_salida)
+        if fila.cedula not in primeros or _orden_reporte(llave) < _orden_reporte(primeros[fila.cedula]):
+            primeros[fila.cedula] = llave
+        _acumular_estadisticas(estadisticas_funcionarios, fila, resultado_marcaciones)
+
+    #Mismo orden que el reporte completo: por la primera aparición de cada funcionario.
+    orden = sorted(primeros, key=lambda cedula: _orden_reporte(primeros[cedula]))
+    return [estadisticas_funcionarios[cedula] for cedula in orden]
+
+def _orden_reporte(llave):
+    """Clave para ordenar llaves (fecha, hora_salida_estipulada, id_salida) como el reporte (fecha desc)."""
+    fecha, hora_salida, id_salida = llave
+    return -fecha.toordinal(), hora_salida, id_salida
+
+#Tamaño de página por defecto y máximo del reporte paginado.
+POR_PAGINA_DEFECTO = 50
+POR_PAGINA_MAXIMO = 500
+
+def _codificar_cursor(direccion, formulario):
+    """Arma el cursor opaco de la paginación a partir de la llave del formulario."""
+    texto = f"{direccion}|{formulario.fecha.isoformat()}|{formulario.hora_salida_estipulada.isoformat()}|{formulario.id_salida}"
+    return urlsafe_b64encode(texto.encode('utf-8')).decode('ascii').rstrip('=')
+
+def _decodificar_cursor(cursor):
+    """Retorna (hacia_atras, llave) a partir del cursor. Un cursor inválido equivale a la primera página."""
+    try:
+        texto = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        direccion, fecha, hora_salida, id_salida = texto.split('|')
+        return direccion == 'ant', (date.fromisoformat(fecha), time.fromisoformat(hora_salida), int(id_salida))
+    except ValueError:
+        return False, None
+
+def obtener_pagina_reporte_salidas(fecha_desde, fecha_hasta, cedula_filtro=None, cursor=None, por_pagina=POR_PAGINA_DEFECTO):
+    """
+    Orquestador del reporte paginado (keyset sobre fecha desc, hora_salida_estipulada asc, id_salida asc):
+    1- Obtiene de la base de datos solo las filas de la página.
+    2- Procesa primero, sin mostrarlos, los formularios del mismo dia que quedaron en páginas anteriores,
+       para que las marcaciones usadas se descuenten igual que en el reporte completo.
+    3- Devuelve (registros, resumen de la página, paginacion) donde paginacion tiene los cursores
+       'anterior' y 'siguiente' (None si no hay más páginas en ese sentido).
+    """
+    por_pagina = min(max(por_pagina, 1), POR_PAGINA_MAXIMO)
+    hacia_atras, llave = _decodificar_cursor(cursor) if cursor else (False, None)
+
+    pagina, hay_mas = FormularioSalida.obtener_pagina_reporte_admin(
+        fecha_desde, fecha_hasta, cedula_filtro, llave, hacia_atras, por_pagina)
+    if not pagina:
+        return [], [], {'anterior': None, 'siguiente': None}
+
+    #El estado de marcaciones usadas es por dia: solo el primer dia de la página puede venir empezado.
+    primero = pagina[0][0]
+    cedulas_primer_dia = {formulario.ci_nro for formulario, *_ in pagina if formulario.fecha == primero.fecha}
+    previos = FormularioSalida.obtener_previos_del_dia(primero, cedulas_primer_dia)
+    emparejados = _emparejar_con_materializados(previos + pagina)[len(previos):]
+
+    registros = []
+    estadisticas_funcionarios = {}
+    for (formulario, marcacion, usuario, _), resultado_marcaciones in zip(pagina, emparejados):
+        _acumular_estadisticas(estadisticas_funcionarios, usuario, resultado_marcaciones)
+        registros.append(_registro_admin(formulario, usuario, resultado_marcaciones))
+
+    hay_anterior = hay_mas if hacia_atras else llave is not None
+    hay_siguiente = llave is not None if hacia_atras else hay_mas
+    paginacion = {
+        'anterior': _codificar_cursor('ant', primero) if hay_anterior else None,
+        'siguiente': _codificar_cursor('sig', pagina[-1][0]) if hay_siguiente else None,
+    }
+    return registros, list(estadisticas_funcionarios.values()), paginacion
+
+
+def obtener_reporte_salidas_funcionario(fecha_desde, fecha_hasta, cedula=None):
     """
     Orquestador Principal para el reporte de funcionarios:
-    1- Obtiene los registros que queremos de la base de datos.
+    1- Obtiene los registros que queremos de la base de datos (del usuario logueado si no se pasa la cedula).
     2- Procesa la lógica de negocio (obtiene las horas cercanas a las estipuladas).
     3- Devuelve objetos limpios para la vista.
     """
-    from flask_login import current_user
     #Obtenemos los datos crudos (Delegamos la query al modelo).
-    resultados = FormularioSalida.obtener_reporte_usuario(fecha_desde, fecha_hasta)
+    resultados = FormularioSalida.obtener_reporte_usuario(fecha_desde, fecha_hasta, cedula)
 
-    datos_procesados = []
-    horas_usadas = set()
-
-    for formulario, marcacion in resultados:
-        #Utilizamos la funcion auxiliar para procesar las marcaciones.
-        resultado_marcaciones = _procesar_marcaciones(formulario, marcacion, current_user.cedula, horas_usadas)
-
-
-        #Preparamos el objeto para la vista (DTO - Data Transfer Object).
-        datos_procesados.append({
-            'fecha': formulario.fecha.strftime('%d-%m-%Y'),
-            'motivo': formulario.motivo,
-            'destino': formulario.destino,
-            'hora_salida_estipulada': formulario.hora_salida_estipulada.strftime('%H:%M'),
-            'hora_llegada_estipulada': formulario.hora_llegada_estipulada.strftime('%H:%M'),
-            'hora_salida_cercana': resultado_marcaciones['hora_salida_cercana'].strftime('%H:%M') if resultado_marcaciones['hora_salida_cercana'] else '-',
-            'hora_llegada_cercana': resultado_marcaciones['hora_llegada_cercana'].strftime('%H:%M') if resultado_marcaciones['hora_llegada_cercana'] else '-',
-            'estado_salida': resultado_marcaciones['estado_salida'],
-            'estado_llegada': resultado_marcaciones['estado_llegada'],
-        })
-    
-    return datos_procesados
+    #Procesamos todas las marcaciones del rango de una sola vez (salvo los dias ya materializados).
+    emparejados = _emparejar_con_materializados(resultados)
 
-def preparar_reporte_para_pdf(tipo, fecha_desde, fecha_hasta, cedula_filtro=None, usuario_actual=None):
-    """Prepara los datos necesarios para generar el reporte en PDF.
-       Retorna (pdf_bytes, file_name)"""
+    with fase('registros'):
+        return [
+            _registro_funcionario(formulario, resultado_marcaciones)
+            for (formulario, *_), resultado_marcaciones in zip(resultados, emparejados)
+        ]
+
+#Nombre del proceso de materialización en la tabla control_proceso.
+PROCESO_MATERIALIZACION = 'resultado_salida'
+
+def refrescar_resultados_materializados():
+    """
+    Proceso incremental (pensado para correr de noche) que completa la tabla resultado_salida:
+    1- Busca los dias (cedula, fecha) anteriores a hoy con formularios sin resultado, formularios nuevos
+       o marcaciones del reloj cargadas/modificadas desde la última marca de agua.
+    2- Recalcula todos los formularios de esos dias (las marcaciones usadas se descuentan por dia).
+    3- Reemplaza sus resultados y guarda la nueva marca de agua.
+    Retorna la cantidad de formularios recalculados.
+    """
+    #La marca de agua es el inicio de la ejecución: lo que cambie mientras corre se toma la próxima vez.
+    inicio = datetime.now()
+    hoy = inicio.date()
+    marca_agua = ControlProceso.obtener_marca_agua(PROCESO_MATERIALIZACION)
+
+    dias = FormularioSalida.dias_pendientes(hoy, marca_agua)
+    if marca_agua:
+        dias |= dias_con_marcaciones_modificadas(marca_agua, hoy)
+
+    cedulas_por_fecha = {}
+    for ci_nro, fecha in dias:
+        cedulas_por_fecha.setdefault(fecha, set()).add(ci_nro)
+
+    total = 0
+    for fecha, cedulas in sorted(cedulas_por_fecha.items()):
+        resultados = FormularioSalida.obtener_formularios_del_dia(fecha, cedulas)
+        if not resultados:
+            continue
+        emparejados = _emparejar_formularios(resultados)
+
+        ids = [formulario.id_salida for formulario, _ in resultados]
+        db.session.execute(delete(ResultadoSalida).where(ResultadoSalida.id_salida.in_(ids)))
+        db.session.execute(insert(ResultadoSalida), [
+            {
+                'id_salida': formulario.id_salida,
+                'ci_nro': formulario.ci_nro,
+                'fecha': formulario.fecha,
+                'hora_salida_cercana': _segundos_a_hora(hora_salida_cercana),
+                'hora_llegada_cercana': _segundos_a_hora(hora_llegada_cercana),
+                'estado_salida': estado_salida,
+                'estado_llegada': estado_llegada,
+                'fecha_calculo': inicio,
+            }
+            for (formulario, _), (hora_salida_cercana, hora_llegada_cercana, estado_salida, estado_llegada)
+            in zip(resultados, emparejados)
+        ])
+        #Un commit por fecha: si el proceso se corta, la próxima ejecución retoma lo que falte.
+        db.session.commit()
+        #Si cambiaron marcaciones del reloj de esa fecha, los reportes en cache quedaron viejos.
+        invalidar_reportes(fecha)
+        total += len(resultados)
+
+    ControlProceso.guardar_marca_agua(PROCESO_MATERIALIZACION, inicio)
+    db.session.commit()
+    return total
+
+def _datos_pdf(tipo, fecha_desde, fecha_hasta, cedula_filtro=None, usuario_actual=None, por_lotes=False):
+    """Obtiene los datos que se renderizan en el PDF. Retorna (encabezado, registros, resumen, file_name).
+       Con por_lotes el reporte de admin se recorre con iterar_reporte_salidas_procesado: registros es un
+       generador y resumen se completa cuando termina de recorrerse."""
     registros = []
     resumen = []
     nombre_funcionario = ""
@@ -301,27 +700,238 @@ def preparar_reporte_para_pdf(tipo, fecha_desde, fecha_hasta, cedula_filtro=None
 
     #Obtención de datos segun el tipo.
     if tipo == 'funcionario' and usuario_actual:
-        registros = obtener_reporte_salidas_funcionario(fecha_desde, fecha_hasta)
+        registros = obtener_reporte_salidas_funcionario(fecha_desde, fecha_hasta, usuario_actual.cedula)
         nombre_funcionario = f"{usuario_actual.nombre} {usuario_actual.apellido}"
         cedula_funcionario = usuario_actual.cedula
         file_name = f"Mis_Salidas_{cedula_funcionario}_{fecha_desde}_{fecha_hasta}.pdf"
     else:
         #Reporte para admin.
-        registros, resumen = obtener_reporte_salidas_procesado(fecha_desde, fecha_hasta, cedula_filtro or None)
+        if por_lotes:
+            registros = iterar_reporte_salidas_procesado(fecha_desde, fecha_hasta, cedula_filtro or None, resumen=resumen)
+        else:
+            registros, resumen = obtener_reporte_salidas_procesado(fecha_desde, fecha_hasta, cedula_filtro or None)
         file_name = f"Reporte_Salidas_{fecha_desde}_{fecha_hasta}.pdf"
-    
+
+    encabezado = {
+        'fecha_desde': fecha_desde.strftime('%d-%m-%Y'),
+        'fecha_hasta': fecha_hasta.strftime('%d-%m-%Y'),
+        'tipo': tipo,
+        'nombre_funcionario': nombre_funcionario,
+        'cedula_funcionario': cedula_funcionario,
+    }
+    return encabezado, registros, resumen, file_name
+
+def preparar_datos_pdf(tipo, fecha_desde, fecha_hasta, cedula_filtro=None, usuario_actual=None):
+    """Obtiene los datos que se renderizan en el PDF.
+       Retorna (contexto, file_name, huella); la huella identifica el contenido y sirve de ETag."""
+    encabezado, registros, resumen, file_name = _datos_pdf(tipo, fecha_desde, fecha_hasta, cedula_filtro, usuario_actual)
+
+    #fecha_generacion no forma parte del contexto: no cambia el contenido del reporte.
+    contexto = {'registros': registros, 'resumen': resumen, **encabezado}
+    return contexto, file_name, huella_reporte(contexto)
+
+def documentos_pdf_por_funcionario(fecha_desde, fecha_hasta, cedula_filtro=None):
+    """Arma los datos del PDF individual (como el de Mis Salidas) de cada funcionario del rango,
+       a partir de una sola pasada del reporte de administración.
+       Retorna una lista de (file_name, contexto, huella) ordenada por cedula."""
+    registros, _ = obtener_reporte_salidas_procesado(fecha_desde, fecha_hasta, cedula_filtro)
+
+    #Separamos por cedula (respeta el orden del reporte, que es el mismo del reporte del funcionario).
+    por_funcionario = {}
+    for registro in registros:
+        registro_funcionario = dict(registro)
+        nombre_completo = registro_funcionario.pop('nombre_completo')
+        ci_nro = registro_funcionario.pop('ci_nro')
+        por_funcionario.setdefault(ci_nro, (nombre_completo, []))[1].append(registro_funcionario)
+
+    documentos = []
+    for ci_nro, (nombre_completo, registros_funcionario) in sorted(por_funcionario.items()):
+        contexto = {
+            'registros': registros_funcionario,
+            'resumen': [],
+            'fecha_desde': fecha_desde.strftime('%d-%m-%Y'),
+            'fecha_hasta': fecha_hasta.strftime('%d-%m-%Y'),
+            'tipo': 'funcionario',
+            'nombre_funcionario': nombre_completo,
+            'cedula_funcionario': ci_nro,
+        }
+        documentos.append((f"Mis_Salidas_{ci_nro}_{fecha_desde}_{fecha_hasta}.pdf", contexto, huella_reporte(contexto)))
+    return documentos
+
+#Columnas de las exportaciones a CSV y XLSX.
+COLUMNAS_EXPORTACION = ['Fecha', 'Salida estipulada', 'Salida real', 'Estado salida',
+                        'Llegada estipulada', 'Llegada real', 'Estado llegada', 'Motivo', 'Destino']
+COLUMNAS_RESUMEN = ['Funcionario', 'CI', 'Total', 'Cumplió', 'Alerta', 'Incumplió']
+
+def _fila_exportacion(registro):
+    return [registro['fecha'], registro['hora_salida_estipulada'], registro['hora_salida_cercana'],
+            registro['estado_salida'], registro['hora_llegada_estipulada'], registro['hora_llegada_cercana'],
+            registro['estado_llegada'], registro['motivo'], registro['destino']]
+
+def datos_exportacion(tipo, fecha_desde, fecha_hasta, cedula_filtro=None, usuario_actual=None):
+    """
+    Prepara la exportación del reporte a CSV/XLSX sin armarlo en memoria.
+    Retorna (columnas, filas, columnas_resumen, filas_resumen, nombre_base):
+    - filas es un generador con el detalle (el de admin lee la base por lotes).
+    - filas_resumen es un generador que se debe recorrer después de filas (recién ahí está completo).
+    """
+    resumen = []
+    if tipo == 'funcionario' and usuario_actual:
+        columnas = COLUMNAS_EXPORTACION
+        registros = obtener_reporte_salidas_funcionario(fecha_desde, fecha_hasta, usuario_actual.cedula)
+        nombre_base = f"Mis_Salidas_{usuario_actual.cedula}_{fecha_desde}_{fecha_hasta}"
+
+        def generar_filas():
+            #El reporte del funcionario no trae resumen: se calcula con los mismos contadores.
+            estadisticas = _inicializar_estadisticas_funcionario(usuario_actual)
+            for registro in registros:
+                estadisticas['total'] += 1
+                _actualizar_estado_estadisticas(estadisticas, registro['estado_salida'])
+                _actualizar_estado_estadisticas(estadisticas, registro['estado_llegada'])
+                yield _fila_exportacion(registro)
+            if estadisticas['total']:
+                resumen.append(estadisticas)
+    else:
+        columnas = ['Funcionario', 'CI'] + COLUMNAS_EXPORTACION
+        registros = iterar_reporte_salidas_procesado(fecha_desde, fecha_hasta, cedula_filtro or None, resumen=resumen)
+        nombre_base = f"Reporte_Salidas_{fecha_desde}_{fecha_hasta}"
+
+        def generar_filas():
+            for registro in registros:
+                yield [registro['nombre_completo'], registro['ci_nro']] + _fila_exportacion(registro)
+
+    def generar_resumen():
+        for estadisticas in resumen:
+            yield [estadisticas['nombre'], estadisticas['ci_nro'], estadisticas['total'],
+                   estadisticas['cumplio'], estadisticas['alerta'], estadisticas['incumplio']]
+
+    return columnas, generar_filas(), COLUMNAS_RESUMEN, generar_resumen(), nombre_base
+
+def generar_pdf_reporte(contexto, huella):
+    """Retorna los bytes del PDF. Si ya se generó uno con los mismos datos se lee de la cache de PDF
+       (conserva la fecha de generación de esa primera vez)."""
+    pdf_bytes = leer_pdf(huella)
+    if pdf_bytes is not None:
+        return pdf_bytes
+
     #Renderizado de contenido HTML (usando template especifico para PDF).
     html_content = render_template('pdf_template.html',
-                                   registros=registros,
-                                   resumen=resumen,
-                                   fecha_desde=fecha_desde.strftime('%d-%m-%Y'),
-                                   fecha_hasta=fecha_hasta.strftime('%d-%m-%Y'),
                                    fecha_generacion=datetime.now().strftime('%d-%m-%Y %H:%M'),
-                                   tipo=tipo,
-                                   nombre_funcionario=nombre_funcionario,
-                                   cedula_funcionario=cedula_funcionario
-                                   )
+                                   **contexto)
     #Conversion a PDF usando la utilidad.
-    pdf_bytes = generar_pdf_desde_html(html_content)
+    inicio = perf_counter()
+    with fase('pdf'):
+        pdf_bytes = generar_pdf_desde_html(html_content)
+    observar('pdf_render_segundos', perf_counter() - inicio)
+    if pdf_bytes:
+        observar('pdf_bytes', len(pdf_bytes))
+        guardar_pdf(huella, pdf_bytes)
+    return pdf_bytes
 
-    return pdf_bytes, file_name
+def preparar_reporte_para_pdf(tipo, fecha_desde, fecha_hasta, cedula_filtro=None, usuario_actual=None):
+    """Prepara los datos necesarios para generar el reporte en PDF.
+       Retorna (pdf_bytes, file_name, huella)"""
+    contexto, file_name, huella = preparar_datos_pdf(tipo, fecha_desde, fecha_hasta, cedula_filtro, usuario_actual)
+    return generar_pdf_reporte(contexto, huella), file_name, huella
+
+#Cantidad de filas por parte en el PDF por lotes.
+TAMANO_LOTE_PDF = 500
+
+@contextmanager
+def datos_pdf_por_lotes(tipo, fecha_desde, fecha_hasta, cedula_filtro=None, usuario_actual=None):
+    """Recorre los datos del reporte una sola vez (sin renderizar): calcula la huella del PDF por lotes y guarda
+       los registros en un archivo temporal (un JSON por línea), así abrir_pdf_por_lotes los renderiza sin
+       volver a consultar ni emparejar. Produce un diccionario con huella, file_name, encabezado, resumen,
+       registros (la ruta del archivo) y solo_funcionario. El archivo se borra al salir del with."""
+    encabezado, registros, resumen, file_name = _datos_pdf(tipo, fecha_desde, fecha_hasta, cedula_filtro,
+                                                           usuario_actual, por_lotes=True)
+    huella = nueva_huella(encabezado)
+    descriptor, ruta = tempfile.mkstemp(dir=directorio_pdf(), suffix='.jsonl')
+    try:
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as archivo:
+            for registro in registros:
+                agregar_a_huella(huella, registro)
+                archivo.write(json.dumps(registro, ensure_ascii=False) + '\n')
+        agregar_a_huella(huella, resumen)
+        yield {
+            'huella': huella.hexdigest(),
+            'file_name': file_name,
+            'encabezado': encabezado,
+            'resumen': resumen,
+            'registros': ruta,
+            'solo_funcionario': bool(tipo == 'funcionario' and usuario_actual),
+        }
+    finally:
+        os.remove(ruta)
+
+def _leer_registros(ruta):
+    """Generador de los registros guardados por datos_pdf_por_lotes."""
+    with open(ruta, encoding='utf-8') as archivo:
+        for linea in archivo:
+            yield json.loads(linea)
+
+def abrir_pdf_por_lotes(datos):
+    """
+    Genera el PDF de reportes muy grandes con memoria acotada, a partir de datos_pdf_por_lotes:
+    1- Recorre los registros por lotes de PDF_TAMANO_LOTE filas y convierte cada lote en un PDF aparte.
+    2- Convierte el encabezado y el resumen, también por lotes.
+    3- Une todas las partes en un archivo y lo guarda en la cache de PDF con la huella de los datos.
+    Retorna el PDF como archivo abierto (binario) listo para enviar.
+    """
+    huella = datos['huella']
+    archivo = abrir_pdf(huella)
+    if archivo is not None:
+        return archivo
+
+    encabezado, resumen = datos['encabezado'], datos['resumen']
+    tamano = app.config.get('PDF_TAMANO_LOTE', TAMANO_LOTE_PDF)
+    fecha_generacion = datetime.now().strftime('%d-%m-%Y %H:%M')
+    directorio = directorio_pdf()
+
+    conversion = [0.0]
+    with tempfile.TemporaryDirectory(dir=directorio) as temporal:
+        def renderizar(nombre, **partes):
+            ruta = os.path.join(temporal, nombre)
+            html_content = render_template('pdf_template.html', fecha_generacion=fecha_generacion,
+                                           **encabezado, **partes)
+            inicio = perf_counter()
+            with fase('pdf'):
+                generado = generar_pdf_a_archivo(html_content, ruta)
+            conversion[0] += perf_counter() - inicio
+            if not generado:
+                raise Exception("El generador de PDF devolvió un error.")
+            return ruta
+
+        #Detalle: se mira un lote hacia adelante para saber cuál es el último (lleva el pie).
+        partes_detalle = []
+        lotes = en_lotes(_leer_registros(datos['registros']), tamano)
+        lote = next(lotes, [])
+        #Sin registros no hay resumen: el encabezado va en la primera parte del detalle.
+        sin_resumen = datos['solo_funcionario'] or not lote
+        while lote is not None:
+            siguiente = next(lotes, None)
+            numero = len(partes_detalle)
+            partes_detalle.append(renderizar(f'detalle_{numero:06d}.pdf', registros=lote, resumen=[],
+                                             encabezado=sin_resumen and numero == 0,
+                                             titulo_detalle=numero == 0, pie=siguiente is None))
+            lote = siguiente
+
+        partes_resumen = [
+            renderizar(f'resumen_{numero:06d}.pdf', resumen=lote_resumen, registros=[],
+                       encabezado=numero == 0, mostrar_detalle=False, pie=False)
+            for numero, lote_resumen in enumerate(en_lotes(resumen, tamano))
+        ]
+
+        descriptor, ruta = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+        os.close(descriptor)
+        inicio = perf_counter()
+        with fase('pdf'):
+            unir_pdfs(partes_resumen + partes_detalle, ruta)
+        observar('pdf_render_segundos', conversion[0] + perf_counter() - inicio)
+        observar('pdf_bytes', os.path.getsize(ruta))
+
+    #Se abre antes de moverlo a la cache: el recorte de la cache no afecta a un archivo abierto.
+    archivo = open(ruta, 'rb')
+    if guardar_archivo_pdf(huella, ruta) == ruta:
+        os.remove(ruta)
+    return archivo
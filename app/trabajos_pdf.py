@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import uuid
+import tempfile
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from app import app, db
+from app.utils import escribir_atomico, PoolProcesos
+from app.replica import usar_replica
+
+#Generación de PDF en segundo plano (se activa con PDF_ASINCRONO).
+#Cada trabajo se procesa en un pool de procesos local y su estado se guarda en archivos dentro de
+#PDF_TRABAJOS_DIR, así cualquier worker web puede responder la consulta de estado y la descarga:
+# - {id}.json: estado del trabajo (pendiente, procesando, listo o error).
+# - {id}.pdf: el resultado, se borra junto con el estado cuando vence PDF_TRABAJOS_TTL.
+
+MAX_PROCESOS_DEFECTO = 2
+MAX_COLA_DEFECTO = 8
+TTL_DEFECTO = 3600
+
+PENDIENTE, PROCESANDO, LISTO, ERROR = 'pendiente', 'procesando', 'listo', 'error'
+
+
+class ColaPdfLlena(Exception):
+    """Se lanza cuando ya hay demasiados trabajos de PDF sin terminar en este proceso."""
+
+
+def _directorio():
+    directorio = app.config.get('PDF_TRABAJOS_DIR', os.path.join(tempfile.gettempdir(), 'marcaciones_pdf'))
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def _ruta(directorio, id_trabajo, extension):
+    return os.path.join(directorio, f'{id_trabajo}.{extension}')
+
+
+def _guardar_estado(directorio, id_trabajo, estado, **datos):
+    ruta = _ruta(directorio, id_trabajo, 'json')
+    try:
+        with open(ruta, encoding='utf-8') as archivo:
+            actual = json.load(archivo)
+    except (OSError, ValueError):
+        actual = {}
+    actual.update(datos, estado=estado, actualizado=time.time())
+    escribir_atomico(ruta, json.dumps(actual).encode('utf-8'))
+
+
+def _ejecutar_trabajo(directorio, id_trabajo, parametros):
+    """Corre dentro del proceso del pool: arma el reporte, genera el PDF y deja el resultado en disco."""
+    from app.models import Usuario
+    from app.services import preparar_reporte_para_pdf, datos_pdf_por_lotes, abrir_pdf_por_lotes
+
+    _guardar_estado(directorio, id_trabajo, PROCESANDO)
+    try:
+        with app.app_context():
+            usar_replica()
+            try:
+                argumentos = dict(
+                    tipo=parametros['tipo'],
+                    fecha_desde=parametros['fecha_desde'],
+                    fecha_hasta=parametros['fecha_hasta'],
+                    cedula_filtro=parametros['cedula_filtro'],
+                    usuario_actual=db.session.get(Usuario, parametros['cedula_usuario'])
+                )
+                #En modo por lotes el PDF se copia desde el archivo, sin cargarlo en memoria.
+                if app.config.get('PDF_POR_LOTES', False):
+                    with datos_pdf_por_lotes(**argumentos) as datos, abrir_pdf_por_lotes(datos) as archivo:
+                        escribir_atomico(_ruta(directorio, id_trabajo, 'pdf'), archivo)
+                    huella = datos['huella']
+                else:
+                    pdf_bytes, _, huella = preparar_reporte_para_pdf(**argumentos)
+                    if not pdf_bytes:
+                        raise Exception("El generador de PDF devolvió un contenido vacío.")
+                    escribir_atomico(_ruta(directorio, id_trabajo, 'pdf'), pdf_bytes)
+            finally:
+                db.session.remove()
+
+        _guardar_estado(directorio, id_trabajo, LISTO, huella=huella)
+    except Exception as e:
+        _guardar_estado(directorio, id_trabajo, ERROR, mensaje=str(e))
+
+
+_pool = PoolProcesos()
+_pendientes = 0
+#Proceso al que corresponde _pendientes.
+_pendientes_pid = None
+_lock = threading.Lock()
+
+
+def _trabajo_terminado(directorio, id_trabajo, pool, futuro):
+    """Callback del futuro: libera el lugar en la cola y registra si el proceso hijo murió."""
+    global _pendientes
+    with _lock:
+        _pendientes -= 1
+    error = futuro.exception()
+    if isinstance(error, BrokenProcessPool):
+        _pool.descartar(pool)
+    if error is not None:
+        app.logger.error(f'Error en trabajo de PDF {id_trabajo}: {error}')
+        _guardar_estado(directorio, id_trabajo, ERROR, mensaje=str(error))
+
+
+def enviar_trabajo_pdf(tipo, fecha_desde, fecha_hasta, cedula_filtro, usuario):
+    """Encola la generación del PDF y retorna el id del trabajo sin esperar a que termine.
+       Lanza ColaPdfLlena si se alcanzó PDF_TRABAJOS_MAX_COLA trabajos sin terminar."""
+    global _pendientes, _pendientes_pid
+    directorio = _directorio()
+    limpiar_trabajos_vencidos()
+
+    id_trabajo = uuid.uuid4().hex
+    if tipo == 'funcionario':
+        nombre_archivo = f"Mis_Salidas_{usuario.cedula}_{fecha_desde}_{fecha_hasta}.pdf"
+    else:
+        nombre_archivo = f"Reporte_Salidas_{fecha_desde}_{fecha_hasta}.pdf"
+    parametros = {
+        'tipo': tipo,
+        'fecha_desde': fecha_desde,
+        'fecha_hasta': fecha_hasta,
+        'cedula_filtro': cedula_filtro,
+        'cedula_usuario': usuario.cedula,
+    }
+
+    procesos = app.config.get('PDF_TRABAJOS_MAX_PROCESOS', MAX_PROCESOS_DEFECTO)
+    with _lock:
+        if _pendientes_pid != os.getpid():
+            #Después de un fork los trabajos del padre no terminan en este proceso: no ocupan la cola.
+            _pendientes, _pendientes_pid = 0, os.getpid()
+        if _pendientes >= app.config.get('PDF_TRABAJOS_MAX_COLA', MAX_COLA_DEFECTO):
+            raise ColaPdfLlena('Hay demasiados PDF en proceso.')
+        _guardar_estado(directorio, id_trabajo, PENDIENTE, cedula_usuario=usuario.cedula,
+                        nombre_archivo=nombre_archivo, creado=time.time())
+        pool = _pool.obtener(procesos)
+        try:
+            futuro = pool.submit(_ejecutar_trabajo, directorio, id_trabajo, parametros)
+        except BrokenProcessPool:
+            #Un proceso del pool murió sin trabajos pendientes (ningún callback lo descartó): se usa otro pool.
+            _pool.descartar(pool)
+            pool = _pool.obtener(procesos)
+            futuro = pool.submit(_ejecutar_trabajo, directorio, id_trabajo, parametros)
+        _pendientes += 1
+    futuro.add_done_callback(lambda f: _trabajo_terminado(directorio, id_trabajo, pool, f))
+    return id_trabajo
+
+
+def _id_valido(id_trabajo):
+    #Los ids son uuid4 en hexadecimal: evita que se usen rutas arbitrarias.
+    return len(id_trabajo) == 32 and all(c in '0123456789abcdef' for c in id_trabajo)
+
+
+def obtener_estado_trabajo(id_trabajo):
+    """Retorna el estado del trabajo (dict) o None si no existe o ya venció."""
+    if not _id_valido(id_trabajo):
+        return None
+    try:
+        with open(_ruta(_directorio(), id_trabajo, 'json'), encoding='utf-8') as archivo:
+            estado = json.load(archivo)
+    except (OSError, ValueError):
+        return None
+    if time.time() - estado['creado'] > app.config.get('PDF_TRABAJOS_TTL', TTL_DEFECTO):
+        return None
+    return estado
+
+
+def ruta_resultado(id_trabajo):
+    """Ruta del PDF generado por el trabajo."""
+    return _ruta(_directorio(), id_trabajo, 'pdf')
+
+
+def limpiar_trabajos_vencidos():
+    """Borra el estado y el PDF de los trabajos creados hace más de PDF_TRABAJOS_TTL segundos."""
+    directorio = _directorio()
+    limite = time.time() - app.config.get('PDF_TRABAJOS_TTL', TTL_DEFECTO)
+    for nombre in os.listdir(directorio):
+        ruta = os.path.join(directorio, nombre)
+        try:
+            if os.stat(ruta).st_mtime < limite:
+                os.remove(ruta)
+        except FileNotFoundError:
+            pass
@@ -1,5 +1,15 @@
 from xhtml2pdf import pisa
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NullObject, StreamObject
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
+import multiprocessing
+import os
+import shutil
+import stat
+import tempfile
+import threading
 
 def generar_pdf_desde_html(html_content):
     """Recibe un string con HTML y devuelve los bytes del PDF.
@@ -16,3 +26,224 @@ def generar_pdf_desde_html(html_content):
     #Regresamos al inicio del buffer para leerlo.
     output.seek(0)
     return output.read()
+
+def generar_pdf_a_archivo(html_content, ruta):
+    """Igual que generar_pdf_desde_html pero escribe el PDF directamente en un archivo.
+       Retorna False si hubo un error."""
+    with open(ruta, 'wb') as output:
+        pisa_status = pisa.CreatePDF(BytesIO(html_content.encode('utf-8')), dest=output)
+    return not pisa_status.err
+
+#Atributos que una página puede heredar del árbol de páginas de su documento.
+_HEREDABLES = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+class _EscritorPdf:
+    """Escribe un PDF objeto por objeto a medida que se agregan las páginas de otros PDF. De lo ya escrito
+       solo guarda la posición de cada objeto (para el xref) y el número de cada página."""
+
+    def __init__(self, salida):
+        self.salida = salida
+        #Posición en el archivo de cada objeto (el índice es el número de objeto; el 0 no se usa).
+        self.posiciones = array('q', [0])
+        self.paginas = array('q')
+        salida.write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+        self.numero_paginas = self._reservar()
+
+    def _reservar(self):
+        self.posiciones.append(0)
+        return len(self.posiciones) - 1
+
+    def _abrir_objeto(self, numero):
+        self.posiciones[numero] = self.salida.tell()
+        self.salida.write(f'{numero} 0 obj\n'.encode())
+
+    def _escribir(self, numero, objeto):
+        self._abrir_objeto(numero)
+        objeto.write_to_stream(self.salida)
+        self.salida.write(b'\nendobj\n')
+
+    def agregar(self, lector):
+        """Copia las páginas del lector con todo lo que referencian, renumerando los objetos."""
+        nuevos = {}
+        pendientes = []
+
+        def copiar(objeto):
+            if isinstance(objeto, IndirectObject):
+                llave = (objeto.idnum, objeto.generation)
+                if llave not in nuevos:
+                    nuevos[llave] = self._reservar()
+                    pendientes.append(objeto)
+                return IndirectObject(nuevos[llave], 0, None)
+            if isinstance(objeto, StreamObject):
+                #Los datos van tal cual (con su /Filter); /Length lo escribe write_to_stream.
+                copia = StreamObject()
+                copia._data = objeto._data
+                copia.update({clave: copiar(valor) for clave, valor in dict.items(objeto) if clave != '/Length'})
+                return copia
+            if isinstance(objeto, DictionaryObject):
+                return DictionaryObject({clave: copiar(valor) for clave, valor in dict.items(objeto)})
+            if isinstance(objeto, ArrayObject):
+                return ArrayObject(copiar(valor) for valor in list.__iter__(objeto))
+            return objeto
+
+        #Las páginas se numeran primero: un enlace a otra página de la parte apunta a la copia.
+        paginas = list(lector.pages)
+        for pagina in paginas:
+            referencia = pagina.indirect_reference
+            nuevos[(referencia.idnum, referencia.generation)] = self._reservar()
+        for pagina in paginas:
+            referencia = pagina.indirect_reference
+            numero = nuevos[(referencia.idnum, referencia.generation)]
+            copia = DictionaryObject({clave: copiar(valor) for clave, valor in dict.items(pagina) if clave != '/Parent'})
+            for clave in _HEREDABLES:
+                nodo = pagina
+                while clave not in copia and nodo is not None:
+                    if clave in nodo:
+                        copia[NameObject(clave)] = copiar(nodo.raw_get(clave))
+                    nodo = nodo.get('/Parent')
+            copia[NameObject('/Parent')] = IndirectObject(self.numero_paginas, 0, None)
+            self._escribir(numero, copia)
+            self.paginas.append(numero)
+        while pendientes:
+            objeto = pendientes.pop()
+            resuelto = objeto.get_object()
+            self._escribir(nuevos[(objeto.idnum, objeto.generation)],
+                           NullObject() if resuelto is None else copiar(resuelto))
+
+    def terminar(self):
+        """Escribe el árbol de páginas, el catálogo, el xref y el trailer."""
+        self._abrir_objeto(self.numero_paginas)
+        self.salida.write(f'<< /Type /Pages /Count {len(self.paginas)} /Kids ['.encode())
+        for inicio in range(0, len(self.paginas), 1000):
+            self.salida.write(''.join(f'{numero} 0 R ' for numero in self.paginas[inicio:inicio + 1000]).encode())
+        self.salida.write(b'] >>\nendobj\n')
+        catalogo = self._reservar()
+        self._abrir_objeto(catalogo)
+        self.salida.write(f'<< /Type /Catalog /Pages {self.numero_paginas} 0 R >>\nendobj\n'.encode())
+
+        inicio_xref = self.salida.tell()
+        self.salida.write(f'xref\n0 {len(self.posiciones)}\n0000000000 65535 f \n'.encode())
+        for inicio in range(1, len(self.posiciones), 1000):
+            self.salida.write(''.join(f'{posicion:010d} 00000 n \n'
+                                      for posicion in self.posiciones[inicio:inicio + 1000]).encode())
+        self.salida.write(f'trailer\n<< /Size {len(self.posiciones)} /Root {catalogo} 0 R >>\n'
+                          f'startxref\n{inicio_xref}\n%%EOF\n'.encode())
+
+def unir_pdfs(rutas, destino):
+    """Concatena las páginas de los PDF de rutas (en ese orden) en el archivo destino.
+       Cada parte se escribe apenas se lee, así en memoria hay una sola parte a la vez: la memoria no crece
+       con el tamaño del resultado (solo un entero por objeto y por página). Se copian las páginas con lo que
+       referencian (contenido, fuentes, imágenes); lo que es del documento (marcadores, formularios) no."""
+    with open(destino, 'wb') as output:
+        escritor = _EscritorPdf(output)
+        for ruta in rutas:
+            escritor.agregar(PdfReader(ruta))
+        escritor.terminar()
+
+def en_lotes(elementos, tamano):
+    """Agrupa un iterable en listas de hasta tamano elementos, sin recorrerlo de antemano."""
+    lote = []
+    for elemento in elementos:
+        lote.append(elemento)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+def agrupar_fragmentos(fragmentos, tamano=8192):
+    """Junta los fragmentos pequeños de un render en streaming en bloques de ~tamano caracteres,
+       para no escribir en el socket por cada fragmento que produce Jinja."""
+    buffer = []
+    acumulado = 0
+    for fragmento in fragmentos:
+        buffer.append(fragmento)
+        acumulado += len(fragmento)
+        if acumulado >= tamano:
+            yield ''.join(buffer)
+            buffer = []
+            acumulado = 0
+    if buffer:
+        yield ''.join(buffer)
+
+def escribir_atomico(ruta, contenido):
+    """Escribe los bytes (o el contenido de un archivo abierto) en la ruta de forma atómica (os.replace):
+       otros procesos ven el archivo completo o no lo ven, nunca a medio escribir."""
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as archivo:
+            if hasattr(contenido, 'read'):
+                shutil.copyfileobj(contenido, archivo)
+            else:
+                archivo.write(contenido)
+        os.replace(temporal, ruta)
+    except OSError:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+def directorio_privado(ruta):
+    """Crea el directorio (modo 0o700) si no existe y verifica que solo el usuario del proceso pueda escribir en él:
+       que sea un directorio y no un enlace, que sea de este usuario y que el grupo y los demás no tengan escritura.
+       Lanza PermissionError si no (otro usuario pudo crearlo antes, por ejemplo dentro de /tmp)."""
+    os.makedirs(ruta, mode=0o700, exist_ok=True)
+    estado = os.lstat(ruta)
+    if not stat.S_ISDIR(estado.st_mode) or estado.st_uid != os.geteuid() or estado.st_mode & 0o022:
+        raise PermissionError(f'{ruta} no es un directorio privado de este usuario (dueño y modo 0o700).')
+    return ruta
+
+class BufferZip:
+    """Salida sin seek para zipfile: acumula lo escrito hasta que se vacía hacia la respuesta.
+       Permite armar un ZIP mientras se envía, sin escribirlo completo en memoria ni en disco."""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self._partes)
+        self._partes = []
+        return datos
+
+    def pendiente(self):
+        """Produce lo acumulado (si hay algo) para enviarlo al cliente."""
+        datos = self.vaciar()
+        if datos:
+            yield datos
+
+class PoolProcesos:
+    """Pool de procesos propio de cada worker, compartido por los módulos que convierten o emparejan en procesos.
+       Usa spawn: los procesos hijos no heredan las conexiones a la base de datos ni los locks del worker web.
+       Se crea otro si cambia la cantidad de procesos o si se descartó (un proceso hijo murió y el pool quedó
+       roto); en esos casos el anterior se cierra sin esperar y lo que ya estaba en él termina. En un fork se
+       crea otro sin tocar el del padre, que no es de este proceso."""
+
+    def __init__(self):
+        self._pool = None
+        #(pid, procesos) con que se creó _pool.
+        self._llave = None
+        self._lock = threading.Lock()
+
+    def obtener(self, procesos):
+        llave = (os.getpid(), procesos)
+        with self._lock:
+            if self._pool is None or self._llave != llave:
+                anterior = self._pool if self._llave and self._llave[0] == llave[0] else None
+                self._pool = ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn'))
+                self._llave = llave
+                if anterior is not None:
+                    anterior.shutdown(wait=False)
+            return self._pool
+
+    def descartar(self, pool):
+        """Cierra un pool roto (BrokenProcessPool); el próximo obtener crea otro."""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
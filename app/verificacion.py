@@ -0,0 +1,181 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from app import app
+from app.models import verificar_password
+from app.metricas import observar, incrementar
+
+try:
+    import fcntl
+except ImportError:
+    #Windows (desarrollo): no hay límite compartido entre procesos, solo el de cada proceso.
+    fcntl = None
+
+#Verificación de contraseñas fuera del hilo de la petición.
+#pbkdf2 con cientos de miles de iteraciones ocupa un núcleo por login: se corre en un pool acotado
+#(LOGIN_MAX_HILOS hilos por proceso; hashlib libera el GIL) para que una ráfaga de logins no deje sin CPU
+#a los reportes. Además:
+# - Límite del servidor: a lo sumo LOGIN_MAX_SERVIDOR peticiones esperando una verificación a la vez,
+#   sumando todos los workers (un archivo con flock por lugar en LOGIN_ADMISION_DIR). La petición espera
+#   el resultado, así que con los workers sync de Gunicorn cada login en curso ocupa un worker entero:
+#   LOGIN_MAX_SERVIDOR tiene que ser menor que la cantidad de workers para que siempre queden workers
+#   para los reportes.
+# - Control de admisión por proceso: con LOGIN_MAX_PENDIENTES verificaciones en curso o en cola.
+#   Lo que no se admite se rechaza al instante (LoginOcupado, la vista responde 503).
+# - Deduplicación: el mismo intento repetido (doble envío del formulario) espera la misma verificación.
+#   Los intentos distintos para una cedula se encolan y se verifican de a uno, en orden: un intento
+#   equivocado no hace rechazar el del usuario.
+# - Métricas en /metrics: login_verificacion_segundos (latencia por resultado: aceptados, rechazados,
+#   no_admitidos) y login_compartidos_total (intentos repetidos que esperaron una verificación en curso).
+
+MAX_HILOS_DEFECTO = 2
+MAX_PENDIENTES_DEFECTO = 16
+MAX_SERVIDOR_DEFECTO = 4
+TIMEOUT_DEFECTO = 15
+DIRECTORIO_DEFECTO = os.path.join(tempfile.gettempdir(), 'marcaciones_login')
+
+
+class LoginOcupado(Exception):
+    """Se lanza cuando no se admite la verificación (demasiados logins en curso)."""
+
+
+_pool = None
+_pool_pid = None
+#cedula -> {hash del intento: futuro} de los intentos en curso o en cola.
+_en_curso = {}
+#cedula -> futuro del último intento encolado (el próximo intento distinto espera a ese).
+_ultimos = {}
+_pendientes = 0
+_lock = threading.Lock()
+
+
+def _obtener_pool():
+    """Pool de hilos de este proceso (un fork no hereda los hilos del pool del padre)."""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ThreadPoolExecutor(max_workers=app.config.get('LOGIN_MAX_HILOS', MAX_HILOS_DEFECTO),
+                                   thread_name_prefix='verificacion')
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def _tomar_lugar():
+    """Toma uno de los LOGIN_MAX_SERVIDOR lugares compartidos por los procesos del servidor.
+       Retorna el descriptor del archivo bloqueado (-1 si no hay flock) o None si están todos ocupados.
+       El lock se libera al cerrar el descriptor, también si el proceso muere."""
+    if fcntl is None:
+        return -1
+    directorio = app.config.get('LOGIN_ADMISION_DIR', DIRECTORIO_DEFECTO)
+    os.makedirs(directorio, exist_ok=True)
+    for numero in range(app.config.get('LOGIN_MAX_SERVIDOR', MAX_SERVIDOR_DEFECTO)):
+        descriptor = os.open(os.path.join(directorio, f'{numero}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return descriptor
+        except OSError:
+            os.close(descriptor)
+    return None
+
+
+def _liberar_lugar(descriptor):
+    if descriptor >= 0:
+        os.close(descriptor)
+
+
+def _registrar(inicio, resultado):
+    observar('login_verificacion_segundos', time.time() - inicio, resultado=resultado)
+
+
+def _no_admitido(inicio, cedula, motivo):
+    _registrar(inicio, 'no_admitidos')
+    app.logger.warning(f'Login no admitido para {cedula}: {motivo}')
+    raise LoginOcupado('Demasiados inicios de sesión en curso.')
+
+
+def verificar_login(cedula, password, raw_password):
+    """Verifica la contraseña en el pool y espera el resultado (True/False).
+       Lanza LoginOcupado si no se admite la verificación o no termina a tiempo."""
+    inicio = time.time()
+    lugar = _tomar_lugar()
+    if lugar is None:
+        _no_admitido(inicio, cedula, 'demasiados logins en curso en el servidor')
+    try:
+        futuro = _admitir(cedula, password, raw_password)
+    except BaseException:
+        _liberar_lugar(lugar)
+        raise
+    if futuro is None:
+        _liberar_lugar(lugar)
+        _no_admitido(inicio, cedula, 'demasiadas verificaciones en curso')
+    #El lugar se libera cuando termina la verificación y no cuando la petición deja de esperarla: después de
+    #LOGIN_TIMEOUT pbkdf2 sigue ocupando un núcleo hasta terminar.
+    futuro.add_done_callback(lambda _: _liberar_lugar(lugar))
+    try:
+        valido = futuro.result(timeout=app.config.get('LOGIN_TIMEOUT', TIMEOUT_DEFECTO))
+    except TimeoutError:
+        _registrar(inicio, 'no_admitidos')
+        raise LoginOcupado('La verificación de la contraseña no terminó a tiempo.')
+
+    _registrar(inicio, 'aceptados' if valido else 'rechazados')
+    return valido
+
+
+def _admitir(cedula, password, raw_password):
+    """Retorna el futuro de la verificación del intento (el que ya está en curso si es el mismo intento)
+       o None si este proceso ya tiene LOGIN_MAX_PENDIENTES verificaciones en curso o en cola."""
+    global _pendientes
+    #El intento se identifica por un hash: no se guarda la contraseña en texto plano.
+    intento = hashlib.sha256(raw_password.encode('utf-8')).digest()
+
+    with _lock:
+        futuro = _en_curso.get(cedula, {}).get(intento)
+        if futuro is not None:
+            incrementar('login_compartidos_total')
+            return futuro
+        if _pendientes >= app.config.get('LOGIN_MAX_PENDIENTES', MAX_PENDIENTES_DEFECTO):
+            return None
+        futuro = Future()
+        _en_curso.setdefault(cedula, {})[intento] = futuro
+        anterior = _ultimos.get(cedula)
+        _ultimos[cedula] = futuro
+        _pendientes += 1
+        futuro.add_done_callback(lambda f: _terminar(cedula, intento, f))
+
+    #Los intentos distintos de una cedula se verifican de a uno: este arranca cuando termina el anterior.
+    if anterior is None:
+        _lanzar(futuro, password, raw_password)
+    else:
+        anterior.add_done_callback(lambda _: _lanzar(futuro, password, raw_password))
+    return futuro
+
+
+def _lanzar(futuro, password, raw_password):
+    """Corre la verificación en el pool y pasa el resultado (o el error) al futuro del intento."""
+    def pasar(verificacion):
+        error = verificacion.exception()
+        if error is None:
+            futuro.set_result(verificacion.result())
+        else:
+            futuro.set_exception(error)
+    try:
+        _obtener_pool().submit(verificar_password, password, raw_password).add_done_callback(pasar)
+    except RuntimeError as error:
+        #El pool ya se cerró (el proceso está terminando).
+        futuro.set_exception(error)
+
+
+def _terminar(cedula, intento, futuro):
+    global _pendientes
+    with _lock:
+        intentos = _en_curso.get(cedula)
+        if intentos is not None and intentos.get(intento) is futuro:
+            del intentos[intento]
+            if not intentos:
+                del _en_curso[cedula]
+        if _ultimos.get(cedula) is futuro:
+            del _ultimos[cedula]
+        _pendientes -= 1
+
@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time as reloj
+from datetime import date, datetime, timedelta, time
+import numpy as np
+from flask import render_template
+from app import app
+from app.models import FormularioSalida, MarcacionIntermediaGeneral, Usuario
+from app.marcaciones import COLUMNAS_MARCACION
+from app.motor_vectorizado import emparejar_lote
+from app.services import emparejar_por_dia, _filas_para_motor, _armar_reporte
+from app.utils import generar_pdf_desde_html
+from semilla import generar_marcaciones_para_formulario, MOTIVOS, DESTINOS
+
+#Benchmark de las etapas del reporte con datos sintéticos en memoria (no usa la base de datos).
+#Las filas imitan las de FormularioSalida.obtener_reporte_admin: (formulario, marcacion, usuario, resultado),
+#con los casos de semilla.py y entre 2 y 10 marcaciones por dia. Se mide por separado:
+# - filas: parseo de la vista a las filas del motor (_filas_para_motor)
+# - emparejamiento_por_dia / emparejamiento_vectorizado: los dos motores de Python
+# - registros: DTO y estadísticas (_armar_reporte)
+# - plantilla / pdf: render de pdf_template.html y xhtml2pdf, con a lo sumo --max-filas-pdf filas
+#   de detalle y de resumen
+#El resultado se guarda en JSON; con --comparar se contrasta con otra corrida (por ejemplo de otro commit)
+#y el script termina con código 1 si alguna etapa es más lenta que la tolerancia.
+#   python benchmark.py
+#   python benchmark.py --tamanos 1000,100000,1000000 --repeticiones 5 --salida antes.json
+#   python benchmark.py --comparar antes.json
+
+ETAPAS = ['filas', 'emparejamiento_por_dia', 'emparejamiento_vectorizado', 'registros', 'plantilla', 'pdf']
+FORMULARIOS_POR_FUNCIONARIO = 100
+
+parser = argparse.ArgumentParser(description='Benchmark del emparejamiento y del reporte con datos sintéticos.')
+parser.add_argument('--tamanos', type=lambda texto: [int(valor) for valor in texto.split(',')],
+                    default=[1000, 10000, 100000], help='cantidades de formularios, separadas por coma')
+parser.add_argument('--repeticiones', type=int, default=3)
+parser.add_argument('--semilla', type=int, default=0)
+parser.add_argument('--max-filas-pdf', type=int, default=500,
+                    help='filas del detalle y del resumen en plantilla y pdf')
+parser.add_argument('--etapas', type=lambda texto: texto.split(','), default=ETAPAS)
+parser.add_argument('--salida', help='archivo JSON de resultados (por defecto benchmark_<commit>_<fecha>.json)')
+parser.add_argument('--comparar', help='JSON de una corrida anterior para comparar')
+parser.add_argument('--tolerancia', type=float, default=0.2,
+                    help='fracción de tiempo extra que se acepta al comparar (0.2 = 20%%)')
+
+
+def _texto_hora(momento):
+    return momento.strftime('%H:%M:%S')
+
+
+def generar_filas(tamano, azar):
+    """Filas (formulario, marcacion, usuario, None) en el orden del reporte (fecha desc, hora de salida).
+       Un formulario por funcionario y dia, FORMULARIOS_POR_FUNCIONARIO dias por funcionario."""
+    cantidad_funcionarios = max(1, -(-tamano // FORMULARIOS_POR_FUNCIONARIO))
+    usuarios = [Usuario(cedula=str(1000000 + numero), nombre='Funcionario', apellido=f'Benchmark {numero}')
+                for numero in range(cantidad_funcionarios)]
+    fecha_base = date(2026, 1, 1)
+
+    filas = []
+    for numero in range(tamano):
+        usuario = usuarios[numero % cantidad_funcionarios]
+        fecha = fecha_base - timedelta(days=numero // cantidad_funcionarios)
+        dummy_salida = datetime.combine(fecha, time(8, 0)) + timedelta(minutes=azar.randint(0, 300))
+        dummy_llegada = dummy_salida + timedelta(minutes=azar.randint(30, 90))
+        tipo_caso = azar.choices([1, 2, 3], weights=[20, 30, 50])[0]
+        marcaciones, _ = generar_marcaciones_para_formulario(azar, dummy_salida, dummy_llegada, tipo_caso, [1, 1, 1])
+
+        #Marcaciones sueltas hasta completar entre 2 y 10 en el dia.
+        objetivo = azar.randint(2, len(COLUMNAS_MARCACION))
+        while len(marcaciones) < objetivo:
+            marcaciones.append(datetime.combine(fecha, time(7, 0)) + timedelta(seconds=azar.randint(0, 8 * 3600)))
+        marcaciones.sort()
+
+        formulario = FormularioSalida(id_salida=numero + 1, ci_nro=usuario.cedula, fecha=fecha,
+                                      hora_salida_estipulada=dummy_salida.time(),
+                                      hora_llegada_estipulada=dummy_llegada.time(),
+                                      motivo=azar.choice(MOTIVOS), destino=azar.choice(DESTINOS), estado=True)
+        marcacion = MarcacionIntermediaGeneral(ci_nro=usuario.cedula, fecha_marcacion=fecha,
+                                               nombre=usuario.nombre, apellido=usuario.apellido,
+                                               **{columna: _texto_hora(momento)
+                                                  for columna, momento in zip(COLUMNAS_MARCACION, marcaciones)})
+        filas.append((formulario, marcacion, usuario, None))
+
+    filas.sort(key=lambda fila: (-fila[0].fecha.toordinal(), fila[0].hora_salida_estipulada, fila[0].id_salida))
+    return filas
+
+
+def medir(funcion, repeticiones):
+    """Corre la función repeticiones veces; retorna (último resultado, tiempos en segundos)."""
+    tiempos = []
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = reloj.perf_counter()
+        resultado = funcion()
+        tiempos.append(reloj.perf_counter() - inicio)
+    return resultado, tiempos
+
+
+def medir_tamano(tamano, argumentos):
+    """Mide las etapas pedidas para un tamaño. Retorna {etapa: {segundos, mediana, filas, por_segundo}}."""
+    resultados = generar_filas(tamano, random.Random(argumentos.semilla))
+    medidas = {}
+
+    def registrar(etapa, tiempos, filas):
+        medidas[etapa] = {'segundos': min(tiempos), 'mediana': statistics.median(tiempos), 'filas': filas,
+                          'por_segundo': filas / min(tiempos) if min(tiempos) else None}
+        print(f"   {etapa:<28} {min(tiempos) * 1000:10.1f} ms  ({filas} filas)")
+
+    #Las etapas siguientes necesitan las anteriores: se calculan aunque no se midan.
+    filas_motor, tiempos = medir(lambda: list(_filas_para_motor(resultados)), argumentos.repeticiones)
+    if 'filas' in argumentos.etapas:
+        registrar('filas', tiempos, tamano)
+
+    emparejados = None
+    if 'emparejamiento_por_dia' in argumentos.etapas:
+        emparejados, tiempos = medir(lambda: list(emparejar_por_dia(filas_motor)), argumentos.repeticiones)
+        registrar('emparejamiento_por_dia', tiempos, tamano)
+    if 'emparejamiento_vectorizado' in argumentos.etapas or emparejados is None:
+        vectorizados, tiempos = medir(lambda: emparejar_lote(filas_motor), argumentos.repeticiones)
+        if 'emparejamiento_vectorizado' in argumentos.etapas:
+            registrar('emparejamiento_vectorizado', tiempos, tamano)
+        if emparejados is not None and emparejados != vectorizados:
+            print("   ⚠️  Los motores por_dia y vectorizado no coinciden")
+        emparejados = vectorizados
+
+    (registros, resumen), tiempos = medir(lambda: _armar_reporte(resultados, emparejados), argumentos.repeticiones)
+    if 'registros' in argumentos.etapas:
+        registrar('registros', tiempos, tamano)
+
+    if 'plantilla' not in argumentos.etapas and 'pdf' not in argumentos.etapas:
+        return medidas
+
+    filas_pdf = min(tamano, argumentos.max_filas_pdf)
+    contexto = {'registros': registros[:filas_pdf], 'resumen': resumen[:filas_pdf], 'fecha_desde': '01-01-2026',
+                'fecha_hasta': '31-12-2026', 'tipo': 'admin', 'nombre_funcionario': '', 'cedula_funcionario': '',
+                'fecha_generacion': '01-01-2026 00:00'}
+    with app.test_request_context():
+        html_content, tiempos = medir(lambda: render_template('pdf_template.html', **contexto),
+                                      argumentos.repeticiones)
+    if 'plantilla' in argumentos.etapas:
+        registrar('plantilla', tiempos, filas_pdf)
+    if 'pdf' in argumentos.etapas:
+        _, tiempos = medir(lambda: generar_pdf_desde_html(html_content), argumentos.repeticiones)
+        registrar('pdf', tiempos, filas_pdf)
+    return medidas
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(actual, anterior, tolerancia):
+    """Imprime la relación de tiempos contra la corrida anterior. Retorna la cantidad de etapas más lentas."""
+    print(f"\nComparación con {anterior.get('commit')} ({anterior.get('fecha')}):")
+    regresiones = 0
+    for tamano, etapas in actual['resultados'].items():
+        for etapa, medida in etapas.items():
+            previa = anterior.get('resultados', {}).get(tamano, {}).get(etapa)
+            if not previa or not previa['segundos'] or previa['filas'] != medida['filas']:
+                continue
+            relacion = medida['segundos'] / previa['segundos']
+            marca = ''
+            if relacion > 1 + tolerancia:
+                marca = '  ⚠️  más lento'
+                regresiones += 1
+            print(f"   {tamano:>8} {etapa:<28} {previa['segundos'] * 1000:10.1f} → "
+                  f"{medida['segundos'] * 1000:10.1f} ms  x{relacion:.2f}{marca}")
+    return regresiones
+
+
+def main(argumentos):
+    app.config.update(FUENTE_MARCACIONES='vista', MOTOR_EMPAREJAMIENTO='vectorizado')
+    commit = _commit_actual()
+    actual = {
+        'commit': commit,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'plataforma': platform.platform(),
+        'semilla': argumentos.semilla,
+        'repeticiones': argumentos.repeticiones,
+        'resultados': {},
+    }
+    with app.app_context():
+        for tamano in argumentos.tamanos:
+            print(f"{tamano} formularios:")
+            actual['resultados'][str(tamano)] = medir_tamano(tamano, argumentos)
+
+    salida = argumentos.salida or f"benchmark_{commit or 'sin_commit'}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(salida, 'w', encoding='utf-8') as archivo:
+        json.dump(actual, archivo, indent=2)
+    print(f"\nResultados guardados en {salida}")
+
+    if argumentos.comparar:
+        with open(argumentos.comparar, encoding='utf-8') as archivo:
+            regresiones = comparar(actual, json.load(archivo), argumentos.tolerancia)
+        return 1 if regresiones else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(parser.parse_args()))
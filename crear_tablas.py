@@ -1,7 +1,10 @@
 from app import app, db
+from app.migraciones import aplicar_migraciones
 
 with app.app_context():
     print("Creando tablas nuevas...")
     #Esto solo crea las tablas que NO existen en la BD.
     db.create_all()
-    print("Tablas creadas exitosamente.")
\ No newline at end of file
+    print("Tablas creadas exitosamente.")
+    #Índices y cambios sobre tablas existentes: ver migrar.py (las migraciones opcionales no se aplican acá).
+    print(f"Migraciones aplicadas: {aplicar_migraciones() or 'ninguna'}")
\ No newline at end of file
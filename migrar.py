@@ -0,0 +1,50 @@
+import argparse
+from datetime import date
+from app import app, db
+from app.migraciones import migraciones_pendientes, aplicar_migraciones, explicar_reportes, versiones_opcionales
+
+#Aplica las migraciones pendientes del esquema (ver app/migraciones.py).
+#   python migrar.py                                   aplica lo pendiente
+#   python migrar.py --estado                          lista lo pendiente sin aplicarlo
+#   python migrar.py --opcional 2                      aplica lo pendiente y además la migración opcional 2
+#                                                      (índice en una tabla de otro sistema: solo con el visto
+#                                                      bueno del dueño de la tabla, ver app/migraciones.py)
+#   python migrar.py --explicar 2025-01-01 2025-01-31 [--cedula 1234567] [--analizar]
+#                                                      muestra qué índices usan las consultas de los reportes
+
+parser = argparse.ArgumentParser(description='Migraciones del esquema registro_intermedio.')
+parser.add_argument('--estado', action='store_true', help='solo lista las migraciones pendientes')
+parser.add_argument('--opcional', action='append', type=int, default=[], choices=versiones_opcionales(),
+                    metavar='VERSION', help='incluye esa migración opcional (se puede repetir)')
+parser.add_argument('--explicar', nargs=2, metavar=('DESDE', 'HASTA'), type=date.fromisoformat,
+                    help='corre EXPLAIN sobre las consultas de los reportes en ese rango')
+parser.add_argument('--cedula', help='cedula para el reporte filtrado y el del funcionario')
+parser.add_argument('--analizar', action='store_true', help='ejecuta las consultas (EXPLAIN ANALYZE)')
+argumentos = parser.parse_args()
+
+with app.app_context():
+    if argumentos.explicar:
+        informe = explicar_reportes(*argumentos.explicar, cedula=argumentos.cedula, analizar=argumentos.analizar)
+        for nombre, plan in informe.items():
+            print(f"{nombre}: costo {plan['costo']}" +
+                  (f", {plan['tiempo_ms']:.1f} ms" if plan['tiempo_ms'] is not None else ''))
+            for indice in plan['indices']:
+                print(f"   índice: {indice}")
+            for tabla in plan['secuenciales']:
+                print(f"   recorrido completo: {tabla}")
+    else:
+        with db.engine.connect() as conexion:
+            pendientes = migraciones_pendientes(conexion, argumentos.opcional)
+            sin_pedir = [migracion for migracion in migraciones_pendientes(conexion, versiones_opcionales())
+                         if migracion not in pendientes]
+            conexion.commit()
+        for migracion in pendientes:
+            print(f"Pendiente {migracion['version']}: {migracion['descripcion']}")
+        for migracion in sin_pedir:
+            print(f"Opcional {migracion['version']} (no se aplica sin --opcional {migracion['version']}): "
+                  f"{migracion['descripcion']}")
+        if not pendientes:
+            print("El esquema está al día.")
+        elif not argumentos.estado:
+            aplicadas = aplicar_migraciones(argumentos.opcional)
+            print(f"Migraciones aplicadas: {', '.join(map(str, aplicadas)) or 'ninguna'}")
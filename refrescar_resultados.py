@@ -0,0 +1,8 @@
+from app import app
+from app.services import refrescar_resultados_materializados
+
+#Pensado para correr todas las noches (cron) después de la carga de marcaciones del reloj.
+with app.app_context():
+    print("Refrescando resultados materializados...")
+    total = refrescar_resultados_materializados()
+    print(f"Formularios recalculados: {total}")
@@ -1,354 +1,343 @@
-from app import app, db
-from app.models import FormularioSalida, Usuario
-from sqlalchemy import text
-from datetime import datetime, timedelta, time
+import argparse
+import io
 import random
+import time as reloj
+from collections import Counter
+from datetime import date, datetime, timedelta, time
+from sqlalchemy import text, insert, bindparam
+from app import app, db
+from app.models import Usuario
+
+#Generador de datos de prueba para cargas y benchmarks.
+#Todo se genera en memoria con un random.Random(semilla) (mismos parámetros y misma semilla = mismos datos)
+#y se carga por lotes: COPY en PostgreSQL, executemany en otros motores.
+#   python semilla.py                                            20 funcionarios, 2026 hasta hoy
+#   python semilla.py --funcionarios 5000 --desde 2023-01-01 --hasta 2025-12-31 --crear-funcionarios
+#   python semilla.py --salidas-por-mes 4 --mezcla 10,30,60 --variaciones 6,3,1 --semilla 42
+#Los funcionarios son los primeros (por cedula) de asistencias.funcionarios que tienen ficha en
+#ficha_personal.personal; con --crear-funcionarios se agregan los que falten, con cedulas desde
+#CEDULA_BASE_SEMILLA y sin contraseña.
+
+CEDULA_BASE_SEMILLA = 90000000
+USUARIO_SEMILLA = 'semilla_sistema'
+DIAS_HABILES_POR_MES = 21.7
+
+MOTIVOS = [
+    "Consulta médica", "Trámites bancarios", "IPS",
+    "Gestión judicial", "Reunión externa", "Trámite personal",
+    "Consulta odontológica", "Retiro de documentos",
+    "Trámites municipales", "Gestión administrativa"
+]
+
+DESTINOS = [
+    "Hospital de Clínicas", "Banco Nacional", "IPS Central",
+    "Palacio de Justicia", "Municipalidad", "SET",
+    "ANDE", "ESSAP", "Registro Civil", "Policía Nacional"
+]
+
+VARIACIONES = ['correcto', 'alerta', 'falta']
+
+COLUMNAS_FORMULARIO = ['ci_nro', 'fecha', 'hora_salida_estipulada', 'hora_llegada_estipulada',
+                       'motivo', 'destino', 'estado', 'fecha_creacion']
+COLUMNAS_MARCACION = ['personal_id', 'registrado', 'fecha_alta', 'fecha_modificacion', 'usuario_alta',
+                      'usuario_modificacion', 'registrado_modificado', 'estado', 'mecanismo_creacion']
+TABLA_MARCACIONES = 'control_asistencia.registro_entrada_salida'
+
+
+def _pesos(texto):
+    pesos = [float(valor) for valor in texto.split(',')]
+    if len(pesos) != 3 or min(pesos) < 0 or not sum(pesos):
+        raise argparse.ArgumentTypeError('se esperan 3 pesos no negativos separados por coma, ej. 20,30,50')
+    return pesos
 
-def generar_hora_aleatoria(base_hora, minutos_variacion=15):
+
+parser = argparse.ArgumentParser(description='Genera formularios y marcaciones de prueba.')
+parser.add_argument('--funcionarios', type=int, default=20, help='cantidad de funcionarios')
+parser.add_argument('--desde', type=date.fromisoformat, default=date(2026, 1, 1))
+parser.add_argument('--hasta', type=date.fromisoformat, default=date.today())
+parser.add_argument('--salidas-por-mes', type=float, default=1.0,
+                    help='promedio de salidas por funcionario por mes (a lo sumo una por dia hábil)')
+parser.add_argument('--mezcla', type=_pesos, default=[20, 30, 50],
+                    help='pesos de los casos 1 (sin intermedias), 2 (solo una) y 3 (ambas)')
+parser.add_argument('--variaciones', type=_pesos, default=[1, 1, 1],
+                    help='pesos de las marcaciones correcto, alerta y falta')
+parser.add_argument('--semilla', type=int, default=0)
+parser.add_argument('--lote', type=int, default=100000, help='marcaciones por lote de carga')
+parser.add_argument('--crear-funcionarios', action='store_true',
+                    help='crea los funcionarios que falten para llegar a --funcionarios')
+parser.add_argument('--conservar', action='store_true',
+                    help='no borra los datos anteriores (se saltean los dias que ya tienen formulario)')
+parser.add_argument('--detalle', action='store_true', help='imprime una linea por formulario')
+
+
+def generar_hora_aleatoria(azar, base_hora, minutos_variacion=15):
     """Genera una hora con variación aleatoria"""
-    dummy_date = datetime.combine(datetime.today(), base_hora)
-    variacion = random.randint(-minutos_variacion, minutos_variacion)
-    nueva_hora = dummy_date + timedelta(minutes=variacion)
-    return nueva_hora.time()
+    dummy_date = datetime.combine(date.today(), base_hora)
+    variacion = azar.randint(-minutos_variacion, minutos_variacion)
+    return (dummy_date + timedelta(minutes=variacion)).time()
 
-def limpiar_datos_anteriores():
-    """Elimina TODOS los datos de prueba anteriores"""
-    print("🗑️  Limpiando TODOS los datos anteriores...")
-    
-    # Eliminar TODAS las marcaciones de semilla_sistema
-    sql_delete_marcaciones = text("""
-        DELETE FROM control_asistencia.registro_entrada_salida
-        WHERE usuario_alta = 'semilla_sistema'
-    """)
-    result_marc = db.session.execute(sql_delete_marcaciones)
-    
-    # Eliminar TODOS los formularios
-    sql_delete_forms = text("""
-        DELETE FROM registro_intermedio.formulario_salida
-    """)
-    result_forms = db.session.execute(sql_delete_forms, {})
-    
-    # Commit de la limpieza
-    db.session.commit()
-    
-    print(f"   ✓ Eliminadas {result_marc.rowcount} marcaciones anteriores")
-    print(f"   ✓ Eliminados {result_forms.rowcount} formularios anteriores")
-    print()
 
-def insertar_marcacion_reloj(ci_nro, fecha, hora_marcacion):
-    """Inserta una marcación en la tabla base registro_entrada_salida"""
-    if hora_marcacion is None:
-        return
-    
-    registrado = datetime.combine(fecha, hora_marcacion)
-    fecha_alta = datetime.now()
-    
-    sql = text("""
-        INSERT INTO control_asistencia.registro_entrada_salida 
-        (personal_id, registrado, fecha_alta, fecha_modificacion, 
-         usuario_alta, usuario_modificacion, registrado_modificado, estado, mecanismo_creacion) 
-        SELECT 
-            p.id as personal_id,
-            :registrado as registrado,
-            :fecha_alta as fecha_alta,
-            :fecha_alta as fecha_modificacion,
-            'semilla_sistema' as usuario_alta,
-            'semilla_sistema' as usuario_modificacion,
-            :registrado as registrado_modificado,
-            'PEN' as estado,
-            1 as mecanismo_creacion
-        FROM ficha_personal.personal p
-        INNER JOIN asistencias.funcionarios f ON f.cedula = p.ci_nro
-        WHERE f.cedula = :ci_nro
-        LIMIT 1
-    """)
-    
-    db.session.execute(sql, {
-        'ci_nro': ci_nro,
-        'registrado': registrado,
-        'fecha_alta': fecha_alta
-    })
-
-def generar_marcaciones_para_formulario(hora_salida_est, hora_llegada_est, fecha, tipo_caso):
+def _hora_marcada(azar, estipulada, variacion, es_llegada):
+    """Hora marcada según la variación: correcto ≤ 15 min, alerta > 15 y ≤ 60 min, falta > 60 min.
+       En la llegada la alerta y la falta se marcan antes de la hora estipulada."""
+    if variacion == 'correcto':
+        minutos = azar.randint(-15, 15)
+    elif variacion == 'alerta':
+        minutos = azar.randint(16, 60)
+    else:
+        minutos = azar.randint(61, 120)
+    if es_llegada and variacion != 'correcto':
+        minutos = -minutos
+    return estipulada + timedelta(minutes=minutos)
+
+
+def generar_marcaciones_para_formulario(azar, dummy_salida, dummy_llegada, tipo_caso, pesos_variacion):
     """
-    Genera marcaciones realistas:
-    - Siempre incluye marcación de entrada (07:00) y salida del trabajo (15:00)
+    Genera marcaciones realistas (datetime del dia del formulario):
+    - Siempre incluye marcación de entrada (~07:00) y salida del trabajo (~15:00)
     - tipo_caso 1: No marcó salida ni llegada intermedia (solo 2 marcaciones)
     - tipo_caso 2: Solo marcó UNA de las intermedias (3 marcaciones totales)
-    - tipo_caso 3: Marcó ambas intermedias (4+ marcaciones)
-    
-    Estados:
-    - Correcto (🟢): ≤ 15 minutos
-    - Alerta (🟡): > 15 min y ≤ 60 min
-    - Falta (🔴): > 60 min o no marcó
+    - tipo_caso 3: Marcó ambas intermedias (4 marcaciones)
+    Retorna (marcaciones ordenadas, escenario).
     """
-    dummy_salida = datetime.combine(fecha, hora_salida_est)
-    dummy_llegada = datetime.combine(fecha, hora_llegada_est)
-    
-    # SIEMPRE generar marcación de entrada (07:00) y salida del trabajo (15:00)
-    hora_entrada_trabajo = generar_hora_aleatoria(time(7, 0), 10)  # ~07:00 ±10 min
-    hora_salida_trabajo = generar_hora_aleatoria(time(15, 0), 10)  # ~15:00 ±10 min
-    
-    marcaciones = [hora_entrada_trabajo]  # Siempre empieza con entrada
-    escenario = "desconocido"
-    
+    fecha = dummy_salida.date()
+    marcaciones = [datetime.combine(fecha, generar_hora_aleatoria(azar, time(7, 0), 10)),
+                   datetime.combine(fecha, generar_hora_aleatoria(azar, time(15, 0), 10))]
+
     if tipo_caso == 1:
-        # CASO 1: No marcó ni salida ni llegada intermedia
-        # Solo 2 marcaciones: entrada trabajo + salida trabajo
-        marcaciones.append(hora_salida_trabajo)
-        escenario = "🔴 sin_marcar_intermedias"
-        
+        escenario = 'sin_marcar_intermedias'
     elif tipo_caso == 2:
-        # CASO 2: Solo marcó UNA intermedia
-        marca_salida = random.choice([True, False])
-        
-        if marca_salida:
-            # Solo marcó salida intermedia
-            variacion = random.choice(['correcto', 'alerta', 'falta'])
-            
-            if variacion == 'correcto':
-                # ≤ 15 minutos
-                minutos_var = random.randint(-15, 15)
-                hora_marc = (dummy_salida + timedelta(minutes=minutos_var)).time()
-                emoji = '🟢'
-            elif variacion == 'alerta':
-                # > 15 min y ≤ 60 min
-                minutos_var = random.randint(16, 60)
-                hora_marc = (dummy_salida + timedelta(minutes=minutos_var)).time()
-                emoji = '🟡'
-            else:  # falta
-                # > 60 min
-                minutos_var = random.randint(61, 120)
-                hora_marc = (dummy_salida + timedelta(minutes=minutos_var)).time()
-                emoji = '🔴'
-            
-            # 3 marcaciones: entrada + salida intermedia + salida trabajo
-            marcaciones.append(hora_marc)
-            marcaciones.append(hora_salida_trabajo)
-            escenario = f"{emoji} solo_salida_{variacion}"
-            
-        else:
-            # Solo marcó llegada intermedia
-            variacion = random.choice(['correcto', 'alerta', 'falta'])
-            
-            if variacion == 'correcto':
-                minutos_var = random.randint(-15, 15)
-                hora_marc = (dummy_llegada + timedelta(minutes=minutos_var)).time()
-                emoji = '🟢'
-            elif variacion == 'alerta':
-                minutos_var = random.randint(16, 60)
-                hora_marc = (dummy_llegada - timedelta(minutes=minutos_var)).time()
-                emoji = '🟡'
-            else:  # falta
-                minutos_var = random.randint(61, 120)
-                hora_marc = (dummy_llegada - timedelta(minutes=minutos_var)).time()
-                emoji = '🔴'
-            
-            # 3 marcaciones: entrada + llegada intermedia + salida trabajo
-            marcaciones.append(hora_marc)
-            marcaciones.append(hora_salida_trabajo)
-            escenario = f"{emoji} solo_llegada_{variacion}"
-            
-    else:  # tipo_caso == 3
-        # CASO 3: Marcó AMBAS intermedias (4 marcaciones mínimo)
-        
-        # Variaciones independientes
-        var_salida = random.choice(['correcto', 'alerta', 'falta'])
-        var_llegada = random.choice(['correcto', 'alerta', 'falta'])
-        
-        # Generar hora de salida intermedia
-        if var_salida == 'correcto':
-            minutos_var = random.randint(-15, 15)
-            hora_salida_marc = (dummy_salida + timedelta(minutes=minutos_var)).time()
-        elif var_salida == 'alerta':
-            minutos_var = random.randint(16, 60)
-            hora_salida_marc = (dummy_salida + timedelta(minutes=minutos_var)).time()
-        else:  # falta
-            minutos_var = random.randint(61, 120)
-            hora_salida_marc = (dummy_salida + timedelta(minutes=minutos_var)).time()
-        
-        # Generar hora de llegada intermedia
-        if var_llegada == 'correcto':
-            minutos_var = random.randint(-15, 15)
-            hora_llegada_marc = (dummy_llegada + timedelta(minutes=minutos_var)).time()
-        elif var_llegada == 'alerta':
-            minutos_var = random.randint(16, 60)
-            hora_llegada_marc = (dummy_llegada - timedelta(minutes=minutos_var)).time()
-        else:  # falta
-            minutos_var = random.randint(61, 120)
-            hora_llegada_marc = (dummy_llegada - timedelta(minutes=minutos_var)).time()
-        
-        # 4 marcaciones: entrada + salida intermedia + llegada intermedia + salida trabajo
-        marcaciones.append(hora_salida_marc)
-        marcaciones.append(hora_llegada_marc)
-        marcaciones.append(hora_salida_trabajo)
-        
-        # Determinar color según peor caso
-        if var_salida == 'falta' or var_llegada == 'falta':
-            color = '🔴'
-        elif var_salida == 'alerta' or var_llegada == 'alerta':
-            color = '🟡'
+        variacion = azar.choices(VARIACIONES, weights=pesos_variacion)[0]
+        if azar.random() < 0.5:
+            marcaciones.append(_hora_marcada(azar, dummy_salida, variacion, False))
+            escenario = f'solo_salida_{variacion}'
         else:
-            color = '🟢'
-        
-        escenario = f"{color} ambas_s:{var_salida}_l:{var_llegada}"
-    
-    # Ordenar marcaciones por hora
+            marcaciones.append(_hora_marcada(azar, dummy_llegada, variacion, True))
+            escenario = f'solo_llegada_{variacion}'
+    else:
+        var_salida, var_llegada = azar.choices(VARIACIONES, weights=pesos_variacion, k=2)
+        marcaciones.append(_hora_marcada(azar, dummy_salida, var_salida, False))
+        marcaciones.append(_hora_marcada(azar, dummy_llegada, var_llegada, True))
+        escenario = f'ambas_s:{var_salida}_l:{var_llegada}'
+
     marcaciones.sort()
-    
     return marcaciones, escenario
 
-def cargar_datos_completos():
+
+def limpiar_datos_anteriores():
+    """Elimina TODOS los formularios y las marcaciones cargadas por la semilla"""
+    print("🗑️  Limpiando TODOS los datos anteriores...")
+    result_marc = db.session.execute(text(f"DELETE FROM {TABLA_MARCACIONES} WHERE usuario_alta = :usuario"),
+                                     {'usuario': USUARIO_SEMILLA})
+    result_forms = db.session.execute(text("DELETE FROM registro_intermedio.formulario_salida"))
+    db.session.commit()
+    print(f"   ✓ Eliminadas {result_marc.rowcount} marcaciones anteriores")
+    print(f"   ✓ Eliminados {result_forms.rowcount} formularios anteriores")
+    print()
+
+
+_SQL_FUNCIONARIOS = text("""
+    SELECT f.cedula, MIN(p.id) AS personal_id
+    FROM asistencias.funcionarios f
+    INNER JOIN ficha_personal.personal p ON p.ci_nro = f.cedula
+    GROUP BY f.cedula
+    ORDER BY f.cedula
+    LIMIT :cantidad
+""")
+
+
+def obtener_funcionarios(cantidad, crear):
+    """Lista de (cedula, personal_id). Con crear, agrega en funcionarios y personal los que falten."""
+    funcionarios = [tuple(fila) for fila in db.session.execute(_SQL_FUNCIONARIOS, {'cantidad': cantidad})]
+    faltan = cantidad - len(funcionarios)
+    if faltan <= 0 or not crear:
+        return funcionarios
+
+    existentes = {cedula for cedula, _ in funcionarios}
+    existentes.update(db.session.execute(text("SELECT cedula FROM asistencias.funcionarios")).scalars())
+    existentes.update(db.session.execute(text("SELECT ci_nro FROM ficha_personal.personal")).scalars())
+    nuevas = []
+    numero = CEDULA_BASE_SEMILLA
+    while len(nuevas) < faltan:
+        if str(numero) not in existentes:
+            nuevas.append(str(numero))
+        numero += 1
+
+    db.session.execute(insert(Usuario), [
+        {'cedula': cedula, 'nombre': 'Funcionario', 'apellido': f'Semilla {cedula}', 'tipousuario': None}
+        for cedula in nuevas])
+    db.session.execute(text("INSERT INTO ficha_personal.personal (ci_nro) VALUES (:ci_nro)"),
+                       [{'ci_nro': cedula} for cedula in nuevas])
+    db.session.commit()
+    print(f"✓ Creados {len(nuevas)} funcionarios de semilla")
+    return [tuple(fila) for fila in db.session.execute(_SQL_FUNCIONARIOS, {'cantidad': cantidad})]
+
+
+def _dias_habiles(fecha_inicio, fecha_fin):
+    dias = []
+    fecha = fecha_inicio
+    while fecha <= fecha_fin:
+        if fecha.weekday() < 5:
+            dias.append(fecha)
+        fecha += timedelta(days=1)
+    return dias
+
+
+def generar_datos(argumentos, funcionarios, ocupados, casos, escenarios):
+    """Genera por funcionario y dia hábil los formularios y sus marcaciones, contando casos y escenarios.
+       Va entregando lotes (formularios, marcaciones) de a lo sumo --lote marcaciones."""
+    azar = random.Random(argumentos.semilla)
+    probabilidad = min(argumentos.salidas_por_mes / DIAS_HABILES_POR_MES, 1.0)
+    dias = _dias_habiles(argumentos.desde, argumentos.hasta)
+    formularios, marcaciones = [], []
+
+    for cedula, personal_id in funcionarios:
+        for fecha in dias:
+            if azar.random() >= probabilidad or (cedula, fecha) in ocupados:
+                continue
+
+            # Horarios intermedios entre 08:00 y 13:00, con 30 a 90 minutos de ausencia
+            dummy_salida = datetime.combine(fecha, time(8, 0)) + timedelta(minutes=azar.randint(0, 300))
+            dummy_llegada = dummy_salida + timedelta(minutes=azar.randint(30, 90))
+            tipo_caso = azar.choices([1, 2, 3], weights=argumentos.mezcla)[0]
+
+            formularios.append((cedula, fecha, dummy_salida.time(), dummy_llegada.time(),
+                                azar.choice(MOTIVOS), azar.choice(DESTINOS), True,
+                                datetime.combine(fecha, time(7, 0))))
+            horas, escenario = generar_marcaciones_para_formulario(
+                azar, dummy_salida, dummy_llegada, tipo_caso, argumentos.variaciones)
+            alta = datetime.combine(fecha, time(20, 0))
+            marcaciones.extend((personal_id, hora, alta, alta, USUARIO_SEMILLA, USUARIO_SEMILLA, hora, 'PEN', 1)
+                               for hora in horas)
+
+            if argumentos.detalle:
+                print(f"CASO {tipo_caso} ({len(horas)} marc) | {cedula:<12} | {fecha} | {escenario}")
+            casos[tipo_caso] += 1
+            escenarios[escenario] += 1
+
+            if len(marcaciones) >= argumentos.lote:
+                yield formularios, marcaciones
+                formularios, marcaciones = [], []
+
+    if formularios:
+        yield formularios, marcaciones
+
+
+def _valor_copy(valor):
+    if valor is None:
+        return '\\N'
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    return str(valor)
+
+
+def _copiar(conexion, tabla, columnas, filas):
+    """COPY ... FROM STDIN con psycopg2, dentro de la transacción de la sesión."""
+    buffer = io.StringIO()
+    for fila in filas:
+        buffer.write('\t'.join(map(_valor_copy, fila)))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor = conexion.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {tabla} ({', '.join(columnas)}) FROM STDIN", buffer)
+    finally:
+        cursor.close()
+
+
+def _insertar_varios(conexion, tabla, columnas, filas):
+    sql = text(f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES ({', '.join(':' + c for c in columnas)})")
+    conexion.execute(sql, [dict(zip(columnas, fila)) for fila in filas])
+
+
+def cargar_lote(conexion, formularios, marcaciones):
+    cargar = _copiar if conexion.dialect.name == 'postgresql' else _insertar_varios
+    cargar(conexion, 'registro_intermedio.formulario_salida', COLUMNAS_FORMULARIO, formularios)
+    cargar(conexion, TABLA_MARCACIONES, COLUMNAS_MARCACION, marcaciones)
+
+
+def _formularios_existentes(funcionarios, fecha_inicio, fecha_fin):
+    consulta = text("""
+        SELECT ci_nro, fecha FROM registro_intermedio.formulario_salida
+        WHERE fecha BETWEEN :desde AND :hasta AND ci_nro IN :cedulas
+    """).bindparams(bindparam('cedulas', expanding=True))
+    return {tuple(fila) for fila in db.session.execute(consulta, {
+        'desde': fecha_inicio, 'hasta': fecha_fin, 'cedulas': [cedula for cedula, _ in funcionarios]})}
+
+
+def cargar_datos_completos(argumentos):
     with app.app_context():
         print("=" * 80)
-        print("GENERANDO DATOS DE PRUEBA - AÑO 2026")
+        print(f"GENERANDO DATOS DE PRUEBA - {argumentos.desde} a {argumentos.hasta} (semilla {argumentos.semilla})")
         print("=" * 80)
         print()
-        
-        # Limpiar TODOS los datos anteriores
-        limpiar_datos_anteriores()
-        
-        # Obtener 20 funcionarios
-        funcionarios = Usuario.query.limit(20).all()
-        
+
+        if not argumentos.conservar:
+            limpiar_datos_anteriores()
+
+        funcionarios = obtener_funcionarios(argumentos.funcionarios, argumentos.crear_funcionarios)
         if not funcionarios:
-            print("❌ ERROR: No hay funcionarios en la BD")
+            print("❌ ERROR: No hay funcionarios con ficha en ficha_personal.personal")
             return
-        
-        print(f"✓ Encontrados {len(funcionarios)} funcionarios para generar datos")
-        print()
-        
-        # Motivos y destinos
-        motivos = [
-            "Consulta médica", "Trámites bancarios", "IPS", 
-            "Gestión judicial", "Reunión externa", "Trámite personal",
-            "Consulta odontológica", "Retiro de documentos",
-            "Trámites municipales", "Gestión administrativa"
-        ]
-        
-        destinos = [
-            "Hospital de Clínicas", "Banco Nacional", "IPS Central",
-            "Palacio de Justicia", "Municipalidad", "SET",
-            "ANDE", "ESSAP", "Registro Civil", "Policía Nacional"
-        ]
-        
-        # Generar datos SOLO para 2026 (desde 01-01-2026 hasta hoy)
-        fecha_inicio = datetime(2026, 1, 1).date()
-        fecha_fin = datetime.now().date()
-        
-        print(f"📅 Generando datos desde {fecha_inicio} hasta {fecha_fin}")
+        if len(funcionarios) < argumentos.funcionarios:
+            print(f"⚠️  Solo hay {len(funcionarios)} funcionarios con ficha (use --crear-funcionarios)")
+        print(f"✓ {len(funcionarios)} funcionarios para generar datos")
         print()
-        
+
+        ocupados = _formularios_existentes(funcionarios, argumentos.desde, argumentos.hasta) \
+            if argumentos.conservar else set()
+
+        inicio = reloj.time()
         contador_formularios = 0
         contador_marcaciones = 0
-        
-        casos_tipo1 = 0
-        casos_tipo2 = 0
-        casos_tipo3 = 0
-        
+        casos = Counter()
+        escenarios = Counter()
+
         try:
-            for func in funcionarios:
-                cantidad_salidas = random.randint(3, 6)
-                fechas_salida = []
-                
-                for _ in range(cantidad_salidas):
-                    dias_diff = (fecha_fin - fecha_inicio).days
-                    fecha_random = fecha_inicio + timedelta(days=random.randint(0, dias_diff))
-                    
-                    # Evitar fines de semana
-                    while fecha_random.weekday() >= 5:
-                        fecha_random += timedelta(days=1)
-                        if fecha_random > fecha_fin:
-                            fecha_random -= timedelta(days=2)
-                            
-                    fechas_salida.append(fecha_random)
-                
-                for fecha in fechas_salida:
-                    existe_form = FormularioSalida.query.filter_by(
-                        ci_nro=func.cedula,
-                        fecha=fecha
-                    ).first()
-                    
-                    if existe_form:
-                        continue
-                    
-                    # Horarios intermedios entre 08:00 y 14:00
-                    hora_inicio_laboral = time(8, 0)
-                    minutos_desde_inicio = random.randint(0, 300)  # 0-5 horas
-                    dummy_salida = datetime.combine(fecha, hora_inicio_laboral) + timedelta(minutes=minutos_desde_inicio)
-                    hora_salida_est = dummy_salida.time()
-                    
-                    minutos_ausencia = random.randint(30, 90)
-                    hora_llegada_est = (dummy_salida + timedelta(minutes=minutos_ausencia)).time()
-                    
-                    # Distribución: 20% caso1, 30% caso2, 50% caso3
-                    tipo_caso = random.choices([1, 2, 3], weights=[20, 30, 50])[0]
-                    
-                    if tipo_caso == 1:
-                        casos_tipo1 += 1
-                    elif tipo_caso == 2:
-                        casos_tipo2 += 1
-                    else:
-                        casos_tipo3 += 1
-                    
-                    nuevo_form = FormularioSalida(
-                        ci_nro=func.cedula,
-                        fecha=fecha,
-                        hora_salida_estipulada=hora_salida_est,
-                        hora_llegada_estipulada=hora_llegada_est,
-                        motivo=random.choice(motivos),
-                        destino=random.choice(destinos),
-                        estado=True,
-                        fecha_creacion=datetime.combine(fecha, time(7, 0))
-                    )
-                    
-                    db.session.add(nuevo_form)
-                    contador_formularios += 1
-                    
-                    marcaciones, escenario = generar_marcaciones_para_formulario(
-                        hora_salida_est, 
-                        hora_llegada_est, 
-                        fecha,
-                        tipo_caso
-                    )
-                    
-                    for hora_marc in marcaciones:
-                        insertar_marcacion_reloj(func.cedula, fecha, hora_marc)
-                        contador_marcaciones += 1
-                    
-                    emoji_caso = {
-                        1: '⭕',
-                        2: '🔶',
-                        3: '✅'
-                    }
-                    
-                    nombre_completo = f"{func.nombre} {func.apellido}"
-                    cant_marc = len(marcaciones)
-                    print(f"{emoji_caso[tipo_caso]} CASO {tipo_caso} ({cant_marc} marc) | {nombre_completo[:25]:<25} | {fecha} | {escenario}")
-            
+            conexion = db.session.connection()
+            for formularios, marcaciones in generar_datos(argumentos, funcionarios, ocupados, casos, escenarios):
+                cargar_lote(conexion, formularios, marcaciones)
+                contador_formularios += len(formularios)
+                contador_marcaciones += len(marcaciones)
+                print(f"   … {contador_formularios} formularios, {contador_marcaciones} marcaciones "
+                      f"({reloj.time() - inicio:.1f} s)")
+
             db.session.commit()
-            print("\n" + "=" * 80)
-            print(f"✓ DATOS GENERADOS EXITOSAMENTE")
-            print(f"✓ Formularios creados: {contador_formularios}")
-            print(f"✓ Marcaciones insertadas: {contador_marcaciones}")
-            print()
-            print(f"📊 Distribución por casos:")
-            if contador_formularios > 0:
-                print(f"   ⭕ Caso 1 (2 marc - sin intermedias):    {casos_tipo1} ({casos_tipo1/contador_formularios*100:.1f}%)")
-                print(f"   🔶 Caso 2 (3 marc - solo una):          {casos_tipo2} ({casos_tipo2/contador_formularios*100:.1f}%)")
-                print(f"   ✅ Caso 3 (4 marc - ambas):             {casos_tipo3} ({casos_tipo3/contador_formularios*100:.1f}%)")
-            print()
-            print(f"🎨 Estados esperados:")
-            print(f"   🟢 Correcto: ≤ 15 minutos")
-            print(f"   🟡 Alerta: > 15 min y ≤ 60 min")
-            print(f"   🔴 Falta: > 60 min o sin marcar")
-            print("=" * 80)
-            
         except Exception as e:
             db.session.rollback()
             print(f"\n❌ ERROR al guardar: {str(e)}")
             import traceback
             traceback.print_exc()
+            return
+
+        if db.engine.dialect.name == 'postgresql':
+            with db.engine.connect() as conexion:
+                conexion.execute(text("ANALYZE registro_intermedio.formulario_salida"))
+                conexion.execute(text(f"ANALYZE {TABLA_MARCACIONES}"))
+                conexion.commit()
+
+        print("\n" + "=" * 80)
+        print(f"✓ DATOS GENERADOS EXITOSAMENTE en {reloj.time() - inicio:.1f} s")
+        print(f"✓ Formularios creados: {contador_formularios}")
+        print(f"✓ Marcaciones insertadas: {contador_marcaciones}")
+        print()
+        print(f"📊 Distribución por casos:")
+        if contador_formularios > 0:
+            print(f"   ⭕ Caso 1 (2 marc - sin intermedias):    {casos[1]} ({casos[1]/contador_formularios*100:.1f}%)")
+            print(f"   🔶 Caso 2 (3 marc - solo una):          {casos[2]} ({casos[2]/contador_formularios*100:.1f}%)")
+            print(f"   ✅ Caso 3 (4 marc - ambas):             {casos[3]} ({casos[3]/contador_formularios*100:.1f}%)")
+            print()
+            print(f"📋 Escenarios:")
+            for escenario, cantidad in sorted(escenarios.items()):
+                print(f"   {escenario:<32} {cantidad}")
+        print()
+        print(f"🎨 Estados esperados:")
+        print(f"   🟢 Correcto: ≤ 15 minutos")
+        print(f"   🟡 Alerta: > 15 min y ≤ 60 min")
+        print(f"   🔴 Falta: > 60 min o sin marcar")
+        print("Si se usan resultados materializados, correr refrescar_resultados.py")
+        print("=" * 80)
+
 
 if __name__ == '__main__':
-    cargar_datos_completos()
\ No newline at end of file
+    cargar_datos_completos(parser.parse_args())
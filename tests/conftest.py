@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+import types
+import pytest
+
+#Las pruebas no usan el config.py de la instalación (apunta a la base real): antes de importar la app
+#se registra un módulo config propio. Correr desde la raíz del repositorio con:
+#   python -m pytest -q
+#Las pruebas de la base (test_paridad_sql.py) necesitan PostgreSQL: se saltean salvo que
+#MARCACIONES_PRUEBAS_POSTGRES tenga la URL de una base vacía de pruebas (nunca la real), por ejemplo
+#   MARCACIONES_PRUEBAS_POSTGRES=postgresql+psycopg2://usuario@localhost/marcaciones_pruebas python -m pytest -q
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class ConfigPruebas:
+    SECRET_KEY = 'pruebas'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('MARCACIONES_PRUEBAS_POSTGRES', 'sqlite://')
+    WTF_CSRF_ENABLED = False
+    METRICAS = False
+
+
+_config = types.ModuleType('config')
+_config.Config = ConfigPruebas
+sys.modules['config'] = _config
+
+
+@pytest.fixture
+def cliente_con_sesion(monkeypatch):
+    """Retorna una función (cedula, tipousuario) -> cliente de pruebas con la sesión iniciada. La identidad
+       se carga en la cache de app/identidad.py, así la petición no consulta la tabla de usuarios."""
+    from app import app, identidad
+
+    def iniciar(cedula, tipousuario):
+        monkeypatch.setitem(identidad._identidades, cedula,
+                            (time.time(), identidad.Identidad(cedula, 'Nombre', 'Apellido', tipousuario)))
+        cliente = app.test_client()
+        with cliente.session_transaction() as sesion:
+            sesion['_user_id'] = cedula
+            sesion['_fresh'] = True
+        return cliente
+    return iniciar
@@ -0,0 +1,45 @@
+import json
+import os
+import time
+import pytest
+from app import app
+from app import cache_reportes
+from app.cache_reportes import CacheDisco, obtener_cache
+
+LLAVE = ('2025-01-01', '2025-01-31', '')
+REPORTE = ([{'nombre_completo': 'Ana Núñez', 'ci_nro': '123', 'hora_salida_cercana': '-', 'estado_salida': 'no_marco'}],
+           [{'nombre': 'Ana Núñez', 'ci_nro': '123', 'total': 1, 'cumplio': 0, 'alerta': 0, 'incumplio': 2}])
+
+
+def test_disco_guarda_json_y_lo_lee_desde_otro_worker(tmp_path):
+    directorio = str(tmp_path / 'cache')
+    CacheDisco(directorio).guardar(LLAVE, REPORTE, time.time())
+    (nombre,) = [nombre for nombre in os.listdir(directorio) if nombre.endswith('.json')]
+    with open(os.path.join(directorio, nombre), encoding='utf-8') as archivo:
+        assert json.load(archivo) == json.loads(json.dumps(REPORTE))
+    assert os.stat(directorio).st_mode & 0o777 == 0o700
+    #Otra instancia (sin la LRU en memoria) lee el archivo.
+    assert CacheDisco(directorio).obtener(LLAVE) == REPORTE
+
+
+def test_disco_rechaza_un_directorio_con_escritura_ajena(tmp_path):
+    directorio = tmp_path / 'compartido'
+    directorio.mkdir()
+    os.chmod(directorio, 0o777)
+    with pytest.raises(PermissionError):
+        CacheDisco(str(directorio))
+
+
+def test_disco_rechaza_un_enlace(tmp_path):
+    (tmp_path / 'real').mkdir(mode=0o700)
+    os.symlink(tmp_path / 'real', tmp_path / 'enlace')
+    with pytest.raises(PermissionError):
+        CacheDisco(str(tmp_path / 'enlace'))
+
+
+def test_disco_necesita_directorio(monkeypatch):
+    monkeypatch.setitem(app.config, 'CACHE_REPORTES', 'disco')
+    monkeypatch.delitem(app.config, 'CACHE_REPORTES_DIR', raising=False)
+    monkeypatch.setattr(cache_reportes, '_cache', None)
+    with pytest.raises(RuntimeError):
+        obtener_cache()
@@ -0,0 +1,204 @@
+import random
+from datetime import date, datetime, time, timedelta
+import pytest
+from app.motor_vectorizado import emparejar_lote
+from app.services import emparejar_por_dia, TOLERANCIA_ALERTA, TOLERANCIA_INCUMPLIMIENTO
+
+#Regresión del emparejamiento: los dos motores de Python (emparejar_por_dia y emparejar_lote) deben dar
+#exactamente lo mismo que el procesamiento original, fila por fila con objetos time y un conjunto
+#horas_usadas de todo el reporte. La referencia de abajo es ese código, sin cambios de lógica.
+
+
+def _referencia_hora_cercana(hora_estipulada, lista_marcaciones, rango_minutos=60):
+    if not hora_estipulada or not lista_marcaciones:
+        return None
+    lista_limpia = [h for h in lista_marcaciones if h is not None]
+    if len(lista_limpia) <= 2:
+        return None
+    lista_procesada = sorted(lista_limpia)[1:-1]
+
+    dummy_date = datetime(2000, 1, 1)
+    target_dt = datetime.combine(dummy_date, hora_estipulada)
+    mejor_match = None
+    min_delta_seconds = rango_minutos * 60
+    for marcacion in lista_procesada:
+        diff_seconds = abs((datetime.combine(dummy_date, marcacion) - target_dt).total_seconds())
+        if diff_seconds <= min_delta_seconds:
+            min_delta_seconds = diff_seconds
+            mejor_match = marcacion
+    return mejor_match
+
+
+def _referencia_estado(hora_estipulada, hora_marcacion, es_llegada=False):
+    if not hora_marcacion:
+        return 'no_marco'
+    dummy = date(2000, 1, 1)
+    dt_est = datetime.combine(dummy, hora_estipulada)
+    dt_marcacion = datetime.combine(dummy, hora_marcacion)
+    if es_llegada and dt_marcacion < dt_est:
+        return 'cumplio'
+    diferencia_minutos = abs((dt_marcacion - dt_est).total_seconds()) / 60
+    if diferencia_minutos >= TOLERANCIA_INCUMPLIMIENTO:
+        return 'incumplio'
+    elif diferencia_minutos >= TOLERANCIA_ALERTA:
+        return 'alerta'
+    return 'cumplio'
+
+
+def _referencia_hora_unica(salida, llegada, salida_cercana, llegada_cercana, horas_usadas, cedula, fecha):
+    dummy = date(2000, 1, 1)
+    diff_salida = abs((datetime.combine(dummy, salida_cercana) - datetime.combine(dummy, salida)).total_seconds()) \
+        if salida_cercana else float('inf')
+    diff_llegada = abs((datetime.combine(dummy, llegada_cercana) - datetime.combine(dummy, llegada)).total_seconds()) \
+        if llegada_cercana else float('inf')
+
+    estado_salida = estado_llegada = 'no_marco'
+    if diff_salida <= diff_llegada:
+        llegada_cercana = None
+        estado_salida = _referencia_estado(salida, salida_cercana)
+    else:
+        salida_cercana = None
+        estado_llegada = _referencia_estado(llegada, llegada_cercana, es_llegada=True)
+    horas_usadas.add((cedula, fecha, salida_cercana if salida_cercana else llegada_cercana))
+    return salida_cercana, llegada_cercana, estado_salida, estado_llegada
+
+
+def _referencia_procesar(cedula, fecha, salida, llegada, lista_horas, horas_usadas):
+    horas_disponibles = [hora for hora in lista_horas if (cedula, fecha, hora) not in horas_usadas]
+    if len(horas_disponibles) == 3:
+        return _referencia_hora_unica(salida, llegada, _referencia_hora_cercana(salida, horas_disponibles),
+                                      _referencia_hora_cercana(llegada, horas_disponibles),
+                                      horas_usadas, cedula, fecha)
+
+    salida_cercana = _referencia_hora_cercana(salida, horas_disponibles)
+    estado_salida = 'no_marco'
+    if salida_cercana:
+        horas_usadas.add((cedula, fecha, salida_cercana))
+        estado_salida = _referencia_estado(salida, salida_cercana)
+        horas_disponibles.remove(salida_cercana)
+
+    llegada_cercana = _referencia_hora_cercana(llegada, horas_disponibles)
+    estado_llegada = 'no_marco'
+    if llegada_cercana:
+        horas_usadas.add((cedula, fecha, llegada_cercana))
+        estado_llegada = _referencia_estado(llegada, llegada_cercana, es_llegada=True)
+    return salida_cercana, llegada_cercana, estado_salida, estado_llegada
+
+
+def _a_time(segundos):
+    return time(segundos // 3600, segundos % 3600 // 60, segundos % 60)
+
+
+def _a_segundos(hora):
+    return None if hora is None else hora.hour * 3600 + hora.minute * 60 + hora.second
+
+
+def emparejar_referencia(formularios, marcas_por_dia):
+    """formularios: (cedula, fecha, salida, llegada) en segundos, en el orden del reporte."""
+    horas_usadas = set()
+    resultados = []
+    for cedula, fecha, salida, llegada in formularios:
+        lista_horas = [_a_time(marca) for marca in marcas_por_dia.get((cedula, fecha), ())]
+        salida_cercana, llegada_cercana, estado_salida, estado_llegada = _referencia_procesar(
+            cedula, fecha, _a_time(salida), _a_time(llegada), lista_horas, horas_usadas)
+        resultados.append((_a_segundos(salida_cercana), _a_segundos(llegada_cercana), estado_salida, estado_llegada))
+    return resultados
+
+
+def _filas_motor(formularios, marcas_por_dia):
+    return [((cedula, fecha), salida, llegada, marcas_por_dia.get((cedula, fecha), ()))
+            for cedula, fecha, salida, llegada in formularios]
+
+
+def _comparar(formularios, marcas_por_dia):
+    esperado = emparejar_referencia(formularios, marcas_por_dia)
+    filas = _filas_motor(formularios, marcas_por_dia)
+    assert list(emparejar_por_dia(filas)) == esperado
+    assert emparejar_lote(filas) == esperado
+
+
+def _marcas_al_azar(azar, estipuladas, minutos_exactos):
+    """Marcas de un dia en segundos: sueltas, cerca de las estipuladas (con distancias límite de 15 y 60
+       minutos), duplicadas, y a veces redondeadas al minuto. Se recortan entre la 01:00 y las 23:00: una
+       estipulada más o menos la distancia puede quedar fuera del dia, y _a_time no la podría representar."""
+    marcas = [azar.randint(6 * 3600, 20 * 3600) for _ in range(azar.choice([0, 1, 2, 2, 3, 3, 4, 5, 6, 8]))]
+    for estipulada in estipuladas:
+        if azar.random() < 0.7:
+            marcas.append(estipulada + azar.choice([0, 1, -1, 59, 600, -600, 899, 900, -900, 901,
+                                                    1800, -1800, 3599, 3600, -3600, 3601, azar.randint(-5400, 5400)]))
+    if marcas and azar.random() < 0.3:
+        marcas.extend(azar.choices(marcas, k=azar.randint(1, 2)))
+    if minutos_exactos:
+        marcas = [marca - marca % 60 for marca in marcas]
+    return tuple(sorted(min(max(marca, 3600), 23 * 3600) for marca in marcas))
+
+
+def generar_reporte(azar, cedulas=6, dias=20):
+    """Formularios de varias cedulas en varios dias, en el orden del reporte
+       (fecha desc, hora_salida_estipulada, id), y las marcas de cada (cedula, fecha)."""
+    fecha_base = date(2025, 3, 31)
+    formularios = []
+    marcas_por_dia = {}
+    id_salida = 0
+    for numero_dia in range(dias):
+        fecha = fecha_base - timedelta(days=numero_dia)
+        for numero in range(cedulas):
+            cedula = str(1000000 + numero)
+            estipuladas = []
+            for _ in range(azar.choice([0, 1, 1, 1, 2, 2, 3, 4])):
+                salida = azar.randint(8 * 60, 15 * 60) * 60 + azar.choice([0, 0, 0, azar.randint(1, 59)])
+                llegada = salida + azar.randint(5, 180) * 60
+                id_salida += 1
+                formularios.append((fecha, salida, id_salida, cedula, llegada))
+                estipuladas += [salida, llegada]
+            if azar.random() < 0.9:
+                marcas_por_dia[(cedula, fecha)] = _marcas_al_azar(azar, estipuladas, azar.random() < 0.5)
+
+    formularios.sort(key=lambda f: (-f[0].toordinal(), f[1], f[2]))
+    return [(cedula, fecha, salida, llegada) for fecha, salida, _, cedula, llegada in formularios], marcas_por_dia
+
+
+@pytest.mark.parametrize('semilla', range(40))
+def test_motores_igual_que_el_original_en_reportes_al_azar(semilla):
+    _comparar(*generar_reporte(random.Random(semilla)))
+
+
+FECHA = date(2025, 3, 3)
+
+
+def _dia(formularios, marcas):
+    return [('1', FECHA, salida, llegada) for salida, llegada in formularios], {('1', FECHA): tuple(sorted(marcas))}
+
+
+def test_empate_gana_la_marca_posterior():
+    h = 3600
+    _comparar(*_dia([(10 * h, 12 * h)], [7 * h, 10 * h - 600, 10 * h + 600, 12 * h - 300, 12 * h + 300, 17 * h]))
+
+
+def test_marcas_duplicadas():
+    h = 3600
+    #La llegada puede usar otra copia de la hora que tomó la salida; el formulario siguiente ya no.
+    _comparar(*_dia([(10 * h, 10 * h + 60), (10 * h + 120, 11 * h)],
+                    [7 * h, 10 * h, 10 * h, 10 * h, 10 * h + 120, 17 * h]))
+
+
+def test_exactamente_tres_marcas():
+    h = 3600
+    #Con una sola marca intermedia va a la estipulada más cercana (empate: la salida).
+    _comparar(*_dia([(10 * h, 12 * h)], [7 * h, 11 * h, 17 * h]))
+    _comparar(*_dia([(10 * h, 12 * h)], [7 * h, 11 * h + 1, 17 * h]))
+    #El segundo formulario del dia queda con tres marcas después de que el primero usa dos.
+    _comparar(*_dia([(9 * h, 10 * h), (13 * h, 14 * h)], [7 * h, 9 * h, 10 * h, 13 * h + 900, 17 * h]))
+
+
+def test_precision_de_segundos_y_limites_de_tolerancia():
+    h = 3600
+    for delta in (899, 900, 901, 3599, 3600, 3601):
+        _comparar(*_dia([(10 * h, 12 * h + 30)], [7 * h, 10 * h + delta, 12 * h + 30 - delta, 17 * h]))
+
+
+def test_varios_dias_y_cedulas_intercalados():
+    azar = random.Random(99)
+    formularios, marcas = generar_reporte(azar, cedulas=25, dias=60)
+    assert len({fecha for _, fecha, _, _ in formularios}) > 1
+    _comparar(formularios, marcas)
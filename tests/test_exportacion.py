@@ -0,0 +1,88 @@
+import csv
+from io import BytesIO, StringIO
+import openpyxl
+import pytest
+from app import services
+from app.exportacion import iterar_csv, iterar_xlsx, TAMANO_LOTE_EXPORTACION
+
+
+def _leer_csv(filas, resumen=()):
+    contenido = b''.join(iterar_csv(['motivo', 'destino', 'hora'], iter(filas), ['nombre', 'total'], list(resumen)))
+    return list(csv.reader(StringIO(contenido.decode('utf-8-sig'))))
+
+
+def test_textos_que_serian_formulas_se_neutralizan():
+    filas = _leer_csv([['=1+1', '+54 21', '-'], ['@SUM(A1)', '\tx', '-2'], ['\r=y', 'Centro', '08:00']],
+                      [['=HYPERLINK("http://x")', 3]])
+    assert filas[1:4] == [["'=1+1", "'+54 21", '-'], ["'@SUM(A1)", "'\tx", "'-2"], ["'\r=y", 'Centro', '08:00']]
+    assert filas[-1] == ['\'=HYPERLINK("http://x")', '3']
+
+
+def test_xlsx_se_abre_con_las_dos_hojas():
+    resumen = []
+
+    def filas():
+        yield ['=1+1', '<Centro & Sur>', 3]
+        yield ['con\x01control', '', 2.5]
+        for numero in range(TAMANO_LOTE_EXPORTACION + 10):
+            yield ['motivo', 'destino', numero]
+        #El resumen se completa recién después de recorrer el detalle, como en datos_exportacion.
+        resumen.append(['Ana Pérez', '1001', 2])
+
+    contenido = b''.join(iterar_xlsx(['motivo', 'destino', 'total'], filas(), ['nombre', 'ci', 'total'], resumen))
+    libro = openpyxl.load_workbook(BytesIO(contenido))
+    assert libro.sheetnames == ['Detalle', 'Resumen']
+    detalle = list(libro['Detalle'].values)
+    assert detalle[:3] == [('motivo', 'destino', 'total'), ('=1+1', '<Centro & Sur>', 3), ('concontrol', '', 2.5)]
+    assert len(detalle) == 3 + TAMANO_LOTE_EXPORTACION + 10
+    assert detalle[-1] == ('motivo', 'destino', TAMANO_LOTE_EXPORTACION + 9)
+    assert list(libro['Resumen'].values) == [('nombre', 'ci', 'total'), ('Ana Pérez', '1001', 2)]
+
+
+def _registro(fecha, estado_salida, estado_llegada):
+    return {'nombre_completo': 'Ana Pérez', 'ci_nro': '1001', 'fecha': fecha,
+            'hora_salida_estipulada': '08:00', 'hora_salida_cercana': '08:05', 'estado_salida': estado_salida,
+            'hora_llegada_estipulada': '09:00', 'hora_llegada_cercana': '-', 'estado_llegada': estado_llegada,
+            'motivo': 'Trámite', 'destino': 'Centro'}
+
+
+_REGISTROS = [_registro('05-01-2026', 'cumplio', 'no_marco'), _registro('06-01-2026', 'alerta', 'cumplio')]
+
+
+@pytest.fixture
+def reporte_sin_base(monkeypatch):
+    """Reemplaza las consultas del reporte: las rutas arman la exportación con estos registros."""
+    def reporte_admin(fecha_desde, fecha_hasta, cedula_filtro=None, resumen=None):
+        yield from _REGISTROS
+        resumen.append({'nombre': 'Ana Pérez', 'ci_nro': '1001', 'total': 2, 'cumplio': 2, 'alerta': 1,
+                        'incumplio': 1})
+
+    monkeypatch.setattr(services, 'iterar_reporte_salidas_procesado', reporte_admin)
+    monkeypatch.setattr(services, 'obtener_reporte_salidas_funcionario', lambda desde, hasta, cedula: list(_REGISTROS))
+
+
+def test_descargar_xlsx_admin(cliente_con_sesion, reporte_sin_base):
+    respuesta = cliente_con_sesion('1002', '1').get('/descargar_xlsx?fecha_desde=2026-01-01&fecha_hasta=2026-01-31')
+    assert respuesta.status_code == 200
+    assert respuesta.is_streamed
+    assert respuesta.headers['Content-Disposition'] == 'attachment; filename=Reporte_Salidas_2026-01-01_2026-01-31.xlsx'
+    libro = openpyxl.load_workbook(BytesIO(respuesta.data))
+    detalle = list(libro['Detalle'].values)
+    assert detalle[0][:3] == ('Funcionario', 'CI', 'Fecha')
+    assert detalle[1:] == [('Ana Pérez', '1001', '05-01-2026', '08:00', '08:05', 'cumplio', '09:00', '-', 'no_marco',
+                            'Trámite', 'Centro'),
+                           ('Ana Pérez', '1001', '06-01-2026', '08:00', '08:05', 'alerta', '09:00', '-', 'cumplio',
+                            'Trámite', 'Centro')]
+    assert list(libro['Resumen'].values)[1:] == [('Ana Pérez', '1001', 2, 2, 1, 1)]
+
+
+def test_descargar_csv_funcionario(cliente_con_sesion, reporte_sin_base):
+    respuesta = cliente_con_sesion('1001', '2').get(
+        '/descargar_csv?tipo=funcionario&fecha_desde=2026-01-01&fecha_hasta=2026-01-31')
+    assert respuesta.status_code == 200
+    assert respuesta.headers['Content-Disposition'] == 'attachment; filename=Mis_Salidas_1001_2026-01-01_2026-01-31.csv'
+    filas = list(csv.reader(StringIO(respuesta.data.decode('utf-8-sig'))))
+    assert filas[0][0] == 'Fecha'
+    assert [fila[0] for fila in filas[1:3]] == ['05-01-2026', '06-01-2026']
+    #El resumen del funcionario se calcula mientras se escribe el detalle.
+    assert filas[3:] == [[], ['Resumen'], services.COLUMNAS_RESUMEN, ['Nombre Apellido', '1001', '2', '2', '1', '1']]
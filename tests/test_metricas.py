@@ -0,0 +1,70 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from app import app
+from app import metricas
+
+
+@pytest.fixture
+def cliente(monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'METRICAS', True)
+    monkeypatch.setitem(metricas._ajustes, 'directorio', str(tmp_path))
+    return app.test_client()
+
+
+def test_metrics_no_se_publica_sin_token(cliente, monkeypatch):
+    monkeypatch.delitem(app.config, 'METRICAS_TOKEN', raising=False)
+    assert cliente.get('/metrics').status_code == 404
+    monkeypatch.setitem(app.config, 'METRICAS_TOKEN', '')
+    assert cliente.get('/metrics', headers={'Authorization': 'Bearer '}).status_code == 404
+
+
+def test_metrics_pide_el_token(cliente, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICAS_TOKEN', 'secreto')
+    assert cliente.get('/metrics').status_code == 403
+    assert cliente.get('/metrics', headers={'Authorization': 'Bearer otro'}).status_code == 403
+    respuesta = cliente.get('/metrics', headers={'Authorization': 'Bearer secreto'})
+    assert respuesta.status_code == 200
+    assert b'# TYPE marcaciones_formularios_emparejados_total counter' in respuesta.data
+
+
+def test_metrics_desactivadas(cliente, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICAS', False)
+    monkeypatch.setitem(app.config, 'METRICAS_TOKEN', 'secreto')
+    assert cliente.get('/metrics', headers={'Authorization': 'Bearer secreto'}).status_code == 404
+
+
+def _escribir_archivo(directorio, pid, valor):
+    (directorio / f'{pid}.json').write_text(json.dumps([['formularios_emparejados_total', [], valor]]))
+
+
+def _emparejados(cliente):
+    respuesta = cliente.get('/metrics', headers={'Authorization': 'Bearer secreto'})
+    return [linea for linea in respuesta.data.decode().splitlines()
+            if linea.startswith('marcaciones_formularios_emparejados_total ')]
+
+
+@pytest.mark.skipif(metricas.fcntl is None, reason='sin flock no se archivan los procesos terminados')
+def test_procesos_terminados_se_archivan(cliente, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'METRICAS_TOKEN', 'secreto')
+    proceso = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+    _escribir_archivo(tmp_path, int(proceso.stdout), 3)
+    (tmp_path / metricas.ARCHIVO_TERMINADOS).write_text(json.dumps([['formularios_emparejados_total', [], 4]]))
+
+    assert _emparejados(cliente) == ['marcaciones_formularios_emparejados_total 7']
+    assert sorted(archivo.name for archivo in tmp_path.glob('*.json')) == [metricas.ARCHIVO_TERMINADOS]
+    assert _emparejados(cliente) == ['marcaciones_formularios_emparejados_total 7']
+
+
+@pytest.mark.skipif(metricas.fcntl is None, reason='sin flock no se archivan los procesos terminados')
+def test_pid_reutilizado_no_pisa_los_valores_anteriores(cliente, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'METRICAS_TOKEN', 'secreto')
+    #Archivo de un proceso anterior con el mismo pid que este.
+    _escribir_archivo(tmp_path, os.getpid(), 5)
+    monkeypatch.setitem(metricas._ajustes, 'activo', True)
+    monkeypatch.setitem(metricas._estado, 'pid', None)
+    metricas.incrementar('formularios_emparejados_total', 2)
+
+    assert _emparejados(cliente) == ['marcaciones_formularios_emparejados_total 7']
@@ -0,0 +1,212 @@
+import os
+import random
+from datetime import date, datetime, time, timedelta
+import pytest
+from sqlalchemy import text
+from app import app, db
+from app.marcaciones import parsear_hora
+from app.migraciones import aplicar_migraciones
+from app.models import FormularioSalida, MarcacionIntermediaGeneral, Usuario, emparejar_dias_en_base
+from app.services import emparejar_por_dia, _emparejar_formularios
+
+#Paridad del emparejamiento en la base (MOTOR_EMPAREJAMIENTO = 'sql', funciones de la migración 3) con el
+#motor de Python. Necesita PostgreSQL: ver MARCACIONES_PRUEBAS_POSTGRES en conftest.py. Los datos de cada
+#prueba se cargan en la sesión y se descartan con rollback; lo único que queda en la base de pruebas son
+#los esquemas, las tablas y las funciones.
+
+pytestmark = pytest.mark.skipif(not os.environ.get('MARCACIONES_PRUEBAS_POSTGRES'),
+                                reason='sin MARCACIONES_PRUEBAS_POSTGRES (base PostgreSQL de pruebas)')
+
+_SQL_DIA = text("""
+    SELECT hora_salida, hora_llegada, estado_salida, estado_llegada
+    FROM registro_intermedio.emparejar_dia(CAST(:marcas AS integer[]), CAST(:salidas AS integer[]),
+                                           CAST(:llegadas AS integer[]))
+    ORDER BY orden
+""")
+_SQL_HORAS = text("""
+    SELECT registro_intermedio.parsear_hora(t) FROM unnest(CAST(:textos AS varchar[])) WITH ORDINALITY AS u(t, i) ORDER BY i
+""")
+
+#Fechas lejos de cualquier dato cargado en la base de pruebas.
+FECHA = date(1999, 3, 31)
+H = 3600
+
+
+@pytest.fixture(scope='module')
+def base():
+    """Esquemas de los otros sistemas (solo las columnas que se leen), tablas del modelo y migraciones."""
+    with app.app_context():
+        with db.engine.begin() as conexion:
+            for esquema in ('asistencias', 'registro_intermedio', 'control_asistencia', 'ficha_personal'):
+                conexion.execute(text(f'CREATE SCHEMA IF NOT EXISTS {esquema}'))
+            conexion.execute(text('CREATE TABLE IF NOT EXISTS ficha_personal.personal '
+                                  '(id serial PRIMARY KEY, ci_nro varchar(20))'))
+            conexion.execute(text("""CREATE TABLE IF NOT EXISTS control_asistencia.registro_entrada_salida
+                                     (id serial PRIMARY KEY, personal_id integer, registrado timestamp,
+                                      registrado_modificado timestamp, fecha_modificacion timestamp DEFAULT now())"""))
+        db.create_all()
+        aplicar_migraciones()
+        yield
+        db.session.remove()
+
+
+@pytest.fixture
+def sesion(base):
+    with app.app_context():
+        yield db.session
+        db.session.rollback()
+
+
+def _texto_al_azar(azar):
+    if azar.random() < 0.5:
+        return f"{azar.randint(0, 30):0{azar.choice([1, 2])}d}:{azar.randint(0, 70):02d}" + \
+            (f":{azar.randint(0, 70):02d}" if azar.random() < 0.5 else '')
+    return ''.join(azar.choice('0123456789:x ') for _ in range(azar.randint(0, 9)))
+
+
+def _dia_al_azar(azar):
+    """Marcas y formularios de un dia, con horas repetidas, marcas cerca de las estipuladas y
+       casos límite de distancia (exactamente 15 y 60 minutos, empates)."""
+    salidas = sorted(azar.randint(8 * 60, 13 * 60) * 60 for _ in range(azar.choice([1, 1, 2, 3, 4])))
+    llegadas = [salida + azar.randint(5, 150) * 60 for salida in salidas]
+
+    marcas = [azar.randint(7 * H, 16 * H) for _ in range(azar.choice([0, 1, 2, 3, 3, 4, 5, 6, 8, 12]))]
+    for estipulada in salidas + llegadas:
+        if azar.random() < 0.6:
+            marcas.append(estipulada + azar.choice([0, 60, -60, 899, 900, -900, 3599, 3600, 3601, -3600, 1800, -1800]))
+    if marcas and azar.random() < 0.3:
+        marcas.append(azar.choice(marcas))
+    if azar.random() < 0.5:
+        marcas = [marca - marca % 60 for marca in marcas]
+    return sorted(min(max(marca, 0), 86399) for marca in marcas), salidas, llegadas
+
+
+def test_parsear_hora_igual_en_sql(sesion):
+    azar = random.Random(0)
+    textos = ['', '8:5', '08:05', '23:59:59', '24:00', '7:60', '08:05:', '08:05:7', '08:5:07', ' 8:05', '٠٨:٠٥']
+    textos += [_texto_al_azar(azar) for _ in range(2000)]
+    assert list(sesion.execute(_SQL_HORAS, {'textos': textos}).scalars()) == [parsear_hora(t) for t in textos]
+
+
+@pytest.mark.parametrize('semilla', range(4))
+def test_emparejar_dia_igual_en_sql(sesion, semilla):
+    azar = random.Random(semilla)
+    for _ in range(500):
+        marcas, salidas, llegadas = _dia_al_azar(azar)
+        python = list(emparejar_por_dia([(('ci', None), salida, llegada, marcas)
+                                          for salida, llegada in zip(salidas, llegadas)]))
+        sql = [tuple(fila) for fila in sesion.execute(_SQL_DIA, {
+            'marcas': marcas, 'salidas': salidas, 'llegadas': llegadas})]
+        assert sql == python, (marcas, salidas, llegadas)
+
+
+def _a_time(segundos):
+    return time(segundos // 3600, segundos % 3600 // 60, segundos % 60)
+
+
+def _cargar(sesion, dias):
+    """dias: {(ci_nro, fecha): ([(salida, llegada), ...], [marcas])} en segundos. Carga usuarios, formularios
+       y marcaciones (en la tabla del reloj y en la vista, a lo sumo diez por dia) y retorna los id_salida
+       de cada dia en el orden en que se cargaron."""
+    ids = {}
+    personal = {}
+    for (ci_nro, fecha), (formularios, marcas) in dias.items():
+        if ci_nro not in personal:
+            sesion.add(Usuario(cedula=ci_nro, nombre='N', apellido='A', tipousuario='U'))
+            personal[ci_nro] = sesion.execute(text('INSERT INTO ficha_personal.personal (ci_nro) VALUES (:ci_nro) '
+                                                   'RETURNING id'), {'ci_nro': ci_nro}).scalar()
+        nuevos = [FormularioSalida(ci_nro=ci_nro, fecha=fecha, hora_salida_estipulada=_a_time(salida),
+                                   hora_llegada_estipulada=_a_time(llegada), motivo='m', destino='d', estado=True,
+                                   fecha_creacion=datetime(1999, 1, 1))
+                  for salida, llegada in formularios]
+        sesion.add_all(nuevos)
+        sesion.flush()
+        ids[(ci_nro, fecha)] = [formulario.id_salida for formulario in nuevos]
+        if marcas:
+            assert len(marcas) <= 10
+            sesion.add(MarcacionIntermediaGeneral(ci_nro=ci_nro, fecha_marcacion=fecha, nombre='N', apellido='A', **{
+                f'hora_marcacion_{i}': _a_time(marca).strftime('%H:%M:%S') for i, marca in enumerate(marcas, 1)}))
+            sesion.execute(text('INSERT INTO control_asistencia.registro_entrada_salida (personal_id, registrado) '
+                                'VALUES (:personal_id, :registrado)'),
+                           [{'personal_id': personal[ci_nro], 'registrado': datetime.combine(fecha, _a_time(marca))}
+                            for marca in marcas])
+    sesion.flush()
+    return ids
+
+
+def _emparejar_con_motor(sesion, fecha_desde, fecha_hasta, motor, fuente):
+    """{id_salida: resultado} del reporte del rango calculado con el motor y la fuente de marcaciones dados."""
+    app.config.update(MOTOR_EMPAREJAMIENTO=motor, FUENTE_MARCACIONES=fuente)
+    try:
+        filas = FormularioSalida.consultar_reporte_admin(fecha_desde, fecha_hasta).all()
+        return {formulario.id_salida: resultado
+                for (formulario, *_), resultado in zip(filas, _emparejar_formularios(filas))}
+    finally:
+        app.config.pop('MOTOR_EMPAREJAMIENTO')
+        app.config.pop('FUENTE_MARCACIONES')
+
+
+def _dias_al_azar(azar, cedulas, dias):
+    """Formularios y marcas de varias cedulas en varios dias: duplicadas, exactamente tres marcas,
+       precisión de segundos y dias sin marcaciones."""
+    resultado = {}
+    for numero_dia in range(dias):
+        fecha = FECHA - timedelta(days=numero_dia)
+        for numero in range(cedulas):
+            formularios = []
+            for _ in range(azar.choice([1, 1, 2, 2, 3])):
+                salida = azar.randint(8 * 60, 14 * 60) * 60 + azar.choice([0, 0, azar.randint(1, 59)])
+                formularios.append((salida, salida + azar.randint(5, 150) * 60))
+            marcas = [azar.randint(7 * H, 17 * H) for _ in range(azar.choice([0, 1, 2, 3, 3, 4]))]
+            for salida, llegada in formularios:
+                for estipulada in (salida, llegada):
+                    if azar.random() < 0.6:
+                        marcas.append(estipulada + azar.choice([0, 1, -1, 899, 900, -900, 3599, 3600, 3601,
+                                                                1800, -1800, azar.randint(-5400, 5400)]))
+            if marcas and azar.random() < 0.3:
+                marcas.append(azar.choice(marcas))
+            if azar.random() < 0.1:
+                marcas = []
+            resultado[(f'paridad-{numero}', fecha)] = (formularios, sorted(marcas)[:10])
+    return resultado
+
+
+@pytest.mark.parametrize('fuente', ['vista', 'tabla'])
+def test_emparejar_dias_en_base_igual_que_python_por_id_salida(sesion, fuente):
+    dias = _dias_al_azar(random.Random(7), cedulas=12, dias=15)
+    ids = _cargar(sesion, dias)
+    fecha_desde, fecha_hasta = FECHA - timedelta(days=14), FECHA
+
+    python = _emparejar_con_motor(sesion, fecha_desde, fecha_hasta, 'vectorizado', fuente)
+    sql = _emparejar_con_motor(sesion, fecha_desde, fecha_hasta, 'sql', fuente)
+    todos = [id_salida for ids_dia in ids.values() for id_salida in ids_dia]
+    assert sorted(python) == sorted(todos)
+    assert sql == python
+    #Pedido por un subconjunto de dias (consulta el rango de fechas de esos dias y sus cedulas) da lo mismo.
+    algunos = list(dias)[::5]
+    calculados = emparejar_dias_en_base(algunos)
+    assert {id_salida for dia in algunos for id_salida in ids[dia]} <= set(calculados)
+    assert calculados == {id_salida: python[id_salida] for id_salida in calculados}
+
+
+@pytest.mark.parametrize('fuente', ['vista', 'tabla'])
+def test_primera_y_ultima_marca_no_se_usan_ni_se_reutilizan(sesion, fuente):
+    recorte = ('paridad-recorte', FECHA)
+    reuso = ('paridad-reuso', FECHA)
+    tres = ('paridad-tres', FECHA)
+    ids = _cargar(sesion, {
+        #La marca de las 10:00 coincide con la salida pero es la primera del dia: se usa la de las 10:30.
+        recorte: ([(10 * H, 12 * H)], [10 * H, 10 * H + 1800, 12 * H, 17 * H]),
+        #Dos formularios iguales: el segundo ya no puede usar las marcas que tomó el primero.
+        reuso: ([(10 * H, 11 * H), (10 * H, 11 * H)], [7 * H, 10 * H, 11 * H, 17 * H]),
+        #Tres marcas: la del medio va a la estipulada más cercana y la llegada queda sin marca.
+        tres: ([(10 * H, 12 * H)], [7 * H, 10 * H + 120, 17 * H]),
+    })
+    esperado = {
+        ids[recorte][0]: (10 * H + 1800, 12 * H, 'alerta', 'cumplio'),
+        ids[reuso][0]: (10 * H, 11 * H, 'cumplio', 'cumplio'),
+        ids[reuso][1]: (None, None, 'no_marco', 'no_marco'),
+        ids[tres][0]: (10 * H + 120, None, 'cumplio', 'no_marco'),
+    }
+    assert _emparejar_con_motor(sesion, FECHA, FECHA, 'sql', fuente) == esperado
+    assert _emparejar_con_motor(sesion, FECHA, FECHA, 'vectorizado', fuente) == esperado
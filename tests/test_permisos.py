@@ -0,0 +1,16 @@
+import pytest
+
+#Las rutas de exportación de todos los funcionarios son solo para administradores. El rechazo ocurre antes de
+#validar los parámetros, así que sin parámetros un administrador llega a la redirección (302) y no al 403.
+
+
+@pytest.mark.parametrize('url', ['/descargar_pdf_funcionarios', '/descargar_csv', '/descargar_xlsx',
+                                 '/descargar_csv?tipo=admin', '/descargar_xlsx?tipo=admin'])
+def test_funcionario_no_descarga_reportes_de_todos(cliente_con_sesion, url):
+    assert cliente_con_sesion('1001', '2').get(url).status_code == 403
+    assert cliente_con_sesion('1002', '1').get(url).status_code == 302
+
+
+@pytest.mark.parametrize('url', ['/descargar_csv?tipo=funcionario', '/descargar_xlsx?tipo=funcionario'])
+def test_funcionario_descarga_su_reporte(cliente_con_sesion, url):
+    assert cliente_con_sesion('1001', '2').get(url).status_code != 403
@@ -0,0 +1,33 @@
+import re
+from pypdf import PdfReader
+from app.utils import generar_pdf_a_archivo, unir_pdfs
+
+
+def _parte(ruta, numero, filas):
+    html = ''.join(f'<tr><td>parte {numero} fila {fila}</td></tr>' for fila in range(filas))
+    assert generar_pdf_a_archivo(f'<html><body><table>{html}</table></body></html>', str(ruta))
+    return str(ruta)
+
+
+def test_unir_pdfs_conserva_paginas_y_orden(tmp_path):
+    partes = [_parte(tmp_path / f'{numero}.pdf', numero, filas) for numero, filas in enumerate((5, 120, 1))]
+    destino = tmp_path / 'unido.pdf'
+    unir_pdfs(partes, str(destino))
+
+    unido = PdfReader(str(destino), strict=True)
+    originales = [pagina.extract_text() for parte in partes for pagina in PdfReader(parte).pages]
+    assert [pagina.extract_text() for pagina in unido.pages] == originales
+    assert len(unido.pages) > len(partes)
+
+    #Cada entrada del xref apunta al comienzo de su objeto.
+    datos = destino.read_bytes()
+    inicio = int(re.search(rb'startxref\n(\d+)', datos).group(1))
+    posiciones = re.findall(rb'(\d{10}) 00000 n', datos[inicio:])
+    for numero, posicion in enumerate(posiciones, 1):
+        assert datos[int(posicion):].startswith(f'{numero} 0 obj'.encode())
+
+
+def test_unir_pdfs_sin_partes(tmp_path):
+    destino = tmp_path / 'vacio.pdf'
+    unir_pdfs([], str(destino))
+    assert len(PdfReader(str(destino)).pages) == 0
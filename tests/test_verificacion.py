@@ -0,0 +1,41 @@
+import threading
+import time
+import pytest
+from app import app
+from app import verificacion
+
+
+@pytest.fixture
+def verificacion_lenta(monkeypatch, tmp_path):
+    """verificar_password que no termina hasta que la prueba lo indica, con un solo lugar en el servidor."""
+    terminar = threading.Event()
+
+    def verificar_password(password, raw_password):
+        terminar.wait(10)
+        return password == raw_password
+
+    monkeypatch.setattr(verificacion, 'verificar_password', verificar_password)
+    monkeypatch.setitem(app.config, 'LOGIN_ADMISION_DIR', str(tmp_path))
+    monkeypatch.setitem(app.config, 'LOGIN_MAX_SERVIDOR', 1)
+    monkeypatch.setitem(app.config, 'LOGIN_TIMEOUT', 0.05)
+    yield terminar
+    terminar.set()
+
+
+@pytest.mark.skipif(verificacion.fcntl is None, reason='sin flock no hay lugares compartidos')
+def test_el_lugar_se_libera_cuando_termina_la_verificacion(verificacion_lenta):
+    with app.app_context():
+        with pytest.raises(verificacion.LoginOcupado):
+            verificacion.verificar_login('1', 'clave', 'clave')
+        futuro = verificacion._ultimos['1']
+        #Venció LOGIN_TIMEOUT pero la verificación sigue corriendo: el único lugar sigue tomado.
+        assert verificacion._tomar_lugar() is None
+
+        verificacion_lenta.set()
+        futuro.result(timeout=5)
+        #Los callbacks del futuro corren después de que result() retorna.
+        limite = time.time() + 5
+        while (lugar := verificacion._tomar_lugar()) is None and time.time() < limite:
+            time.sleep(0.01)
+        assert lugar is not None
+        verificacion._liberar_lugar(lugar)